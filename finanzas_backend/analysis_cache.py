@@ -0,0 +1,199 @@
+# analysis_cache.py
+#
+# Caché de respuestas para /api/analisis-financiero.
+# La clave es un hash de las entradas normalizadas del prompt (usuario, transacciones,
+# estado financiero, ánimo y deudas): si nada cambió desde la última consulta, se
+# devuelve el análisis anterior sin pagar otra generación de Gemini.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def build_cache_key(user_id, transactions, financial_state, mood_context, debt_context, summary=None):
+    """Hash estable (SHA-256) de las entradas del prompt, independiente del orden de las claves."""
+    normalized = json.dumps(
+        {
+            "user_id": user_id,
+            "transactions": transactions,
+            "financial_state": financial_state or {},
+            "mood": (mood_context or {}).get("predominant", "neutral"),
+            "debts": debt_context or [],
+            "summary": summary or {},
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def build_data_key(user_id, transactions, summary):
+    """
+    Huella solo de los datos del servidor (historial + resumen precalculado). Es la que guarda
+    el job de pregeneración: no conoce el estado que envía la app, así que su análisis se
+    reutiliza mientras el usuario no registre nada nuevo.
+    """
+    normalized = json.dumps(
+        {"user_id": user_id, "transactions": transactions, "summary": summary or {}},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class _SQLiteBackend:
+    """Segundo nivel opcional en disco, compartido entre reinicios y workers del mismo host."""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                " key TEXT PRIMARY KEY, user_id TEXT NOT NULL,"
+                " value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_user ON analysis_cache(user_id)")
+            self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_id, value, expires_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if row[2] < time.time():
+            self.delete(key)
+            return None
+        return row[0], row[1], row[2]
+
+    def set(self, key, user_id, value, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, user_id, value, expires_at) VALUES (?, ?, ?, ?)",
+                (key, user_id, value, expires_at),
+            )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def delete_user(self, user_id):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM analysis_cache WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+            return cursor.rowcount
+
+
+class AnalysisCache:
+    """Caché LRU con TTL en memoria y, opcionalmente, respaldo en SQLite."""
+
+    def __init__(self, max_entries=512, ttl_seconds=6 * 3600, sqlite_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (user_id, value, expires_at)
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self._disk = _SQLiteBackend(sqlite_path) if sqlite_path else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] >= now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+
+        if self._disk is not None:
+            stored = self._disk.get(key)
+            if stored is not None:
+                user_id, value, expires_at = stored
+                with self._lock:
+                    self._store(key, user_id, value, expires_at)
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, user_id, value):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store(key, user_id, value, expires_at)
+        if self._disk is not None:
+            self._disk.set(key, user_id, value, expires_at)
+
+    def invalidate_user(self, user_id):
+        """Elimina todas las entradas de un usuario (p. ej. al registrar una transacción)."""
+        with self._lock:
+            keys = self._keys_by_user.pop(user_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            removed = len(keys)
+        if self._disk is not None:
+            removed = max(removed, self._disk.delete_user(user_id))
+        if removed:
+            with self._lock:
+                self.invalidations += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "disk_backend": self._disk is not None,
+            }
+
+    # --- Internos (requieren self._lock) ---
+    def _store(self, key, user_id, value, expires_at):
+        self._entries[key] = (user_id, value, expires_at)
+        self._entries.move_to_end(key)
+        self._keys_by_user.setdefault(user_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_keys = self._keys_by_user.get(entry[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._keys_by_user[entry[0]]
+
+
+def cache_from_env():
+    """Construye la caché a partir de ANALYSIS_CACHE_MAX_ENTRIES, ANALYSIS_CACHE_TTL y ANALYSIS_CACHE_SQLITE."""
+    return AnalysisCache(
+        max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "512")),
+        ttl_seconds=int(os.getenv("ANALYSIS_CACHE_TTL", str(6 * 3600))),
+        sqlite_path=os.getenv("ANALYSIS_CACHE_SQLITE") or None,
+    )
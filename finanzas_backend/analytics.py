@@ -0,0 +1,211 @@
+# analytics.py
+#
+# Métricas deterministas del resumen financiero (/api/resumen), calculadas en local con NumPy
+# en lugar de pedírselas a Gemini sobre el JSON crudo de las transacciones.
+# Las transacciones del usuario se cargan una vez en arrays columnares (fecha, importe, tipo,
+# categoría) y todo lo demás son operaciones vectorizadas sobre ellos:
+#   - totales por categoría del mes (bincount ponderado);
+#   - gasto de la semana en curso frente a la anterior, al mismo día de la semana;
+#   - días con gasto anómalo: z-score de cada día frente a la media/desviación móvil de los
+#     ANOMALY_WINDOW_DAYS anteriores (sumas acumuladas, sin bucles);
+#   - movimientos atípicos dentro de su categoría (z-score frente al histórico de la categoría);
+#   - previsión de gasto a fin de mes por presupuesto: recta de mínimos cuadrados sobre el gasto
+#     acumulado diario del mes (ritmo lineal), comparada con el importe del presupuesto.
+
+import calendar
+import datetime
+
+import numpy as np
+
+# Días de historial que se cargan para las ventanas móviles y las comparaciones.
+HISTORY_DAYS = 120
+ANOMALY_WINDOW_DAYS = 28
+ANOMALY_Z_THRESHOLD = 2.5
+# Mínimo de días con historial para evaluar una anomalía (ventanas casi vacías dan z enormes).
+ANOMALY_MIN_HISTORY_DAYS = 14
+# Suelo de la desviación como fracción de la media: con un historial plano (std 0) un pico
+# seguiría sin marcarse, y con uno casi plano cualquier céntimo de más daría un z enorme.
+ANOMALY_MIN_STD_FRACTION = 0.25
+# Mínimo de movimientos en una categoría para marcar uno como atípico.
+OUTLIER_MIN_SAMPLES = 5
+# Con menos días transcurridos del mes, la previsión usa el ritmo medio en lugar de la recta.
+FORECAST_MIN_DAYS_FOR_FIT = 5
+
+
+class TransactionArrays:
+    """Transacciones de un usuario en columnas: fechas (datetime64[D]), importes (>0), tipo y categoría."""
+
+    def __init__(self, rows):
+        self.dates = np.array([str(r.get("transaction_date") or "")[:10] for r in rows], dtype="datetime64[D]")
+        self.amounts = np.abs(np.array([float(r.get("amount") or 0) for r in rows], dtype=np.float64))
+        self.is_expense = np.array([r.get("type") == "Gasto" for r in rows], dtype=bool)
+        self.is_income = np.array([r.get("type") == "Ingreso" for r in rows], dtype=bool)
+        self.categories, self.category_codes = np.unique(
+            np.array([r.get("category") or "Sin categoría" for r in rows], dtype=object).astype(str),
+            return_inverse=True,
+        ) if rows else (np.array([], dtype=str), np.array([], dtype=np.int64))
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def daily_expense(self, start, end):
+        """Gasto total por día en [start, end] (ambos incluidos) como array de end - start + 1 posiciones."""
+        days = int((np.datetime64(end) - np.datetime64(start)).astype(int)) + 1
+        mask = self.is_expense & (self.dates >= np.datetime64(start)) & (self.dates <= np.datetime64(end))
+        offsets = (self.dates[mask] - np.datetime64(start)).astype(np.int64)
+        return np.bincount(offsets, weights=self.amounts[mask], minlength=days)[:days]
+
+
+def _round(value):
+    return round(float(value), 2)
+
+
+def category_totals(data, start, end):
+    """Gasto por categoría en [start, end] (importe, nº de movimientos y % del total), de mayor a menor."""
+    in_range = (data.dates >= np.datetime64(start)) & (data.dates <= np.datetime64(end))
+    n = len(data.categories)
+    spent = np.bincount(data.category_codes[in_range & data.is_expense], weights=data.amounts[in_range & data.is_expense], minlength=n)
+    count = np.bincount(data.category_codes[in_range & data.is_expense], minlength=n)
+    order = np.argsort(-spent)
+    total = spent.sum()
+    return [
+        {"category": str(data.categories[i]), "spent": _round(spent[i]), "transactions": int(count[i]),
+         "share": _round(spent[i] / total * 100) if total else 0.0}
+        for i in order if spent[i] > 0
+    ]
+
+
+def weekly_comparison(data, today):
+    """Gasto de la semana en curso (hasta hoy) frente al mismo tramo de la semana anterior."""
+    week_start = today - datetime.timedelta(days=today.weekday())
+    daily = data.daily_expense(week_start - datetime.timedelta(days=7), today)
+    elapsed = today.weekday() + 1
+    current, previous = daily[7:7 + elapsed].sum(), daily[:elapsed].sum()
+    return {
+        "week_start": week_start.isoformat(),
+        "current": _round(current),
+        "previous_same_days": _round(previous),
+        "previous_full_week": _round(daily[:7].sum()),
+        "change_pct": _round((current - previous) / previous * 100) if previous else None,
+    }
+
+
+def rolling_zscore_anomalies(daily, window=ANOMALY_WINDOW_DAYS, threshold=ANOMALY_Z_THRESHOLD,
+                             min_history=ANOMALY_MIN_HISTORY_DAYS, min_std_fraction=ANOMALY_MIN_STD_FRACTION):
+    """
+    Índices y z-score de los días cuyo gasto supera en `threshold` desviaciones la media de los
+    `window` días anteriores (sin incluir el propio día). Media y varianza móviles salen de
+    sumas acumuladas, así que el coste es lineal en el número de días. La desviación nunca
+    baja de `min_std_fraction` veces la media.
+    """
+    n = len(daily)
+    if n <= min_history:
+        return np.array([], dtype=np.int64), np.array([])
+    csum = np.concatenate(([0.0], np.cumsum(daily)))
+    csum2 = np.concatenate(([0.0], np.cumsum(daily * daily)))
+    idx = np.arange(n)
+    lo = np.maximum(idx - window, 0)
+    count = idx - lo
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (csum[idx] - csum[lo]) / count
+        var = (csum2[idx] - csum2[lo]) / count - mean * mean
+        std = np.maximum(np.sqrt(np.maximum(var, 0.0)), min_std_fraction * mean)
+        z = (daily - mean) / std
+    flagged = (count >= min_history) & (std > 0) & (z >= threshold)
+    return idx[flagged], z[flagged]
+
+
+def daily_anomalies(data, today, days=HISTORY_DAYS):
+    start = today - datetime.timedelta(days=days - 1)
+    daily = data.daily_expense(start, today)
+    idx, z = rolling_zscore_anomalies(daily)
+    return [
+        {"date": (start + datetime.timedelta(days=int(i))).isoformat(), "spent": _round(daily[i]), "z_score": _round(score)}
+        for i, score in zip(idx, z)
+        if start + datetime.timedelta(days=int(i)) >= today - datetime.timedelta(days=ANOMALY_WINDOW_DAYS)
+    ]
+
+
+def category_outliers(data, since, threshold=ANOMALY_Z_THRESHOLD, min_samples=OUTLIER_MIN_SAMPLES):
+    """Gastos desde `since` que destacan dentro de su categoría (z-score frente a todo el historial cargado)."""
+    codes, amounts = data.category_codes[data.is_expense], data.amounts[data.is_expense]
+    dates = data.dates[data.is_expense]
+    n = len(data.categories)
+    count = np.bincount(codes, minlength=n)
+    mean = np.bincount(codes, weights=amounts, minlength=n) / np.maximum(count, 1)
+    var = np.bincount(codes, weights=amounts * amounts, minlength=n) / np.maximum(count, 1) - mean * mean
+    std = np.sqrt(np.maximum(var, 0.0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = (amounts - mean[codes]) / std[codes]
+    flagged = np.flatnonzero((dates >= np.datetime64(since)) & (count[codes] >= min_samples) & (std[codes] > 0) & (z >= threshold))
+    flagged = flagged[np.argsort(-z[flagged])]
+    return [
+        {"date": str(dates[i]), "category": str(data.categories[codes[i]]), "amount": _round(amounts[i]),
+         "category_mean": _round(mean[codes[i]]), "z_score": _round(z[i])}
+        for i in flagged
+    ]
+
+
+def month_end_forecast(data, budgets, today):
+    """
+    Previsión de gasto a fin de mes por presupuesto. Con al menos FORECAST_MIN_DAYS_FOR_FIT días
+    transcurridos se ajusta una recta al gasto acumulado diario de la categoría y se evalúa en
+    el último día del mes; antes, se extrapola el ritmo medio (gastado / días transcurridos).
+    """
+    month_start = today.replace(day=1)
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    elapsed = today.day
+    in_month = data.is_expense & (data.dates >= np.datetime64(month_start)) & (data.dates <= np.datetime64(today))
+    lookup = {str(c): i for i, c in enumerate(data.categories)}
+
+    # Gasto acumulado por día y categoría del mes: matriz (categorías x días transcurridos).
+    n = len(data.categories)
+    offsets = (data.dates[in_month] - np.datetime64(month_start)).astype(np.int64)
+    flat = data.category_codes[in_month] * elapsed + offsets
+    cumulative = np.cumsum(np.bincount(flat, weights=data.amounts[in_month], minlength=n * elapsed).reshape(n, elapsed), axis=1) \
+        if n else np.zeros((0, elapsed))
+    x = np.arange(1, elapsed + 1, dtype=np.float64)
+
+    forecasts = []
+    for budget in budgets:
+        category, amount = budget["category"], float(budget["amount"] or 0)
+        code = lookup.get(category)
+        series = cumulative[code] if code is not None else np.zeros(elapsed)
+        spent = series[-1] if elapsed else 0.0
+        if elapsed >= FORECAST_MIN_DAYS_FOR_FIT and spent > 0:
+            slope, intercept = np.polyfit(x, series, 1)
+            projected = max(spent, slope * days_in_month + intercept)
+        else:
+            projected = spent / elapsed * days_in_month if elapsed else 0.0
+        pct = projected / amount * 100 if amount else None
+        forecasts.append({
+            "category": category,
+            "budget": _round(amount),
+            "spent": _round(spent),
+            "projected": _round(projected),
+            "projected_pct": _round(pct) if pct is not None else None,
+            "status": "excedido" if amount and spent >= amount else "en_riesgo" if pct is not None and pct >= 100 else "ok",
+        })
+    return sorted(forecasts, key=lambda f: -(f["projected_pct"] or 0))
+
+
+def build_summary(transactions, budgets, today=None):
+    """Resumen completo para /api/resumen a partir de las filas de 'transactions' y 'budgets' del mes."""
+    today = today or datetime.date.today()
+    data = TransactionArrays(transactions)
+    month_start = today.replace(day=1)
+    month = (data.dates >= np.datetime64(month_start)) & (data.dates <= np.datetime64(today))
+    income = data.amounts[month & data.is_income].sum()
+    expense = data.amounts[month & data.is_expense].sum()
+    return {
+        "date": today.isoformat(),
+        "transactions_loaded": len(data),
+        "month": {"income": _round(income), "expense": _round(expense), "balance": _round(income - expense)},
+        "category_totals": category_totals(data, month_start, today),
+        "weekly": weekly_comparison(data, today),
+        "anomalies": {
+            "days": daily_anomalies(data, today),
+            "transactions": category_outliers(data, month_start),
+        },
+        "budget_forecast": month_end_forecast(data, budgets, today),
+    }
@@ -0,0 +1,113 @@
+# bench_cold_start.py
+#
+# Mide el arranque en frío del backend: desde que se lanza el proceso de uvicorn hasta
+#   - la primera respuesta 200 de "/" (el puerto ya escucha; lo que ve el móvil), y
+#   - la primera respuesta 200 de "/ready" (Supabase y Gemini ya creados en segundo plano).
+# Supabase apunta al PostgREST simulado de stubs.py, así que no se necesita red. También mide
+# cuánto cuesta importar los módulos pesados que ahora se cargan de forma diferida.
+#
+# Uso (desde finanzas_backend/):
+#   python benchmarks/bench_cold_start.py --repeticiones 5
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from stubs import PostgRESTStub  # noqa: E402
+
+FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.stub"
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _esperar_200(url, inicio, timeout):
+    while time.perf_counter() - inicio < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - inicio
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def medir_arranque(env, timeout):
+    port = _puerto_libre()
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        primera = _esperar_200(f"http://127.0.0.1:{port}/", inicio, timeout)
+        lista = _esperar_200(f"http://127.0.0.1:{port}/ready", inicio, timeout)
+    finally:
+        proceso.terminate()
+        proceso.wait()
+    return primera, lista
+
+
+def medir_imports_pesados():
+    """Tiempo de importar en un proceso limpio los módulos que main.py ya no importa al arrancar."""
+    inicio = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    base = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import google.generativeai, firebase_admin.messaging, supabase"], check=True)
+    return time.perf_counter() - inicio - base
+
+
+def _ms(valor):
+    return f"{valor * 1000:.0f} ms" if valor is not None else "sin respuesta"
+
+
+def _formato(valores):
+    validos = [v for v in valores if v is not None]
+    if not validos:
+        return "sin respuesta"
+    return f"mediana {statistics.median(validos) * 1000:.0f} ms, máx {max(validos) * 1000:.0f} ms ({len(validos)}/{len(valores)})"
+
+
+def main(args):
+    postgrest = PostgRESTStub(latencia_ms=args.latencia_db_ms)
+    env = {
+        **os.environ,
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_KEY": FAKE_SUPABASE_KEY,
+        "SUPABASE_SERVICE_KEY": FAKE_SUPABASE_KEY,
+        "GEMINI_API_KEY": "stub",
+    }
+
+    primeras, listas = [], []
+    for i in range(args.repeticiones):
+        primera, lista = medir_arranque(env, args.timeout)
+        primeras.append(primera)
+        listas.append(lista)
+        print(f"Arranque {i + 1}: primera respuesta {_ms(primera)}, /ready {_ms(lista)}")
+    postgrest.shutdown()
+
+    print(f"\nImport -> primera respuesta de '/': {_formato(primeras)}")
+    print(f"Import -> '/ready' (clientes listos):  {_formato(listas)}")
+    print(f"Coste de los imports diferidos (google.generativeai, firebase_admin, supabase): {medir_imports_pesados() * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del arranque en frío del backend")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--latencia-db-ms", type=float, default=2.0)
+    main(parser.parse_args())
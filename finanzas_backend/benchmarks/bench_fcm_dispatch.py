@@ -0,0 +1,54 @@
+# bench_fcm_dispatch.py
+#
+# Compara el envío anterior de send_reminders.py (un requests.post secuencial por dispositivo)
+# con NotificationDispatcher (lotes de hasta 500 mensajes, varios lotes en paralelo), usando un
+# servidor FCM local que simula latencia por llamada, errores transitorios y tokens muertos.
+#
+# Uso (desde finanzas_backend/):
+#   python benchmarks/bench_fcm_dispatch.py -n 5000 --latencia-ms 40 --errores 0.02 --muertos 0.01
+
+import argparse
+import os
+import sys
+import time
+
+import requests
+from firebase_admin import messaging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from notification_dispatcher import NotificationDispatcher  # noqa: E402
+from stubs import start_stub_fcm, stub_send_each  # noqa: E402
+
+
+def main(args):
+    server, url = start_stub_fcm(args.latencia_ms, args.errores, args.muertos)
+    notificaciones = [
+        (f"recordatorio {i}", messaging.Message(notification=messaging.Notification(title="Bench", body=str(i)), token=f"token-{i}"))
+        for i in range(args.n)
+    ]
+
+    # Comportamiento anterior: una petición HTTP (sin pool) por notificación.
+    muestra = notificaciones[:args.muestra_secuencial]
+    t = time.perf_counter()
+    for _, message in muestra:
+        requests.post(url, json=[message.token])
+    por_notificacion = (time.perf_counter() - t) / len(muestra)
+    secuencial = por_notificacion * args.n
+    print(f"Secuencial (estimado a partir de {len(muestra)}): {secuencial:.2f}s, {args.n} peticiones HTTP")
+
+    dispatcher = NotificationDispatcher(max_workers=args.workers, backoff_base=0.01, send_each=stub_send_each(url))
+    stats = dispatcher.send_all(notificaciones)
+    print(f"Dispatcher: {stats.summary()}")
+    print(f"Peticiones HTTP: {stats.batches} | Aceleración: {secuencial / stats.elapsed:.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del envío de notificaciones FCM")
+    parser.add_argument("-n", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latencia-ms", type=float, default=40)
+    parser.add_argument("--errores", type=float, default=0.02)
+    parser.add_argument("--muertos", type=float, default=0.01)
+    parser.add_argument("--muestra-secuencial", type=int, default=100)
+    main(parser.parse_args())
@@ -0,0 +1,189 @@
+# bench_import.py
+#
+# Mide POST /api/transactions/import (transaction_import.StatementImporter) con un extracto
+# generado de --filas movimientos (50k por defecto), CSV u OFX, que se entrega en trozos de
+# --trozo-kb como el cuerpo de la petición (request.stream()): el fichero nunca está entero en
+# memoria, tampoco aquí. Por cada tamaño informa del tiempo total, filas/s, lotes y del pico de
+# memoria (tracemalloc) de la importación, que debe quedarse en unos pocos lotes más las huellas
+# vistas aunque el extracto crezca.
+#
+# Por defecto el cliente es uno asíncrono en memoria con --latencia-db-ms por upsert que no guarda
+# las filas (así el pico es solo del importador). Con --postgrest se usa supabase-py contra el
+# PostgREST simulado de stubs.py (camino HTTP real; el pico incluye la tabla del stub).
+# El tiempo se mide en una pasada sin tracemalloc y el pico en otra con él (tracemalloc ralentiza).
+#
+# Uso (desde finanzas_backend/):
+#   python benchmarks/bench_import.py --filas 10000,50000 --formato csv
+#   python benchmarks/bench_import.py --formato ofx --postgrest
+
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from transaction_import import StatementImporter  # noqa: E402
+
+FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.stub"
+CATEGORIAS = ("Comida", "Transporte", "Ocio", "Hogar", "Salud", "Compras")
+CONCEPTOS = ("MERCADONA", "UBER *TRIP", "NETFLIX.COM", "FARMACIA CENTRAL", "AMAZON EU", "BAR LA ESQUINA", "NOMINA")
+
+
+# --- Extracto generado ---
+def _movimientos(filas, seed):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    for i in range(filas):
+        day = today - datetime.timedelta(days=rng.randint(0, 59))
+        amount = round(rng.uniform(1, 300), 2) * (1 if rng.random() < 0.1 else -1)
+        yield i, day, amount, f"{rng.choice(CONCEPTOS)} {rng.randint(1, 9999)}", rng.choice(CATEGORIAS)
+
+
+def _lineas_csv(filas, seed):
+    yield "Fecha;Concepto;Importe;Categoría\n"
+    for _, day, amount, concepto, categoria in _movimientos(filas, seed):
+        yield f"{day:%d/%m/%Y};{concepto};{amount:.2f}".replace(".", ",") + f";{categoria}\n"
+
+
+def _lineas_ofx(filas, seed):
+    yield "OFXHEADER:100\nDATA:OFXSGML\nVERSION:102\nCHARSET:1252\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n"
+    for i, day, amount, concepto, _ in _movimientos(filas, seed):
+        kind = "CREDIT" if amount > 0 else "DEBIT"
+        yield (f"<STMTTRN>\n<TRNTYPE>{kind}\n<DTPOSTED>{day:%Y%m%d}120000\n<TRNAMT>{amount:.2f}\n"
+               f"<FITID>{i:010d}\n<NAME>{concepto}\n</STMTTRN>\n")
+    yield "</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n"
+
+
+async def _trozos(formato, filas, trozo_bytes, seed, medida):
+    """Cuerpo de la petición en trozos de ~trozo_bytes, generado sobre la marcha."""
+    lineas = _lineas_ofx if formato == "ofx" else _lineas_csv
+    buffer, size = [], 0
+    for line in lineas(filas, seed):
+        data = line.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if size >= trozo_bytes:
+            medida["bytes"] += size
+            yield b"".join(buffer)
+            buffer, size = [], 0
+            await asyncio.sleep(0)
+    if buffer:
+        medida["bytes"] += size
+        yield b"".join(buffer)
+
+
+# --- Cliente en memoria ---
+class _Respuesta:
+    def __init__(self, data=None, count=None):
+        self.data = data
+        self.count = count
+
+
+class _Consulta:
+    def __init__(self, cliente, rows=None, rpc_args=None):
+        self.cliente = cliente
+        self.rows = rows
+        self.rpc_args = rpc_args
+
+    def upsert(self, rows, **_):
+        return _Consulta(self.cliente, rows=rows)
+
+    async def execute(self):
+        await asyncio.sleep(self.cliente.latencia)
+        self.cliente.requests += 1
+        if self.rpc_args is not None:
+            return _Respuesta(data=len(self.rpc_args["p_categories"]))
+        return _Respuesta(count=len(self.rows))
+
+
+class ClienteMemoria:
+    """Lo justo de un AsyncClient de supabase-py para el importador; no guarda las filas."""
+
+    def __init__(self, latencia_ms):
+        self.latencia = latencia_ms / 1000
+        self.requests = 0
+
+    def table(self, _name):
+        return _Consulta(self)
+
+    def rpc(self, _name, args):
+        return _Consulta(self, rpc_args=args)
+
+
+# --- Medición ---
+async def _importar(db, formato, filas, args, trazar):
+    medida = {"bytes": 0}
+    importer = StatementImporter(db, str(uuid.uuid4()), batch_size=args.lote, max_in_flight=args.en_vuelo)
+    if trazar:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = await importer.run(_trozos(formato, filas, args.trozo_kb * 1024, args.semilla, medida), formato)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trazar else None
+    finally:
+        if trazar:
+            tracemalloc.stop()
+    return result, elapsed, peak, medida["bytes"]
+
+
+async def _cliente_postgrest(args):
+    from stubs import PostgRESTStub
+
+    postgrest = PostgRESTStub(latencia_ms=args.latencia_db_ms)
+    os.environ.update({"SUPABASE_URL": postgrest.url, "SUPABASE_KEY": FAKE_SUPABASE_KEY,
+                       "SUPABASE_SERVICE_KEY": FAKE_SUPABASE_KEY})
+    from clients import get_supabase_async
+
+    return postgrest, await get_supabase_async("SUPABASE_SERVICE_KEY")
+
+
+async def main(args):
+    postgrest = None
+    if args.postgrest:
+        postgrest, db = await _cliente_postgrest(args)
+        cliente = "PostgREST simulado"
+    else:
+        db = ClienteMemoria(args.latencia_db_ms)
+        cliente = "cliente en memoria"
+    print(f"Importación {args.formato.upper()} con {cliente}: lotes de {args.lote}, {args.en_vuelo} en vuelo, "
+          f"latencia {args.latencia_db_ms:.1f} ms por petición, trozos de {args.trozo_kb} KiB")
+    print(f"{'filas':>8} {'MB':>7} {'lotes':>6} {'insertadas':>11} {'inválidas':>10} {'s':>7} {'filas/s':>9} {'pico MB':>8}")
+    try:
+        for filas in args.filas:
+            if postgrest:
+                postgrest.reset_table("transactions")
+            result, elapsed, _, size = await _importar(db, args.formato, filas, args, trazar=False)
+            if postgrest:
+                postgrest.reset_table("transactions")
+            _, _, peak, _ = await _importar(db, args.formato, filas, args, trazar=True)
+            print(f"{filas:>8} {size / 1e6:>7.2f} {result.batches:>6} {result.inserted:>11} {result.invalid:>10} "
+                  f"{elapsed:>7.2f} {filas / elapsed:>9.0f} {peak / 1e6:>8.2f}")
+            if result.inserted != filas or result.invalid:
+                raise SystemExit(f"❌ Se esperaban {filas} filas insertadas y 0 inválidas: {result.to_dict()}")
+    finally:
+        if postgrest:
+            from clients import close_async
+
+            await close_async()
+            postgrest.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiempo y pico de memoria de la importación de extractos")
+    parser.add_argument("--filas", type=lambda v: [int(x) for x in v.split(",")], default=[10_000, 50_000])
+    parser.add_argument("--formato", choices=("csv", "ofx"), default="csv")
+    parser.add_argument("--lote", type=int, default=1000)
+    parser.add_argument("--en-vuelo", type=int, default=2)
+    parser.add_argument("--trozo-kb", type=int, default=64)
+    parser.add_argument("--latencia-db-ms", type=float, default=20.0, help="Latencia simulada por upsert")
+    parser.add_argument("--postgrest", action="store_true", help="supabase-py contra el PostgREST simulado de stubs.py")
+    parser.add_argument("--semilla", type=int, default=7)
+    asyncio.run(main(parser.parse_args()))
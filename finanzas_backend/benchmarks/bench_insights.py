@@ -0,0 +1,140 @@
+# bench_insights.py
+#
+# Compara el motor por lotes de generate_insights.py con el bucle por usuario de la Edge
+# Function generate-user-insights (replicado aquí con las mismas llamadas: consulta de insight
+# reciente + RPC + insert por usuario y tipo), contra el PostgREST simulado de stubs.py con una
+# latencia fija por petición. Mide tiempo total y número de peticiones a 1k/10k/100k usuarios.
+#
+# El bucle original es secuencial y su coste crece linealmente con los usuarios, así que se mide
+# sobre una muestra (--muestra-legacy) y se extrapola. El stub calcula los candidatos en Python:
+# lo que compara este benchmark son los viajes de ida y vuelta, no el plan de las consultas
+# (para eso, EXPLAIN ANALYZE de insight_candidates() sobre la base real).
+#
+# Uso (desde finanzas_backend/):
+#   python benchmarks/bench_insights.py --usuarios 1000,10000,100000 --latencia-db-ms 2
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from stubs import PostgRESTStub  # noqa: E402
+
+FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.stub"
+
+
+def _tiene_insight_reciente(supabase, user_id, insight_type, days):
+    threshold = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)).isoformat()
+    return bool(supabase.table("insights").select("id").eq("user_id", user_id).eq("type", insight_type)
+                .gte("created_at", threshold).limit(1).execute().data)
+
+
+def _insertar(supabase, user_id, insight_type):
+    supabase.table("insights").insert({"user_id": user_id, "type": insight_type, "severity": "info",
+                                       "title": insight_type, "description": ""}).execute()
+
+
+def bucle_por_usuario(supabase, user_ids):
+    """Las mismas peticiones que la Edge Function, usuario a usuario."""
+    for user_id in user_ids:
+        args = {"p_user_id": user_id}
+        # Con comprobación previa de insight reciente: semanal, categoría principal, ahorro mensual.
+        for rpc, insight_type, days in (
+            ("compare_weekly_spending", "weekly_spending_comparison", 7),
+            ("get_top_spending_category_current_month", "top_spending_category", 30),
+            ("compare_monthly_savings", "monthly_savings_comparison", 30),
+        ):
+            if not _tiene_insight_reciente(supabase, user_id, insight_type, days):
+                if supabase.rpc(rpc, args).execute().data:
+                    _insertar(supabase, user_id, insight_type)
+        for _ in supabase.rpc("get_budgets_progress_for_user", args).execute().data:
+            if not _tiene_insight_reciente(supabase, user_id, "budget_exceeded", 7):
+                _insertar(supabase, user_id, "budget_exceeded")
+        # Sin comprobación: pagos próximos, saldo bajo e hitos de metas.
+        for rpc, insight_type in (
+            ("get_upcoming_recurring_payments", "upcoming_payment"),
+            ("check_low_balance_accounts", "low_balance_warning"),
+            ("check_goal_milestones", "goal_milestone"),
+        ):
+            for _ in supabase.rpc(rpc, args).execute().data:
+                _insertar(supabase, user_id, insight_type)
+
+
+def medir(postgrest, supabase, usuarios, args):
+    import generate_insights
+
+    inicio = time.perf_counter()
+    user_ids = postgrest.seed(usuarios, args.tx_por_usuario, con_transacciones=False)
+    siembra = time.perf_counter() - inicio
+    resultado = {"users": usuarios, "seed_s": round(siembra, 2)}
+
+    for etiqueta in ("batch", "batch_repeat"):
+        peticiones = postgrest.requests
+        stats = generate_insights.generate_insights(page_size=args.page_size, supabase=supabase)
+        resultado[etiqueta] = {
+            "elapsed_s": round(stats.elapsed, 3),
+            "requests": postgrest.requests - peticiones,
+            "candidates": stats.candidates,
+            "inserted": stats.inserted,
+        }
+
+    postgrest.reset_table("insights")
+    muestra = user_ids[:min(args.muestra_legacy, usuarios)]
+    peticiones = postgrest.requests
+    inicio = time.perf_counter()
+    bucle_por_usuario(supabase, muestra)
+    duracion = time.perf_counter() - inicio
+    factor = usuarios / len(muestra)
+    resultado["per_user_loop"] = {
+        "sample_users": len(muestra),
+        "elapsed_s": round(duracion * factor, 3),
+        "requests": round((postgrest.requests - peticiones) * factor),
+        "extrapolated": factor > 1,
+    }
+    return resultado
+
+
+def main(args):
+    postgrest = PostgRESTStub(latencia_ms=args.latencia_db_ms)
+    os.environ.update({"SUPABASE_URL": postgrest.url, "SUPABASE_SERVICE_KEY": FAKE_SUPABASE_KEY})
+    from clients import close_sync, get_supabase
+
+    supabase = get_supabase("SUPABASE_SERVICE_KEY")
+    resultados = []
+    try:
+        for usuarios in args.usuarios:
+            resultados.append(medir(postgrest, supabase, usuarios, args))
+    finally:
+        close_sync()
+        postgrest.shutdown()
+
+    print(f"\nLatencia por petición: {args.latencia_db_ms} ms, página: {args.page_size} usuarios")
+    print(f"{'usuarios':>9} {'lotes s':>9} {'peticiones':>11} {'repetición s':>13} {'bucle s':>10} {'peticiones':>11} {'mejora':>8}")
+    for r in resultados:
+        lote, bucle = r["batch"], r["per_user_loop"]
+        mejora = bucle["elapsed_s"] / lote["elapsed_s"] if lote["elapsed_s"] else 0.0
+        marca = "*" if bucle["extrapolated"] else " "
+        print(f"{r['users']:>9} {lote['elapsed_s']:>9.2f} {lote['requests']:>11} {r['batch_repeat']['elapsed_s']:>13.2f} "
+              f"{bucle['elapsed_s']:>9.1f}{marca} {bucle['requests']:>11} {mejora:>7.0f}x")
+    print("* extrapolado desde una muestra de usuarios (el bucle es secuencial y lineal).")
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump({"latency_ms": args.latencia_db_ms, "page_size": args.page_size, "results": resultados}, f, indent=2)
+        print(f"Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del motor de insights por lotes frente al bucle por usuario")
+    parser.add_argument("--usuarios", type=lambda v: [int(x) for x in v.split(",")], default=[1000, 10000, 100000])
+    parser.add_argument("--tx-por-usuario", type=int, default=8)
+    parser.add_argument("--latencia-db-ms", type=float, default=2.0)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--muestra-legacy", type=int, default=300)
+    parser.add_argument("--salida", default=None)
+    main(parser.parse_args())
@@ -0,0 +1,72 @@
+# bench_prompt_size.py
+#
+# Compara el prompt de análisis anterior (json.dumps con indent=2) con el formato compacto de
+# prompt_builder.py: tamaño en caracteres, tokens estimados y tiempo de construcción.
+#
+# Uso (desde finanzas_backend/):
+#   python benchmarks/bench_prompt_size.py
+
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prompt_builder import build_debts_block, build_transactions_block, estimate_tokens  # noqa: E402
+
+CATEGORIAS = ["Comida", "Transporte", "Ocio", "Salud", "Hogar", "Educación", "Compras"]
+
+
+def _transacciones(n):
+    random.seed(n)
+    hoy = date.today()
+    return [
+        {
+            "description": random.choice(["Supermercado", "Uber", "Cine", "Farmacia", "Arriendo", "Curso online"]),
+            "amount": round(random.uniform(5, 400), 2),
+            "type": "Ingreso" if random.random() < 0.15 else "Gasto",
+            "category": random.choice(CATEGORIAS),
+            "transaction_date": f"{hoy - timedelta(days=i // 2)}T{random.randint(0, 23):02d}:15:00+00:00",
+        }
+        for i in range(n)
+    ]
+
+
+DEUDAS = [
+    {"name": "Tarjeta Visa", "total_amount": 1200000, "installments_paid": 3, "installments_total": 12, "installment_amount": 100000},
+    {"name": "Celular", "total_amount": 900000, "installments_paid": 5, "installments_total": 6, "installment_amount": 150000},
+]
+
+
+def prompt_anterior(transactions):
+    return f"""
+            DEUDAS A CUOTAS:
+            {json.dumps(DEUDAS, indent=2)}
+
+            HISTORIAL RECIENTE:
+            {json.dumps(transactions, indent=2, default=str)}
+            """
+
+
+def prompt_compacto(transactions):
+    return f"DEUDAS A CUOTAS:\n{build_debts_block(DEUDAS)}\n\nHISTORIAL RECIENTE:\n{build_transactions_block(transactions)}\n"
+
+
+def _medir(fn, arg, repeticiones=200):
+    t = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = fn(arg)
+    return resultado, (time.perf_counter() - t) / repeticiones * 1e6
+
+
+if __name__ == "__main__":
+    print(f"{'filas':>6} | {'antes chars':>11} | {'antes tok':>9} | {'antes µs':>8} | {'ahora chars':>11} | {'ahora tok':>9} | {'ahora µs':>8} | {'ahorro':>6}")
+    for n in (30, 50, 200):
+        tx = _transacciones(n)
+        antes, t_antes = _medir(prompt_anterior, tx)
+        ahora, t_ahora = _medir(prompt_compacto, tx)
+        ahorro = 1 - estimate_tokens(ahora) / estimate_tokens(antes)
+        print(f"{n:>6} | {len(antes):>11} | {estimate_tokens(antes):>9} | {t_antes:>8.0f} | "
+              f"{len(ahora):>11} | {estimate_tokens(ahora):>9} | {t_ahora:>8.0f} | {ahorro:>6.0%}")
@@ -0,0 +1,98 @@
+# load_test_analisis.py
+#
+# Prueba de carga para /api/analisis-financiero.
+# Lanza N peticiones simultáneas contra un servidor en marcha y comprueba que se
+# solapan en el tiempo (en lugar de atenderse una detrás de otra), mientras mide
+# la latencia de "/" para verificar que el event loop sigue respondiendo.
+# Cada petición lleva un usuario y un cuerpo distintos: si no, el single-flight las fusionaría
+# en una sola generación y el límite por usuario del planificador devolvería 429.
+#
+# Uso:
+#   uvicorn main:app --port 8000          (desde finanzas_backend/)
+#   python benchmarks/load_test_analisis.py --url http://localhost:8000 -n 20
+#   python benchmarks/load_test_analisis.py --user-ids <UUID1>,<UUID2>,... -n 20   (usuarios con datos)
+
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+
+async def _peticion_analisis(client, url, user_id, i, t0):
+    inicio = time.perf_counter() - t0
+    response = await client.post(
+        f"{url}/api/analisis-financiero",
+        json={"user_id": user_id, "financial_state": {"available_balance": 1000 + i}},
+    )
+    fin = time.perf_counter() - t0
+    return inicio, fin, response.status_code
+
+
+async def _sondear_raiz(client, url, stop_event):
+    """Mide cuánto tarda "/" mientras las peticiones de análisis están en curso."""
+    latencias = []
+    while not stop_event.is_set():
+        t = time.perf_counter()
+        await client.get(f"{url}/")
+        latencias.append(time.perf_counter() - t)
+        await asyncio.sleep(0.1)
+    return latencias
+
+
+def _max_solapadas(intervalos):
+    eventos = sorted([(i, 1) for i, _ in intervalos] + [(f, -1) for _, f in intervalos])
+    actual = maximo = 0
+    for _, delta in eventos:
+        actual += delta
+        maximo = max(maximo, actual)
+    return maximo
+
+
+def _usuarios(args):
+    """Un user_id por petición: los de --user-ids (sin repetir) o UUID nuevos."""
+    if not args.user_ids:
+        return [str(uuid.uuid4()) for _ in range(args.n)]
+    if len(args.user_ids) < args.n:
+        raise SystemExit(f"--user-ids necesita al menos {args.n} usuarios distintos (uno por petición)")
+    return args.user_ids[:args.n]
+
+
+async def main(args):
+    user_ids = _usuarios(args)
+    limits = httpx.Limits(max_connections=args.n + 1)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        stop_event = asyncio.Event()
+        sonda = asyncio.create_task(_sondear_raiz(client, args.url, stop_event))
+
+        t0 = time.perf_counter()
+        resultados = await asyncio.gather(
+            *[_peticion_analisis(client, args.url, user_id, i, t0) for i, user_id in enumerate(user_ids)]
+        )
+        total = time.perf_counter() - t0
+        stop_event.set()
+        latencias_raiz = await sonda
+
+    intervalos = [(inicio, fin) for inicio, fin, _ in resultados]
+    suma_latencias = sum(fin - inicio for inicio, fin in intervalos)
+    codigos = {}
+    for _, _, code in resultados:
+        codigos[code] = codigos.get(code, 0) + 1
+
+    print(f"Peticiones: {args.n} | Códigos: {codigos}")
+    print(f"Tiempo total: {total:.2f}s | Suma de latencias: {suma_latencias:.2f}s")
+    print(f"Factor de solapamiento (suma/total): {suma_latencias / total:.2f}x")
+    print(f"Máximo de peticiones en vuelo a la vez: {_max_solapadas(intervalos)}")
+    if latencias_raiz:
+        print(f"Latencia máxima de '/' durante la carga: {max(latencias_raiz) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de /api/analisis-financiero")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--user-ids", type=lambda value: [v for v in value.split(",") if v], default=None,
+                        help="Usuarios separados por comas, uno por petición (por defecto, UUID aleatorios)")
+    parser.add_argument("-n", type=int, default=20, help="Número de peticiones simultáneas")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    asyncio.run(main(parser.parse_args()))
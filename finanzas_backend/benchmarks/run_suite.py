@@ -0,0 +1,295 @@
+# run_suite.py
+#
+# Suite de rendimiento reproducible del backend, sin servicios externos.
+# Levanta los sustitutos locales de benchmarks/stubs.py (PostgREST sembrado, Gemini con
+# latencia y streaming configurables, FCM), arranca finanzas_backend/main.py con uvicorn
+# apuntando a ellos y mide, para cada tamaño de datos y nivel de concurrencia:
+#   - analisis:        POST /api/analisis-financiero
+#   - analisis_stream: POST /api/analisis-financiero/stream (hasta el evento `done`)
+#   - reminders:       send_reminders.send_recurring_payment_reminders (latencia por lote FCM)
+# El resultado (p50/p95/p99, req/s, errores) se guarda en JSON junto con el commit, para
+# compararlo entre versiones con --comparar.
+#
+# Uso (desde finanzas_backend/):
+#   python benchmarks/run_suite.py --usuarios 100,1000 --concurrencias 1,8,32 --salida bench.json
+#   python benchmarks/run_suite.py --comparar bench_base.json --salida bench.json
+
+import argparse
+import asyncio
+import datetime
+import importlib
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from stubs import GeminiStub, GeminiStubModel, PostgRESTStub, start_stub_fcm, stub_send, stub_send_each  # noqa: E402
+
+# Clave con forma de JWT: supabase-py valida el formato aunque el stub no la compruebe.
+FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.stub"
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano (0 si no hay muestras)."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, math.ceil(p / 100 * len(ordenados)) - 1)
+    return ordenados[indice]
+
+
+def _resumen(escenario, usuarios, concurrencia, latencias, errores, duracion):
+    total = len(latencias) + errores
+    return {
+        "scenario": escenario,
+        "users": usuarios,
+        "concurrency": concurrencia,
+        "requests": total,
+        "errors": errores,
+        "req_s": round(total / duracion, 2) if duracion else 0.0,
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+        "elapsed_s": round(duracion, 3),
+    }
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+def arrancar_backend(postgrest, gemini, fcm_url, args):
+    """Importa finanzas_backend/main.py apuntando a los stubs y lo sirve con uvicorn en un hilo."""
+    import uvicorn
+    from firebase_admin import messaging
+
+    os.environ.update({
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_KEY": FAKE_SUPABASE_KEY,
+        "SUPABASE_SERVICE_KEY": FAKE_SUPABASE_KEY,
+        "GEMINI_API_KEY": "stub",
+        "GEMINI_MAX_CONCURRENCY": str(args.gemini_concurrencia),
+        # Sin cuota por minuto ni límite por usuario: la carga sintética los superaría y se
+        # mediría el rechazo en lugar del camino completo (el planificador se mide en sim_gemini_quota.py).
+        "GEMINI_REQUESTS_PER_MINUTE": "0",
+        "GEMINI_TOKENS_PER_MINUTE": "0",
+        "GEMINI_USER_REQUESTS_PER_MINUTE": "0",
+        # Sin caché de análisis por defecto: se mide el camino completo en cada petición.
+        "ANALYSIS_CACHE_MAX_ENTRIES": "512" if args.con_cache else "0",
+    })
+    backend = importlib.import_module("main")
+    importlib.import_module("clients").set_gemini_model(GeminiStubModel(gemini.url))
+    # El backend llama a messaging.send / send_each en cada envío: se redirigen al FCM falso.
+    messaging.send = stub_send(fcm_url)
+    messaging.send_each = stub_send_each(fcm_url)
+
+    port = _puerto_libre()
+    server = uvicorn.Server(uvicorn.Config(backend.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    # Los clientes se precalientan en segundo plano: se mide cuando /ready ya responde 200.
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            with urllib.request.urlopen(f"{url}/ready") as response:
+                if response.status == 200:
+                    break
+        except urllib.error.URLError:
+            pass
+        time.sleep(0.05)
+    return server, url
+
+
+async def _carga(url, total, concurrencia, construir_peticion, leer_respuesta):
+    """Bucle cerrado: `concurrencia` clientes lanzan peticiones hasta completar `total`."""
+    import httpx
+
+    latencias = []
+    errores = 0
+    siguiente = 0
+
+    async def cliente(http):
+        nonlocal siguiente, errores
+        while siguiente < total:
+            i = siguiente
+            siguiente += 1
+            method, path, body = construir_peticion(i)
+            t = time.perf_counter()
+            try:
+                ok = await leer_respuesta(http, method, f"{url}{path}", body)
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencias.append(time.perf_counter() - t)
+            else:
+                errores += 1
+
+    limits = httpx.Limits(max_connections=concurrencia + 1)
+    async with httpx.AsyncClient(timeout=300, limits=limits) as http:
+        inicio = time.perf_counter()
+        await asyncio.gather(*[cliente(http) for _ in range(concurrencia)])
+        return latencias, errores, time.perf_counter() - inicio
+
+
+async def _respuesta_json(http, method, url, body):
+    response = await http.request(method, url, json=body)
+    return response.status_code == 200
+
+
+async def _respuesta_stream(http, method, url, body):
+    async with http.stream(method, url, json=body) as response:
+        if response.status_code != 200:
+            return False
+        async for line in response.aiter_lines():
+            if line.startswith("event: done"):
+                return True
+            if line.startswith("event: error"):
+                return False
+    return False
+
+
+def escenarios_http(user_ids):
+    def analisis(i):
+        return "POST", "/api/analisis-financiero", {
+            "user_id": user_ids[i % len(user_ids)],
+            "financial_state": {"available_balance": 1000, "net_worth": 5000, "monthly_income": 2500},
+        }
+
+    return {
+        "analisis": (analisis, _respuesta_json),
+        "analisis_stream": (analisis, _respuesta_stream),
+    }
+
+
+def medir_recordatorios(postgrest, fcm_url, usuarios):
+    """Un envío completo de recordatorios recurrentes (uno por usuario) contra los stubs."""
+    import send_reminders
+    from notification_dispatcher import FCM_MAX_WORKERS, NotificationDispatcher
+
+    postgrest.reset_table("reminder_deliveries")
+    dispatcher = NotificationDispatcher(max_workers=FCM_MAX_WORKERS, backoff_base=0.01,
+                                        send_each=stub_send_each(fcm_url))
+    inicio = time.perf_counter()
+    stats = send_reminders.send_recurring_payment_reminders(dispatcher)
+    duracion = time.perf_counter() - inicio
+    if stats is None:
+        return _resumen("reminders", usuarios, FCM_MAX_WORKERS, [], usuarios, duracion)
+    resultado = _resumen("reminders", usuarios, FCM_MAX_WORKERS, stats.latencies, 0, duracion)
+    # Para este escenario el rendimiento relevante son notificaciones por segundo, no lotes.
+    resultado["requests"] = stats.sent + stats.failed
+    resultado["errors"] = stats.failed
+    resultado["req_s"] = round((stats.sent + stats.failed) / duracion, 2) if duracion else 0.0
+    return resultado
+
+
+def comparar(anterior_path, actual):
+    with open(anterior_path) as f:
+        anterior = json.load(f)
+    previos = {(r["scenario"], r["users"], r["concurrency"]): r for r in anterior["results"]}
+    print(f"\n=== Comparación con {anterior.get('commit', '?')} ===")
+    print(f"{'escenario':<16} {'usuarios':>8} {'conc':>5} {'p95 ms':>18} {'req/s':>18}")
+    for r in actual["results"]:
+        previo = previos.get((r["scenario"], r["users"], r["concurrency"]))
+        if previo is None:
+            continue
+
+        def delta(campo):
+            antes, ahora = previo[campo], r[campo]
+            cambio = f"{(ahora - antes) / antes * 100:+.0f}%" if antes else "n/a"
+            return f"{ahora:.1f} ({cambio})"
+
+        print(f"{r['scenario']:<16} {r['users']:>8} {r['concurrency']:>5} {delta('p95_ms'):>18} {delta('req_s'):>18}")
+
+
+def main(args):
+    postgrest = PostgRESTStub(latencia_ms=args.latencia_db_ms)
+    gemini = GeminiStub(latencia_ms=args.latencia_gemini_ms, fragmentos=args.fragmentos, fragmento_ms=args.fragmento_ms)
+    fcm_server, fcm_url = start_stub_fcm(args.latencia_fcm_ms, args.errores_fcm, 0.0)
+    os.environ.setdefault("REMINDERS_CHECKPOINT_DIR", tempfile.mkdtemp(prefix="bench_checkpoints_"))
+
+    server, url = arrancar_backend(postgrest, gemini, fcm_url, args)
+    print(f"Backend en {url} | PostgREST {postgrest.url} | Gemini {gemini.url} | FCM {fcm_url}")
+
+    resultados = []
+    try:
+        for usuarios in args.usuarios:
+            user_ids = postgrest.seed(usuarios, args.tx_por_usuario, seed=args.semilla)
+            for nombre, (construir, leer) in escenarios_http(user_ids).items():
+                if nombre not in args.escenarios:
+                    continue
+                for concurrencia in args.concurrencias:
+                    total = max(args.peticiones, concurrencia)
+                    latencias, errores, duracion = asyncio.run(_carga(url, total, concurrencia, construir, leer))
+                    resultado = _resumen(nombre, usuarios, concurrencia, latencias, errores, duracion)
+                    resultados.append(resultado)
+                    print(f"{nombre:<16} usuarios={usuarios:<6} conc={concurrencia:<4} "
+                          f"p50={resultado['p50_ms']:.1f}ms p95={resultado['p95_ms']:.1f}ms "
+                          f"p99={resultado['p99_ms']:.1f}ms {resultado['req_s']:.1f} req/s errores={errores}")
+            if "reminders" in args.escenarios:
+                resultado = medir_recordatorios(postgrest, fcm_url, usuarios)
+                resultados.append(resultado)
+                print(f"{'reminders':<16} usuarios={usuarios:<6} p95 lote={resultado['p95_ms']:.1f}ms "
+                      f"{resultado['req_s']:.1f} notif/s errores={resultado['errors']}")
+    finally:
+        server.should_exit = True
+        postgrest.shutdown()
+        gemini.shutdown()
+        fcm_server.shutdown()
+
+    reporte = {
+        "commit": _commit_actual(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar")},
+        "results": resultados,
+    }
+    with open(args.salida, "w") as f:
+        json.dump(reporte, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {args.salida}")
+    if args.comparar:
+        comparar(args.comparar, reporte)
+
+
+def _lista_enteros(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Suite de rendimiento del backend con servicios simulados")
+    parser.add_argument("--usuarios", type=_lista_enteros, default=[100, 1000], help="Tamaños de datos (usuarios sembrados)")
+    parser.add_argument("--tx-por-usuario", type=int, default=60)
+    parser.add_argument("--concurrencias", type=_lista_enteros, default=[1, 8, 32])
+    parser.add_argument("--peticiones", type=int, default=64, help="Peticiones por escenario y concurrencia")
+    parser.add_argument("--escenarios", type=lambda v: v.split(","), default=["analisis", "analisis_stream", "reminders"])
+    parser.add_argument("--latencia-db-ms", type=float, default=2.0)
+    parser.add_argument("--latencia-gemini-ms", type=float, default=800.0, help="Latencia hasta el primer fragmento")
+    parser.add_argument("--fragmentos", type=int, default=8)
+    parser.add_argument("--fragmento-ms", type=float, default=50.0)
+    parser.add_argument("--latencia-fcm-ms", type=float, default=40.0)
+    parser.add_argument("--errores-fcm", type=float, default=0.0)
+    parser.add_argument("--gemini-concurrencia", type=int, default=4, help="GEMINI_MAX_CONCURRENCY del backend")
+    parser.add_argument("--con-cache", action="store_true", help="Mantiene la caché de análisis activa")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default="bench_results.json")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para mostrar la diferencia")
+    main(parser.parse_args())
@@ -0,0 +1,163 @@
+# sim_gemini_quota.py
+#
+# Simulación de cuota para gemini_scheduler.py, sin red: un Gemini falso que aplica su propia
+# cuota de peticiones por minuto (ResourceExhausted al superarla) y una mezcla de tráfico
+# contra él durante --duracion segundos:
+#   - usuarios interactivos normales (una petición cada pocos segundos cada uno);
+#   - un usuario abusivo que repite la petición sin parar;
+#   - una avalancha de peticiones de segundo plano (BATCH, como las de la pregeneración nocturna)
+#     al poco de empezar.
+# Se ejecuta dos veces, con el planificador y solo con el semáforo de concurrencia (como antes),
+# y compara por clase de tráfico: completadas, 429 de Gemini, rechazos tempranos y latencias.
+# Lo esperable con el planificador: ningún 429 de Gemini, el abusivo limitado, y las
+# interactivas con poca espera aunque la cola de batch esté llena.
+#
+# Uso (desde finanzas_backend/):
+#   python benchmarks/sim_gemini_quota.py --cuota-rpm 480 --duracion 20
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from gemini_scheduler import BATCH, INTERACTIVE, GeminiOverloaded, GeminiScheduler, TokenBucket  # noqa: E402
+
+PROMPT = "x" * 8000  # ~2k tokens de entrada, del orden del prompt real
+
+
+class ResourceExhausted(Exception):
+    """Mismo nombre que google.api_core.exceptions.ResourceExhausted (lo reconoce is_quota_error)."""
+
+
+class FakeUsage:
+    def __init__(self, total):
+        self.total_token_count = total
+
+
+class FakeResponse:
+    def __init__(self, tokens):
+        self.text = "ok"
+        self.usage_metadata = FakeUsage(tokens)
+
+
+class GeminiCuota:
+    """Gemini falso: latencia aleatoria y cuota de `rpm` peticiones por minuto (ráfaga de 1/6 de minuto)."""
+
+    def __init__(self, rpm, latencia):
+        self.bucket = TokenBucket(rpm, burst=max(1, rpm / 6))
+        self.latencia = latencia
+        self.llamadas = 0
+        self.rechazadas = 0
+
+    async def generate(self):
+        self.llamadas += 1
+        if self.bucket.delay(1) > 0:
+            self.rechazadas += 1
+            await asyncio.sleep(0.05)
+            raise ResourceExhausted("429 Quota exceeded")
+        self.bucket.take(1)
+        await asyncio.sleep(random.uniform(*self.latencia))
+        return FakeResponse(random.randint(2500, 4000))
+
+
+class Resultados:
+    def __init__(self):
+        self.por_clase = {}
+
+    def anotar(self, clase, resultado, latencia=None):
+        datos = self.por_clase.setdefault(clase, {"enviadas": 0, "ok": 0, "cuota_gemini": 0, "rechazadas": 0, "latencias": []})
+        datos["enviadas"] += 1
+        datos[resultado] += 1
+        if latencia is not None:
+            datos["latencias"].append(latencia)
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(p * len(valores)))] if valores else float("nan")
+
+
+async def _peticion(modo, scheduler, semaforo, gemini, resultados, clase, user_id, priority):
+    inicio = time.perf_counter()
+    try:
+        if modo == "planificador":
+            ticket = scheduler.admit(user_id, PROMPT, priority)
+            async with ticket:
+                ticket.record_usage((await gemini.generate()).usage_metadata)
+        else:
+            async with semaforo:
+                await gemini.generate()
+    except GeminiOverloaded:
+        resultados.anotar(clase, "rechazadas")
+        return
+    except ResourceExhausted:
+        resultados.anotar(clase, "cuota_gemini")
+        return
+    resultados.anotar(clase, "ok", time.perf_counter() - inicio)
+
+
+async def simular(modo, args):
+    random.seed(args.semilla)
+    gemini = GeminiCuota(args.cuota_rpm, (args.latencia_min, args.latencia_max))
+    # El planificador se dimensiona algo por debajo de la cuota real, como en producción.
+    scheduler = GeminiScheduler(args.concurrencia, requests_per_minute=args.cuota_rpm * 0.9, tokens_per_minute=0,
+                                quota_backoff=5)
+    semaforo = asyncio.Semaphore(args.concurrencia)
+    resultados = Resultados()
+    tareas = []
+    fin = time.perf_counter() + args.duracion
+
+    def lanzar(clase, user_id, priority):
+        tareas.append(asyncio.ensure_future(
+            _peticion(modo, scheduler, semaforo, gemini, resultados, clase, user_id, priority)))
+
+    async def usuario(user_id, intervalo, clase):
+        while time.perf_counter() < fin:
+            lanzar(clase, user_id, INTERACTIVE)
+            await asyncio.sleep(random.expovariate(1 / intervalo))
+
+    async def avalancha_batch():
+        await asyncio.sleep(args.duracion * 0.1)
+        for i in range(args.batch):
+            lanzar("batch", f"batch-{i}", BATCH)
+
+    await asyncio.gather(
+        *(usuario(f"user-{i}", args.intervalo_usuario, "interactiva") for i in range(args.usuarios)),
+        usuario("abusivo", 0.2, "abusivo"),
+        avalancha_batch(),
+    )
+    await asyncio.gather(*tareas)
+    return resultados, gemini, scheduler.stats() if modo == "planificador" else None
+
+
+def main(args):
+    print(f"Cuota simulada: {args.cuota_rpm:.0f} RPM, {args.usuarios} usuarios interactivos, 1 abusivo, "
+          f"{args.batch} peticiones batch, {args.duracion:.0f}s")
+    for modo in ("sin_planificador", "planificador"):
+        resultados, gemini, stats = asyncio.run(simular(modo, args))
+        print(f"\n== {modo} == (llamadas a Gemini: {gemini.llamadas}, 429 de Gemini: {gemini.rechazadas})")
+        print(f"{'clase':>12} {'enviadas':>9} {'ok':>6} {'429 Gemini':>11} {'rechazadas':>11} {'p50 s':>7} {'p95 s':>7}")
+        for clase, datos in resultados.por_clase.items():
+            print(f"{clase:>12} {datos['enviadas']:>9} {datos['ok']:>6} {datos['cuota_gemini']:>11} {datos['rechazadas']:>11} "
+                  f"{_percentil(datos['latencias'], 0.5):>7.2f} {_percentil(datos['latencias'], 0.95):>7.2f}")
+        if stats:
+            print(f"Planificador: rechazos {stats['shed']}, espera en cola {stats['queue_wait_seconds']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulación de cuota de Gemini con y sin el planificador")
+    parser.add_argument("--cuota-rpm", type=float, default=480)
+    parser.add_argument("--duracion", type=float, default=20)
+    parser.add_argument("--usuarios", type=int, default=40)
+    parser.add_argument("--intervalo-usuario", type=float, default=15.0, help="Segundos medios entre peticiones de cada usuario")
+    parser.add_argument("--batch", type=int, default=300)
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--latencia-min", type=float, default=0.3)
+    parser.add_argument("--latencia-max", type=float, default=1.5)
+    parser.add_argument("--semilla", type=int, default=7)
+    main(parser.parse_args())
@@ -0,0 +1,670 @@
+# stubs.py
+#
+# Servidores locales que sustituyen a los servicios externos en los benchmarks:
+#   - PostgRESTStub: API compatible con PostgREST (lo que usa supabase-py) sobre datos en
+#     memoria sembrados (transactions, budgets, monthly_category_spend, profiles,
+#     recurring_transactions...) y las RPC que llama el backend.
+#   - GeminiStub: generación con latencia configurable, con o sin streaming.
+#   - FCM: servidor que responde un estado por token (ok / transitorio / token muerto).
+# Todos corren en hilos (ThreadingHTTPServer) dentro del mismo proceso que el benchmark.
+
+import bisect
+import datetime
+import json
+import random
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from firebase_admin import messaging
+
+CATEGORIAS = ("Comida", "Transporte", "Ocio", "Hogar", "Salud", "Compras", "Servicios", "Educación")
+ANIMOS = ("feliz", "estresado", "neutral", "ansioso", "aburrido")
+
+
+def _serve(handler_cls):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _json_response(handler, status, payload, extra_headers=None):
+    body = json.dumps(payload, default=str).encode()
+    handler.send_response(status)
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(body)))
+    for name, value in (extra_headers or {}).items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+# --- PostgREST ---
+def _parse_in(value):
+    inner = value[1:-1] if value.startswith("(") and value.endswith(")") else value
+    return {part.strip().strip('"') for part in inner.split(",")} if inner else set()
+
+
+def _matches(row, column, expression):
+    op, _, value = expression.partition(".")
+    current = row.get(column)
+    if op == "is":
+        return current is None if value == "null" else str(current).lower() == value
+    if current is None:
+        return False
+    if op == "in":
+        return str(current) in _parse_in(value)
+    if op in ("eq", "neq"):
+        return (str(current) == value) == (op == "eq")
+    try:
+        left, right = float(current), float(value)
+    except (TypeError, ValueError):
+        left, right = str(current), value
+    return {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}.get(op, False)
+
+
+# RPC por usuario de la Edge Function generate-user-insights -> tipo de insight equivalente.
+LEGACY_INSIGHT_RPCS = {
+    "compare_weekly_spending": "weekly_spending_comparison",
+    "get_top_spending_category_current_month": "top_spending_category",
+    "compare_monthly_savings": "monthly_savings_comparison",
+    "get_budgets_progress_for_user": "budget_exceeded",
+    "get_upcoming_recurring_payments": "upcoming_payment",
+    "check_low_balance_accounts": "low_balance_warning",
+    "check_goal_milestones": "goal_milestone",
+}
+
+
+def _shard(user_id, count):
+    return zlib.crc32(str(user_id).encode()) % count
+
+
+class PostgRESTStub:
+    """Base de datos en memoria detrás de una API PostgREST mínima (/rest/v1/...)."""
+
+    RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+    def __init__(self, latencia_ms=2.0):
+        self.latencia_ms = latencia_ms
+        self.tables = {}
+        self.summaries = {}
+        self._insights = None  # tipo -> {user_id: [elementos]}, calculado al primer uso
+        self._insight_keys = None
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server, self.url = _serve(self._handler())
+
+    # --- Datos ---
+    def seed(self, usuarios, tx_por_usuario, seed=42, con_transacciones=True):
+        """
+        Siembra `usuarios` usuarios con `tx_por_usuario` transacciones de los últimos 60 días y
+        los agregados que mantienen los triggers (monthly_category_spend, user_period_flow).
+        Con `con_transacciones=False` solo se guardan los agregados (siembras muy grandes).
+        """
+        rng = random.Random(seed)
+        today = datetime.date.today()
+        tomorrow = (today + datetime.timedelta(days=1)).isoformat()
+        tables = {name: [] for name in (
+            "transactions", "budgets", "monthly_category_spend", "profiles", "recurring_transactions",
+            "reminder_deliveries", "precomputed_analyses", "insights", "user_period_flow", "accounts", "goals",
+        )}
+        summaries = {}
+        tx_id = budget_id = 0
+        for u in range(usuarios):
+            user_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            tables["profiles"].append({"id": user_id, "fcm_token": f"token-{u}"})
+            spend = {}
+            flow = {}
+            for _ in range(tx_por_usuario):
+                tx_id += 1
+                day = today - datetime.timedelta(days=rng.randint(0, 59))
+                tipo = "Ingreso" if rng.random() < 0.15 else "Gasto"
+                category = rng.choice(CATEGORIAS)
+                amount = round(rng.uniform(5, 400), 2)
+                if con_transacciones:
+                    tables["transactions"].append({
+                        "id": tx_id, "user_id": user_id, "type": tipo, "category": category,
+                        "amount": amount if tipo == "Ingreso" else -amount,
+                        "description": f"{category} #{tx_id}", "transaction_date": day.isoformat(),
+                        "mood": rng.choice(ANIMOS) if tipo == "Gasto" else None,
+                        "is_installment": False,
+                    })
+                if tipo == "Gasto" and (day.year, day.month) == (today.year, today.month):
+                    spend[category] = spend.get(category, 0.0) + amount
+                for period in (("month", day.replace(day=1)), ("week", day - datetime.timedelta(days=day.weekday()))):
+                    totals = flow.setdefault(period, {"income": 0.0, "expense": 0.0})
+                    totals["income" if tipo == "Ingreso" else "expense"] += amount
+            for (kind, start), totals in flow.items():
+                tables["user_period_flow"].append({
+                    "user_id": user_id, "period_kind": kind, "period_start": start.isoformat(),
+                    "income": round(totals["income"], 2), "expense": round(totals["expense"], 2),
+                })
+            for n in range(2):
+                tables["accounts"].append({
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))), "user_id": user_id, "name": f"Cuenta {n + 1}",
+                    "type": "Ahorros", "status": "active", "balance": round(rng.uniform(-100, 2000), 2),
+                })
+            target = round(rng.uniform(500, 5000), 2)
+            tables["goals"].append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128))), "user_id": user_id, "name": "Fondo de emergencia",
+                "status": "active", "target_amount": target, "current_amount": round(rng.uniform(0, target), 2),
+            })
+            for category in CATEGORIAS[:4]:
+                budget_id += 1
+                tables["budgets"].append({
+                    "id": budget_id, "user_id": user_id, "category": category,
+                    "amount": round(rng.uniform(100, 800), 2), "month": today.month, "year": today.year,
+                })
+            for category, total in spend.items():
+                tables["monthly_category_spend"].append({
+                    "user_id": user_id, "year": today.year, "month": today.month,
+                    "category": category, "total_spent": round(total, 2),
+                })
+            tables["recurring_transactions"].append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128))), "user_id": user_id,
+                "description": "Suscripción", "type": "Gasto", "amount": -9.99, "next_due_date": tomorrow,
+            })
+            summaries[user_id] = {
+                "month_income": 0, "month_expense": round(sum(spend.values()), 2),
+                "prev_month_income": 0, "prev_month_expense": 0,
+                "category_totals": {c: round(v, 2) for c, v in spend.items()},
+                "weekly_expense": [], "predominant_mood": rng.choice(ANIMOS),
+                "installments": [], "monthly_installments": 0,
+            }
+        for name in ("transactions", "recurring_transactions"):
+            tables[name].sort(key=lambda row: str(row["id"]))
+        with self._lock:
+            self.tables = tables
+            self.summaries = summaries
+            self._insights = self._insight_keys = None
+        return [p["id"] for p in tables["profiles"]]
+
+    def reset_table(self, name):
+        with self._lock:
+            self.tables[name] = []
+            self._insights = self._insight_keys = None
+
+    # --- Consultas ---
+    def _select(self, table, params):
+        rows = [r for r in self.tables.get(table, []) if all(_matches(r, c, e) for c, e in params["filters"])]
+        if params.get("order"):
+            for part in reversed(params["order"].split(",")):
+                column, *mods = part.split(".")
+                rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse="desc" in mods)
+        offset = int(params.get("offset") or 0)
+        if params.get("limit"):
+            rows = rows[offset:offset + int(params["limit"])]
+        elif offset:
+            rows = rows[offset:]
+        select = params.get("select") or "*"
+        if select.strip() == "*":
+            return [dict(r) for r in rows]
+        columns = [c.strip() for c in select.split(",")]
+        return [{c: r.get(c) for c in columns} for r in rows]
+
+    def _upsert(self, table, rows, on_conflict, ignore_duplicates):
+        existing = self.tables.setdefault(table, [])
+        if not on_conflict:
+            existing.extend(rows)
+            return rows
+        columns = [c.strip() for c in on_conflict.split(",")]
+        index = {tuple(str(r.get(c)) for c in columns): r for r in existing}
+        written = []
+        for row in rows:
+            key = tuple(str(row.get(c)) for c in columns)
+            if key in index:
+                if ignore_duplicates:
+                    continue
+                index[key].update(row)
+                written.append(index[key])
+            else:
+                existing.append(row)
+                index[key] = row
+                written.append(row)
+        return written
+
+    def _update(self, table, filters, values):
+        updated = []
+        for row in self.tables.get(table, []):
+            if all(_matches(row, c, e) for c, e in filters):
+                row.update(values)
+                updated.append(row)
+        return updated
+
+    def _rpc(self, name, args):
+        if name == "get_user_financial_summary":
+            return self.summaries.get(args.get("p_user_id"), {})
+        if name == "active_analysis_users":
+            ids = sorted(p["id"] for p in self.tables["profiles"])
+            ids = [i for i in ids if (args.get("p_after_id") is None or i > args["p_after_id"])
+                   and (args.get("p_shard_count", 1) <= 1 or _shard(i, args["p_shard_count"]) == args.get("p_shard_index", 0))]
+            return [{"id": i} for i in ids[:args.get("p_limit", 500)]]
+        if name == "pending_recurring_reminders":
+            tokens = {p["id"]: p.get("fcm_token") for p in self.tables["profiles"]}
+            delivered = {(d["kind"], str(d["source_id"]), str(d["delivery_date"]), d["user_id"]) for d in self.tables["reminder_deliveries"]}
+            result = []
+            for rt in self.tables["recurring_transactions"]:
+                if len(result) >= args.get("p_limit", 500):
+                    break
+                if (rt["next_due_date"] != args["p_due_date"] or not tokens.get(rt["user_id"])
+                        or (args.get("p_after_id") is not None and rt["id"] <= args["p_after_id"])
+                        or (args.get("p_shard_count", 1) > 1 and _shard(rt["user_id"], args["p_shard_count"]) != args.get("p_shard_index", 0))
+                        or ("recurring_payment", rt["id"], rt["next_due_date"], rt["user_id"]) in delivered):
+                    continue
+                result.append({**rt, "fcm_token": tokens[rt["user_id"]]})
+            return result
+        if name == "pending_goal_reminders":
+            return []
+        if name == "insight_candidates":
+            by_user = self._insight_items().get(args["p_type"], {})
+            ordered = list(by_user)  # ya ordenado por user_id
+            start = 0 if args.get("p_after_id") is None else bisect.bisect_right(ordered, args["p_after_id"])
+            result = []
+            for user_id in ordered[start:]:
+                if len(result) >= args.get("p_limit", 1000):
+                    break
+                if args.get("p_shard_count", 1) <= 1 or _shard(user_id, args["p_shard_count"]) == args.get("p_shard_index", 0):
+                    result.append({"id": user_id, "user_id": user_id, "items": by_user[user_id]})
+            return result
+        if name == "enqueue_budget_alert_events":
+            outbox = self.tables.setdefault("budget_alert_outbox", [])
+            today = datetime.date.today()
+            for category in args["p_categories"]:
+                outbox.append({"user_id": args["p_user_id"], "category": category, "year": today.year, "month": today.month})
+            return len(args["p_categories"])
+        if name in ("claim_budget_alert_thresholds", "release_budget_alert_thresholds"):
+            return self._budget_alert_thresholds(name, args["p_rows"])
+        if name == "insert_insights_batch":
+            return self._insert_insights(args["p_rows"])
+        if name in LEGACY_INSIGHT_RPCS:
+            # RPC por usuario de la Edge Function original (para comparar con el motor por lotes).
+            return self._insight_items().get(LEGACY_INSIGHT_RPCS[name], {}).get(args["p_user_id"], [])
+        raise KeyError(name)
+
+    def _budget_alert_thresholds(self, name, rows):
+        """Mismo cálculo que claim/release_budget_alert_thresholds() en SQL."""
+        state = {(r["user_id"], r["category"], r["year"], r["month"]): r
+                 for r in self.tables.setdefault("budget_alert_state", [])}
+        result = []
+        for row in rows:
+            key = (row["user_id"], row["category"], row["year"], row["month"])
+            current = state.get(key)
+            if name == "release_budget_alert_thresholds":
+                if current and current["threshold"] == row["threshold"]:
+                    current["threshold"] = 80 if row["threshold"] >= 100 else 0
+                    result.append(current)
+            elif current is None:
+                if row["threshold"] > 0:
+                    state[key] = dict(row)
+                    self.tables["budget_alert_state"].append(state[key])
+                    result.append(row)
+            elif row["threshold"] != current["threshold"]:
+                raised = row["threshold"] > current["threshold"]
+                current["threshold"] = row["threshold"]
+                if raised:
+                    result.append(row)
+        if name == "release_budget_alert_thresholds":
+            return len(result)
+        return [{"user_id": r["user_id"], "category": r["category"], "threshold": r["threshold"]} for r in result]
+
+    def _insight_items(self):
+        """Mismo cálculo que insight_candidates() en SQL, sobre las tablas en memoria."""
+        if self._insights is not None:
+            return self._insights
+        today = datetime.date.today()
+        this_week = today - datetime.timedelta(days=today.weekday())
+        last_week = (this_week - datetime.timedelta(days=7)).isoformat()
+        week_before = (this_week - datetime.timedelta(days=14)).isoformat()
+        last_month = (today.replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+        month_before = (last_month - datetime.timedelta(days=1)).replace(day=1).isoformat()
+        last_month = last_month.isoformat()
+        items = {}
+
+        def add(insight_type, user_id, item):
+            items.setdefault(insight_type, {}).setdefault(user_id, []).append(item)
+
+        flow = {(r["user_id"], r["period_kind"], r["period_start"]): r for r in self.tables.get("user_period_flow", [])}
+        for (user_id, kind, start), current in flow.items():
+            if kind == "week" and start == last_week:
+                previous = flow.get((user_id, "week", week_before))
+                if previous and previous["expense"] > 0 and abs(current["expense"] - previous["expense"]) > 0.1 * previous["expense"]:
+                    add("weekly_spending_comparison", user_id, {
+                        "key": start, "current": current["expense"], "previous": previous["expense"],
+                        "percentage_change": round((current["expense"] - previous["expense"]) / previous["expense"] * 100, 1),
+                    })
+            if kind == "month" and start == last_month:
+                previous = flow.get((user_id, "month", month_before))
+                if previous and (previous["income"] > 0 or previous["expense"] > 0):
+                    add("monthly_savings_comparison", user_id, {
+                        "key": start, "savings": current["income"] - current["expense"],
+                        "previous_savings": previous["income"] - previous["expense"],
+                    })
+
+        spend = {}
+        for r in self.tables.get("monthly_category_spend", []):
+            if (r["year"], r["month"]) == (today.year, today.month) and r["total_spent"]:
+                spend[(r["user_id"], r["category"])] = abs(r["total_spent"])
+        top = {}
+        for (user_id, category), total in spend.items():
+            if total > top.get(user_id, ("", 0))[1]:
+                top[user_id] = (category, total)
+        for user_id, (category, total) in top.items():
+            add("top_spending_category", user_id, {"key": f"{today.year}-{today.month}", "category": category, "total_spent": total})
+        for b in self.tables.get("budgets", []):
+            spent = spend.get((b["user_id"], b["category"]))
+            if (b["year"], b["month"]) == (today.year, today.month) and b["amount"] > 0 and spent is not None and spent >= b["amount"]:
+                add("budget_exceeded", b["user_id"], {
+                    "key": f"budget:{b['id']}:{b['year']}-{b['month']}", "budget_id": b["id"],
+                    "category": b["category"], "amount": b["amount"], "spent": spent,
+                })
+
+        horizon = (today + datetime.timedelta(days=3)).isoformat()
+        for rt in self.tables.get("recurring_transactions", []):
+            if today.isoformat() <= rt["next_due_date"] <= horizon:
+                add("upcoming_payment", rt["user_id"], {
+                    "key": f"{rt['id']}:{rt['next_due_date']}", "description": rt["description"],
+                    "amount": rt.get("amount", 0), "next_due_date": rt["next_due_date"],
+                })
+        for a in self.tables.get("accounts", []):
+            if a["status"] == "active" and a["type"] != "Tarjeta de Crédito" and a["balance"] < 50:
+                add("low_balance_warning", a["user_id"], {"key": a["id"], "account_name": a["name"], "current_balance": a["balance"]})
+        for g in self.tables.get("goals", []):
+            if g["status"] == "active" and 0 < g["target_amount"] and g["current_amount"] < g["target_amount"]:
+                reached = [h for h in (25, 50, 75, 90) if g["current_amount"] * 100 >= g["target_amount"] * h]
+                if reached:
+                    add("goal_milestone", g["user_id"], {"key": f"{g['id']}:{reached[-1]}", "goal_name": g["name"], "milestone": reached[-1]})
+
+        for insight_type, by_user in items.items():
+            for user_items in by_user.values():
+                user_items.sort(key=lambda item: str(item["key"]))
+            items[insight_type] = dict(sorted(by_user.items()))
+        self._insights = items
+        return items
+
+    def _insert_insights(self, rows):
+        """insert_insights_batch(): anti-join por (usuario, tipo, clave) dentro de la ventana del tipo."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        insights = self.tables.setdefault("insights", [])
+        if self._insight_keys is None:
+            # Índice (usuario, tipo, clave) -> creado, como idx_insights_user_type_created.
+            self._insight_keys = {
+                (i["user_id"], i["type"], i["metadata"].get("dedupe_key")): i["created_at"]
+                for i in insights if i.get("metadata", {}).get("dedupe_key") is not None
+            }
+        recent = self._insight_keys
+        inserted = 0
+        for row in rows:
+            created = recent.get((row["user_id"], row["type"], row["dedupe_key"]))
+            if created is not None and created >= now - datetime.timedelta(days=row["dedupe_days"]):
+                continue
+            insights.append({
+                "id": str(uuid.uuid4()), "user_id": row["user_id"], "type": row["type"], "severity": row["severity"],
+                "title": row["title"], "description": row["description"], "created_at": now, "is_read": False,
+                "metadata": {**(row.get("metadata") or {}), "dedupe_key": row["dedupe_key"]},
+            })
+            recent[(row["user_id"], row["type"], row["dedupe_key"])] = now
+            inserted += 1
+        return inserted
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _parse(self):
+                parts = urlsplit(self.path)
+                path = parts.path.removeprefix("/rest/v1/").strip("/")
+                params = {"filters": []}
+                for key, value in parse_qsl(parts.query, keep_blank_values=True):
+                    if key in PostgRESTStub.RESERVED_PARAMS:
+                        params[key] = value
+                    else:
+                        params["filters"].append((key, value))
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                return path, params, body
+
+            def _respond(self, method):
+                if stub.latencia_ms:
+                    time.sleep(stub.latencia_ms / 1000)
+                path, params, body = self._parse()
+                prefer = self.headers.get("Prefer", "")
+                try:
+                    with stub._lock:
+                        stub.requests += 1
+                        if path.startswith("rpc/"):
+                            result = stub._rpc(path[4:], body or {})
+                        elif method == "GET":
+                            result = stub._select(path, params)
+                        elif method == "POST":
+                            rows = body if isinstance(body, list) else [body]
+                            result = stub._upsert(path, rows, params.get("on_conflict"), "ignore-duplicates" in prefer)
+                        elif method == "PATCH":
+                            result = stub._update(path, params["filters"], body or {})
+                        else:
+                            result = []
+                        result = json.loads(json.dumps(result, default=str))
+                except KeyError as e:
+                    _json_response(self, 404, {"message": f"No existe {e}"})
+                    return
+                total = len(result) if "count=exact" in prefer else "*"
+                headers = {"Content-Range": f"0-{max(len(result) - 1, 0)}/{total}"} if isinstance(result, list) else {}
+                _json_response(self, 200, result, headers)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def do_PATCH(self):
+                self._respond("PATCH")
+
+            def do_HEAD(self):
+                self._respond("GET")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+# --- Gemini ---
+class GeminiStub:
+    """
+    POST /generate {"prompt", "stream"}. Sin streaming responde tras `latencia_ms` + todos los
+    fragmentos; con streaming envía una línea JSON por fragmento (chunked) cada `fragmento_ms`.
+    """
+
+    def __init__(self, latencia_ms=800.0, fragmentos=8, fragmento_ms=50.0):
+        self.latencia_ms = latencia_ms
+        self.fragmentos = fragmentos
+        self.fragmento_ms = fragmento_ms
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server, base = _serve(self._handler())
+        self.url = f"{base}/generate"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with stub._lock:
+                    stub.requests += 1
+                prompt_tokens = (len(payload.get("prompt", "")) + 3) // 4
+                chunks = [f"## Parte {i + 1}\nConsejo financiero simulado. " for i in range(stub.fragmentos)]
+                time.sleep(stub.latencia_ms / 1000)
+                if not payload.get("stream"):
+                    time.sleep(stub.fragmento_ms * stub.fragmentos / 1000)
+                    _json_response(self, 200, {
+                        "text": "".join(chunks), "prompt_tokens": prompt_tokens,
+                        "output_tokens": sum(len(c) for c in chunks) // 4,
+                    })
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for chunk in chunks:
+                        line = (json.dumps({"text": chunk}) + "\n").encode()
+                        self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+                        self.wfile.flush()
+                        time.sleep(stub.fragmento_ms / 1000)
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # el backend canceló la generación
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+class _UsoTokens:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class _RespuestaGemini:
+    def __init__(self, payload):
+        self.text = payload["text"]
+        self.usage_metadata = _UsoTokens(payload.get("prompt_tokens", 0), payload.get("output_tokens", 0))
+
+
+class _StreamGemini:
+    """Iterable asíncrono de fragmentos; expone `_iterator` con aclose() como el SDK."""
+
+    def __init__(self, client, url, prompt):
+        self._iterator = self._fragmentos(client, url, prompt)
+
+    async def _fragmentos(self, client, url, prompt):
+        async with client.stream("POST", url, json={"prompt": prompt, "stream": True}) as response:
+            async for line in response.aiter_lines():
+                if line:
+                    yield _RespuestaGemini({"text": json.loads(line)["text"]})
+
+    def __aiter__(self):
+        return self._iterator
+
+
+class GeminiStubModel:
+    """Sustituto de genai.GenerativeModel que llama a GeminiStub (mismos métodos que usa el backend)."""
+
+    model_name = "gemini-stub"
+
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+
+    def _http(self):
+        import httpx
+
+        # Se crea perezosamente en el event loop del servidor que lo usa.
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=200))
+        return self._client
+
+    async def generate_content_async(self, prompt, stream=False):
+        if stream:
+            return _StreamGemini(self._http(), self.url, prompt)
+        response = await self._http().post(self.url, json={"prompt": prompt, "stream": False})
+        return _RespuestaGemini(response.json())
+
+    def generate_content(self, prompt):
+        import httpx
+
+        return _RespuestaGemini(httpx.post(self.url, json={"prompt": prompt, "stream": False}, timeout=120).json())
+
+
+# --- FCM ---
+def start_stub_fcm(latencia_ms, tasa_errores, tasa_muertos):
+    """
+    Servidor FCM falso. Recibe una lista de tokens por POST y, tras `latencia_ms`, responde un
+    estado por token: "ok", "unavailable" (transitorio) o "unregistered" (token muerto).
+    """
+    muertos = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            tokens = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            time.sleep(latencia_ms / 1000)
+            results = []
+            for token in tokens:
+                if token in muertos or random.random() < tasa_muertos:
+                    muertos.add(token)
+                    results.append("unregistered")
+                elif random.random() < tasa_errores:
+                    results.append("unavailable")
+                else:
+                    results.append("ok")
+            _json_response(self, 200, results)
+
+        def log_message(self, *args):
+            pass
+
+    server, base = _serve(Handler)
+    return server, f"{base}/send"
+
+
+class _FakeSendResponse:
+    def __init__(self, status):
+        self.success = status == "ok"
+        self.message_id = "stub" if self.success else None
+        self.exception = None
+        if status == "unregistered":
+            self.exception = messaging.UnregisteredError("Token no registrado")
+        elif status == "unavailable":
+            self.exception = messaging.exceptions.UnavailableError("Servicio no disponible")
+
+
+class _FakeBatchResponse:
+    def __init__(self, statuses):
+        self.responses = [_FakeSendResponse(s) for s in statuses]
+        self.success_count = sum(1 for r in self.responses if r.success)
+        self.failure_count = len(self.responses) - self.success_count
+
+
+def stub_send_each(url):
+    """Sustituto de messaging.send_each que envía el lote al servidor FCM falso."""
+    import requests
+
+    session = requests.Session()
+
+    def send_each(batch, app=None, dry_run=False):
+        statuses = session.post(url, json=[m.token for m in batch]).json()
+        return _FakeBatchResponse(statuses)
+
+    return send_each
+
+
+def stub_send(url):
+    """Sustituto de messaging.send (un mensaje) contra el servidor FCM falso."""
+    send_each = stub_send_each(url)
+
+    def send(message, app=None, dry_run=False):
+        result = send_each([message]).responses[0]
+        if not result.success:
+            raise result.exception
+        return result.message_id
+
+    return send
@@ -0,0 +1,300 @@
+# budget_alert_consumer.py
+#
+# Consumidor de larga duración de las alertas de presupuesto.
+# Un trigger de sentencia sobre 'transactions' deja eventos (usuario, categoría, mes) en
+# 'budget_alert_outbox' (migración 20261017150000_budget_alert_outbox.sql). Este proceso:
+#   1. reclama hasta BUDGET_ALERTS_BATCH_SIZE eventos con claim_budget_alert_events() (SKIP
+#      LOCKED: se pueden lanzar varios consumidores sin que se pisen);
+#   2. los agrupa por usuario y categoría y evalúa el lote entero con tres consultas en bloque
+#      (presupuestos del mes, gasto agregado y tokens FCM), en lugar de unas por transacción;
+#   3. solo notifica los presupuestos que cruzaron un umbral (80% o 100%) por encima del último
+#      notificado en el mes: claim_budget_alert_thresholds() registra el umbral de cada uno en
+#      'budget_alert_state' y devuelve los que subieron (migración 20261017170000). Así un gasto
+#      más en una categoría que ya pasó del 80% no repite la notificación;
+#   4. entrega las alertas al NotificationDispatcher en un hilo aparte y solo cuando el envío
+#      termina marca los eventos como hechos (complete_budget_alert_events()). Las alertas que no
+#      se llegan a enviar se liberan (release_budget_alert_thresholds()) para avisar en el
+#      siguiente intento. Mientras tanto ya está reclamando y evaluando el siguiente lote.
+# Si el proceso cae, los eventos reclamados vuelven a ofrecerse al caducar su lease.
+# La latencia de las alertas ya no depende de que la app llame a /check-budget-on-transaction.
+#
+# Uso (desde finanzas_backend/):
+#   python budget_alert_consumer.py            # bucle continuo
+#   python budget_alert_consumer.py --once     # vacía la cola y termina (cron)
+
+import os
+import time
+import logging
+import socket
+import signal
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import messaging
+
+from clients import close_sync
+from jobs import crear_supabase
+from notification_dispatcher import DispatchStats, crear_dispatcher, limpiar_tokens_muertos
+from observability import setup_logging, shutdown_logging
+
+BUDGET_COLUMNS = 'id, user_id, category, amount, month, year'
+
+BUDGET_ALERTS_BATCH_SIZE = int(os.getenv("BUDGET_ALERTS_BATCH_SIZE", "500"))
+# Espera entre consultas cuando la cola está vacía.
+BUDGET_ALERTS_POLL_SECONDS = float(os.getenv("BUDGET_ALERTS_POLL_SECONDS", "2"))
+# Un evento reclamado y no completado en este tiempo se vuelve a ofrecer.
+BUDGET_ALERTS_LEASE_SECONDS = int(os.getenv("BUDGET_ALERTS_LEASE_SECONDS", "120"))
+BUDGET_ALERTS_MAX_ATTEMPTS = int(os.getenv("BUDGET_ALERTS_MAX_ATTEMPTS", "5"))
+# Lotes cuyo envío puede estar en curso mientras se evalúa el siguiente.
+BUDGET_ALERTS_MAX_IN_FLIGHT = int(os.getenv("BUDGET_ALERTS_MAX_IN_FLIGHT", "2"))
+# Valores por consulta .in_() para no exceder el largo de URL de PostgREST.
+IN_CHUNK_SIZE = 100
+
+log = logging.getLogger("sasper")
+
+
+def evaluate_budget_threshold(category_name, total_spent, budget_amount):
+    """Devuelve (porcentaje gastado, título, cuerpo); título y cuerpo son None si no hay que notificar."""
+    if budget_amount == 0:
+        percentage_spent = 0
+    else:
+        percentage_spent = (total_spent / budget_amount) * 100
+
+    if 100 <= percentage_spent:
+        return percentage_spent, 'Presupuesto Excedido', f'¡Cuidado! Has superado tu presupuesto para "{category_name}".'
+    if 80 <= percentage_spent < 100:
+        return percentage_spent, 'Alerta de Presupuesto', f'Ya has utilizado el {int(percentage_spent)}% de tu presupuesto para "{category_name}".'
+    return percentage_spent, None, None
+
+
+def threshold_level(percentage_spent):
+    """Umbral alcanzado (0, 80 o 100), el que se guarda en 'budget_alert_state'."""
+    if percentage_spent >= 100:
+        return 100
+    if percentage_spent >= 80:
+        return 80
+    return 0
+
+
+def _en_trozos(values, size=IN_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class ConsumerStats:
+    """Contadores acumulados del consumidor."""
+
+    def __init__(self):
+        self.batches = 0
+        self.events = 0
+        self.evaluated = 0  # pares (usuario, categoría) tras agrupar
+        self.alerts = 0
+        self.repeated = 0  # alertas no enviadas porque el umbral ya se había notificado
+        self.without_token = 0
+        self.dispatch = DispatchStats()
+        self._lock = threading.Lock()
+
+    def summary(self):
+        coalescing = self.events / self.evaluated if self.evaluated else 0.0
+        return (
+            f"{self.batches} lotes, {self.events} eventos -> {self.evaluated} evaluaciones "
+            f"({coalescing:.1f} eventos por evaluación), {self.alerts} alertas, {self.repeated} ya notificadas, "
+            f"{self.without_token} sin token; envío: {self.dispatch.summary()}"
+        )
+
+
+class BudgetAlertConsumer:
+    """Reclama eventos del outbox por lotes, evalúa presupuestos y envía las alertas en segundo plano."""
+
+    def __init__(self, supabase=None, dispatcher=None, consumer_id=None, batch_size=BUDGET_ALERTS_BATCH_SIZE,
+                 max_in_flight=BUDGET_ALERTS_MAX_IN_FLIGHT):
+        self.supabase = supabase or crear_supabase()
+        self.dispatcher = dispatcher or crear_dispatcher()
+        self.consumer_id = consumer_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size
+        self.stats = ConsumerStats()
+        self._senders = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="budget-alerts")
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    # --- Etapa 1: reclamar ---
+    def claim(self):
+        return self.supabase.rpc("claim_budget_alert_events", {
+            "p_consumer": self.consumer_id, "p_limit": self.batch_size,
+            "p_lease_seconds": BUDGET_ALERTS_LEASE_SECONDS, "p_max_attempts": BUDGET_ALERTS_MAX_ATTEMPTS,
+        }).execute().data or []
+
+    def complete(self, ids):
+        if ids:
+            self.supabase.rpc("complete_budget_alert_events", {"p_consumer": self.consumer_id, "p_ids": ids}).execute()
+
+    def release(self, states):
+        """Deshace los cruces de umbral de alertas que no se enviaron."""
+        if states:
+            self.supabase.rpc("release_budget_alert_thresholds", {"p_rows": states}).execute()
+
+    # --- Etapa 2: agrupar y evaluar ---
+    def evaluate(self, events, today=None):
+        """
+        Devuelve (lista de (etiqueta, messaging.Message) a enviar, {etiqueta: fila de
+        budget_alert_state reclamada}) para un lote de eventos.
+        """
+        today = today or datetime.date.today()
+        # Solo alerta el mes en curso: un evento de un mes ya cerrado (lease recuperado tras el
+        # cambio de mes) se da por hecho sin evaluarlo.
+        categories_by_user = {}
+        for event in events:
+            if (event["year"], event["month"]) == (today.year, today.month):
+                categories_by_user.setdefault(event["user_id"], set()).add(event["category"])
+        self.stats.evaluated += sum(len(c) for c in categories_by_user.values())
+        if not categories_by_user:
+            return [], {}
+
+        budgets, spent = {}, {}
+        for users in _en_trozos(categories_by_user):
+            rows = self.supabase.table("budgets").select(BUDGET_COLUMNS) \
+                .in_("user_id", users).eq("year", today.year).eq("month", today.month).execute().data or []
+            for row in rows:
+                if row["category"] in categories_by_user[row["user_id"]]:
+                    budgets[(row["user_id"], row["category"])] = float(row["amount"])
+        if not budgets:
+            return [], {}
+
+        for users in _en_trozos({user_id for user_id, _ in budgets}):
+            rows = self.supabase.table("monthly_category_spend").select("user_id, category, total_spent") \
+                .in_("user_id", users).eq("year", today.year).eq("month", today.month).execute().data or []
+            for row in rows:
+                # Los gastos se guardan en negativo: se compara el importe, no el signo.
+                spent[(row["user_id"], row["category"])] = abs(float(row["total_spent"]))
+
+        levels = {}
+        alerts = {}  # user_id -> [(categoría, título, cuerpo)]
+        for (user_id, category_name), amount in budgets.items():
+            percentage_spent, title, body = evaluate_budget_threshold(
+                category_name, spent.get((user_id, category_name), 0.0), amount
+            )
+            levels[(user_id, category_name)] = threshold_level(percentage_spent)
+            if title:
+                alerts.setdefault(user_id, []).append((category_name, title, body))
+
+        tokens = {}
+        for users in _en_trozos(alerts):
+            rows = self.supabase.table("profiles").select("id, fcm_token").in_("id", users).execute().data or []
+            tokens.update({row["id"]: row["fcm_token"] for row in rows if row.get("fcm_token")})
+        for user_id, user_alerts in alerts.items():
+            if user_id not in tokens:
+                self.stats.without_token += len(user_alerts)
+
+        # Se registra el umbral de todos los presupuestos evaluados (también los que bajaron),
+        # salvo los de usuarios sin token: esos se notificarán cuando tengan uno.
+        states = [
+            {"user_id": user_id, "category": category_name, "year": today.year, "month": today.month, "threshold": level}
+            for (user_id, category_name), level in levels.items()
+            if level == 0 or user_id in tokens
+        ]
+        crossed = set()
+        for chunk in _en_trozos(states, self.batch_size):
+            rows = self.supabase.rpc("claim_budget_alert_thresholds", {"p_rows": chunk}).execute().data or []
+            crossed.update((row["user_id"], row["category"]) for row in rows)
+        self.stats.repeated += sum(
+            1 for user_id, user_alerts in alerts.items() if user_id in tokens
+            for category_name, _, _ in user_alerts if (user_id, category_name) not in crossed
+        )
+
+        notifications, claimed = [], {}
+        for user_id, user_alerts in alerts.items():
+            token = tokens.get(user_id)
+            for category_name, title, body in user_alerts:
+                if not token or (user_id, category_name) not in crossed:
+                    continue
+                label = f"{user_id}/{category_name}"
+                claimed[label] = {"user_id": user_id, "category": category_name, "year": today.year,
+                                  "month": today.month, "threshold": levels[(user_id, category_name)]}
+                notifications.append((label, messaging.Message(
+                    notification=messaging.Notification(title=title, body=body),
+                    token=token,
+                    data={'screen': 'budgets'},
+                )))
+        self.stats.alerts += len(notifications)
+        return notifications, claimed
+
+    # --- Etapa 3: enviar y completar (en segundo plano) ---
+    def _send_and_complete(self, ids, notifications, claimed):
+        try:
+            if notifications:
+                try:
+                    stats = self.dispatcher.send_all(notifications)
+                except Exception:
+                    self.release(list(claimed.values()))
+                    raise
+                # Las que fallaron no cuentan como notificadas: el próximo gasto vuelve a avisar.
+                self.release([claimed[label] for label, _ in stats.failed_items if label in claimed])
+                limpiar_tokens_muertos(self.supabase, stats, "budget_alerts")
+                with self.stats._lock:
+                    self.stats.dispatch.merge(stats)
+            self.complete(ids)
+        except Exception as e:
+            # Sin completar: los eventos se reintentan cuando caduque el lease.
+            log.error(f"budget_alerts: ❌ error enviando un lote de {len(ids)} eventos: {e}")
+        finally:
+            self._in_flight.release()
+
+    def run_once(self):
+        """Procesa un lote; devuelve cuántos eventos se reclamaron."""
+        self._in_flight.acquire()
+        try:
+            events = self.claim()
+            if not events:
+                self._in_flight.release()
+                return 0
+            notifications, claimed = self.evaluate(events)
+        except Exception:
+            self._in_flight.release()
+            raise
+        self.stats.batches += 1
+        self.stats.events += len(events)
+        self._senders.submit(self._send_and_complete, [event["id"] for event in events], notifications, claimed)
+        return len(events)
+
+    def run(self, stop_event, once=False):
+        """Bucle principal: lotes seguidos mientras haya cola; si no, espera BUDGET_ALERTS_POLL_SECONDS."""
+        log.info(f"budget_alerts: consumidor {self.consumer_id} iniciado (lotes de {self.batch_size}).")
+        while not stop_event.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                log.error(f"budget_alerts: ❌ error procesando un lote: {e}")
+                claimed = 0
+            if claimed < self.batch_size:
+                if once:
+                    break
+                stop_event.wait(BUDGET_ALERTS_POLL_SECONDS)
+
+    def close(self):
+        """Espera a que terminen los envíos en curso."""
+        self._senders.shutdown(wait=True)
+        self.dispatcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consumidor de las alertas de presupuesto (budget_alert_outbox).")
+    parser.add_argument("--once", action="store_true", help="Vacía la cola y termina en lugar de quedarse escuchando.")
+    parser.add_argument("--batch-size", type=int, default=BUDGET_ALERTS_BATCH_SIZE)
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    setup_logging()
+    start = time.perf_counter()
+    consumer = BudgetAlertConsumer(batch_size=args.batch_size)
+    try:
+        consumer.run(stop, once=args.once)
+    finally:
+        consumer.close()
+        close_sync()
+        log.info(f"budget_alerts: {consumer.stats.summary()} en {time.perf_counter() - start:.2f}s")
+        shutdown_logging()
@@ -0,0 +1,267 @@
+# clients.py
+#
+# Clientes externos (Supabase, Gemini, Firebase) creados de forma perezosa.
+# Antes main.py importaba google.generativeai y firebase_admin, leía serviceAccountKey.json y
+# creaba los clientes al importarse, así que en un arranque en frío de Render uvicorn tardaba
+# en abrir el puerto y la primera petición del móvil caducaba. Ahora:
+#   - los módulos pesados se importan la primera vez que se necesitan;
+#   - cada fábrica es thread-safe (doble comprobación con lock) y crea el cliente una sola vez;
+#   - warm_up() los crea en segundo plano una vez que el servidor ya escucha, y readiness()
+#     indica a /ready qué clientes están listos.
+#
+# Transporte HTTP compartido: Supabase (API y jobs) usa un único httpx.Client/AsyncClient por
+# proceso con keep-alive, HTTP/2 si está instalado `h2`, límites de conexiones y timeouts
+# explícitos, así el handshake TLS se paga una vez por conexión y no en cada llamada.
+# Gemini usa gRPC (un canal HTTP/2 persistente por modelo) y Firebase una sesión con pool por
+# app, así que basta con crearlos una sola vez. close_async()/close_sync() cierran todo al apagar.
+
+import asyncio
+import contextlib
+import importlib.util
+import logging
+import os
+import threading
+import time
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
+
+# Pool HTTP compartido (por proceso).
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+
+log = logging.getLogger("sasper")
+
+_lock = threading.Lock()
+_async_http = None
+_sync_http = None
+_supabase = {}  # variable de entorno de la clave -> cliente síncrono
+_supabase_async = {}  # variable de entorno de la clave -> cliente asíncrono
+_supabase_async_lock = None
+_gemini_models = {}  # nombre del modelo -> GenerativeModel
+_gemini_override = None
+_messaging = None
+# Estado por cliente para /ready: None = pendiente, True = listo, str = error.
+_status = {"supabase": None, "gemini": None}
+_warm_up_seconds = None
+
+
+def _http_options():
+    import httpx
+
+    return {
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        # HTTP/2 multiplexa las peticiones concurrentes en una sola conexión; requiere el paquete h2.
+        "http2": importlib.util.find_spec("h2") is not None,
+        # HTTP_VERIFY_SSL=false solo para redes locales con proxy que intercepta TLS.
+        "verify": os.getenv("HTTP_VERIFY_SSL", "true").lower() != "false",
+    }
+
+
+def get_async_http():
+    """httpx.AsyncClient compartido por el proceso (se cierra con close_async)."""
+    global _async_http
+    if _async_http is None:
+        import httpx
+
+        _async_http = httpx.AsyncClient(**_http_options())
+    return _async_http
+
+
+def get_sync_http():
+    """httpx.Client compartido y thread-safe para los jobs y el backend síncrono (se cierra con close_sync)."""
+    global _sync_http
+    if _sync_http is not None:
+        return _sync_http
+    with _lock:
+        if _sync_http is None:
+            import httpx
+
+            _sync_http = httpx.Client(**_http_options())
+    return _sync_http
+
+
+def get_supabase(key_env="SUPABASE_KEY"):
+    """
+    Cliente síncrono de Supabase sobre el transporte compartido. `key_env` elige la clave
+    (SUPABASE_SERVICE_KEY en los jobs); se crea un cliente por clave y se reutiliza.
+    """
+    client = _supabase.get(key_env)
+    if client is not None:
+        return client
+    http = get_sync_http()
+    with _lock:
+        if key_env not in _supabase:
+            from supabase import create_client
+            from supabase.lib.client_options import ClientOptions
+
+            url, key = os.getenv("SUPABASE_URL"), os.getenv(key_env)
+            if not all([url, key]):
+                raise RuntimeError(f"Faltan variables de entorno (SUPABASE_URL o {key_env}).")
+            _supabase[key_env] = create_client(url, key, options=ClientOptions(httpx_client=http))
+    return _supabase[key_env]
+
+
+async def get_supabase_async(key_env="SUPABASE_KEY"):
+    """
+    Cliente asíncrono de Supabase (se crea en el event loop de la aplicación la primera vez).
+    Como en get_supabase, `key_env` elige la clave: la API usa SUPABASE_SERVICE_KEY para las
+    RPC y tablas que solo expone al backend (resumen precalculado, análisis pregenerados).
+    """
+    global _supabase_async_lock
+    client = _supabase_async.get(key_env)
+    if client is not None:
+        return client
+    if _supabase_async_lock is None:
+        _supabase_async_lock = asyncio.Lock()
+    async with _supabase_async_lock:
+        if key_env not in _supabase_async:
+            from supabase import acreate_client
+            from supabase.lib.client_options import AsyncClientOptions
+
+            url, key = os.getenv("SUPABASE_URL"), os.getenv(key_env)
+            try:
+                if not all([url, key]):
+                    raise RuntimeError(f"Faltan variables de entorno (SUPABASE_URL o {key_env}).")
+                _supabase_async[key_env] = await acreate_client(
+                    url, key, options=AsyncClientOptions(httpx_client=get_async_http()),
+                )
+            except Exception as e:
+                if key_env == "SUPABASE_KEY":
+                    _status["supabase"] = str(e)
+                raise
+            if key_env == "SUPABASE_KEY":
+                _status["supabase"] = True
+            log.info(f"✅ Cliente asíncrono de Supabase ({key_env}) inicializado.")
+    return _supabase_async[key_env]
+
+
+def get_gemini_model(name=GEMINI_MODEL):
+    """Modelo de Gemini por nombre; importa y configura google.generativeai solo en el primer uso."""
+    if _gemini_override is not None:
+        return _gemini_override
+    model = _gemini_models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        if name not in _gemini_models:
+            import google.generativeai as genai
+
+            try:
+                genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                _gemini_models[name] = genai.GenerativeModel(name)
+            except Exception as e:
+                _status["gemini"] = str(e)
+                raise
+            _status["gemini"] = True
+            log.info(f"✅ Cliente de Gemini inicializado con el modelo: {_gemini_models[name].model_name}")
+    return _gemini_models[name]
+
+
+def get_messaging():
+    """Módulo firebase_admin.messaging con la app de Firebase ya inicializada."""
+    global _messaging
+    if _messaging is not None:
+        return _messaging
+    with _lock:
+        if _messaging is None:
+            import firebase_admin
+            from firebase_admin import credentials, messaging
+
+            try:
+                if not firebase_admin._apps:
+                    cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS", "serviceAccountKey.json"))
+                    # La app mantiene su sesión HTTP (con pool) para todos los envíos; solo fijamos el timeout.
+                    firebase_admin.initialize_app(cred, options={"httpTimeout": HTTP_TIMEOUT})
+                _status["firebase"] = True
+                log.info("Firebase Admin SDK inicializado correctamente.")
+            except Exception as e:
+                # Como antes: sin credenciales el servidor sigue arrancando y los envíos fallan.
+                _status["firebase"] = str(e)
+                log.error(f"Error al inicializar Firebase Admin SDK: {e}")
+            _messaging = messaging
+    return _messaging
+
+
+async def aget_gemini_model(name=GEMINI_MODEL):
+    """Como get_gemini_model, pero si aún no existe lo crea en un hilo para no bloquear el event loop."""
+    model = _gemini_override or _gemini_models.get(name)
+    return model if model is not None else await asyncio.to_thread(get_gemini_model, name)
+
+
+def set_gemini_model(model):
+    """Sustituye todos los modelos por `model` (benchmarks con servicios simulados)."""
+    global _gemini_override
+    _gemini_override = model
+    _status["gemini"] = True
+
+
+async def warm_up():
+    """Crea todos los clientes; se lanza en segundo plano al arrancar para no retrasar el bind."""
+    global _warm_up_seconds
+    start = time.perf_counter()
+    # Firebase ya no se precalienta: la API no envía notificaciones (las envían los jobs y el
+    # consumidor de alertas de presupuesto, que lo inicializan con get_messaging()).
+    for name, factory in (("supabase", get_supabase_async), ("gemini", aget_gemini_model)):
+        try:
+            await factory()
+        except Exception as e:
+            log.error(f"Error precalentando el cliente de {name}: {e}")
+    _warm_up_seconds = time.perf_counter() - start
+    log.info(f"🔥 Clientes precalentados en {_warm_up_seconds:.2f}s.")
+
+
+def readiness():
+    """(listo, detalle) para /ready: listo cuando Supabase y Gemini están creados."""
+    ready = _status["supabase"] is True and _status["gemini"] is True
+    detail = {name: ("ok" if state is True else "pendiente" if state is None else f"error: {state}")
+              for name, state in _status.items()}
+    detail["warm_up_seconds"] = round(_warm_up_seconds, 3) if _warm_up_seconds is not None else None
+    return ready, detail
+
+
+async def close_async():
+    """Cierra el transporte asíncrono compartido (al apagar la API)."""
+    global _async_http, _supabase_async_lock
+    if _async_http is not None:
+        await _async_http.aclose()
+    _async_http = None
+    _supabase_async.clear()
+    _supabase_async_lock = None
+    _status["supabase"] = None
+    close_sync()
+
+
+def close_sync():
+    """Cierra el transporte síncrono compartido (al terminar un job o apagar la API)."""
+    global _sync_http
+    with _lock:
+        if _sync_http is not None:
+            _sync_http.close()
+        _sync_http = None
+        _supabase.clear()
+
+
+@contextlib.asynccontextmanager
+async def client_lifespan():
+    """
+    Ciclo de vida de los clientes para el lifespan de FastAPI: lanza el precalentamiento en
+    segundo plano (sin retrasar el bind del puerto) y al apagar cierra el transporte compartido.
+    """
+    warm_up_task = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        if not warm_up_task.done():
+            warm_up_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await warm_up_task
+        await close_async()
+        log.info("🔌 Conexiones HTTP compartidas cerradas.")
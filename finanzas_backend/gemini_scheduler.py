@@ -0,0 +1,318 @@
+# gemini_scheduler.py
+#
+# Planificador de las llamadas a Gemini de la API, consciente de la cuota del proyecto.
+# Sustituye al semáforo de concurrencia de main.py:
+#   - un token bucket global de peticiones por minuto y otro de tokens por minuto, dimensionados
+#     a la cuota (GEMINI_REQUESTS_PER_MINUTE / GEMINI_TOKENS_PER_MINUTE), además del tope de
+#     generaciones simultáneas (GEMINI_MAX_CONCURRENCY);
+#   - un bucket por usuario (GEMINI_USER_REQUESTS_PER_MINUTE, ráfaga GEMINI_USER_BURST), para
+#     que un solo usuario no agote la cuota de todos;
+#   - dos colas con prioridad estricta: las peticiones interactivas pasan siempre por delante
+#     de las de segundo plano (BATCH: la pregeneración nocturna, que entra por el endpoint
+#     interno /internal/analisis-pregenerado; el cliente nunca elige la prioridad);
+#   - rechazo temprano: si la cola está llena o la espera estimada supera el máximo, la petición
+#     se rechaza al momento con GeminiOverloaded (la API responde 429 con Retry-After) en lugar
+#     de quedarse esperando hasta agotar el timeout del cliente;
+#   - si Gemini devuelve error de cuota (429) pese a todo, se pausa el bucket global
+#     GEMINI_QUOTA_BACKOFF_SECONDS;
+#   - las llamadas extra del router (hedge al modelo rápido, respaldo por cuota) también se
+#     cobran a los buckets globales con Ticket.charge_extra().
+# Profundidad de las colas, esperas y rechazos se exportan en /metrics (observability.py).
+# Como pregenerate_analyses.py genera a través de la API, toda la cuota de Gemini del proyecto
+# pasa por este planificador: GEMINI_REQUESTS_PER_MINUTE es la cuota completa.
+
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+
+from model_router import is_quota_error
+from observability import GEMINI_QUEUE_DEPTH, GEMINI_QUEUE_WAIT, GEMINI_SHED
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "150"))
+GEMINI_TOKENS_PER_MINUTE = float(os.getenv("GEMINI_TOKENS_PER_MINUTE", "2000000"))
+# Ráfaga máxima de los buckets globales, en segundos de cuota: con un minuto entero se podría
+# lanzar toda la cuota de golpe y Gemini la rechazaría igualmente.
+GEMINI_BURST_SECONDS = float(os.getenv("GEMINI_BURST_SECONDS", "10"))
+GEMINI_USER_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_USER_REQUESTS_PER_MINUTE", "6"))
+GEMINI_USER_BURST = int(os.getenv("GEMINI_USER_BURST", "3"))
+GEMINI_QUEUE_MAX = {
+    INTERACTIVE: int(os.getenv("GEMINI_QUEUE_MAX_INTERACTIVE", "100")),
+    BATCH: int(os.getenv("GEMINI_QUEUE_MAX_BATCH", "500")),
+}
+GEMINI_MAX_QUEUE_WAIT_SECONDS = {
+    INTERACTIVE: float(os.getenv("GEMINI_MAX_QUEUE_WAIT_SECONDS", "20")),
+    BATCH: float(os.getenv("GEMINI_MAX_QUEUE_WAIT_BATCH_SECONDS", "120")),
+}
+# Tokens de salida que se reservan por petición hasta conocer el uso real.
+GEMINI_EXPECTED_OUTPUT_TOKENS = int(os.getenv("GEMINI_EXPECTED_OUTPUT_TOKENS", "1500"))
+GEMINI_QUOTA_BACKOFF_SECONDS = float(os.getenv("GEMINI_QUOTA_BACKOFF_SECONDS", "30"))
+# Buckets por usuario que se conservan (los menos recientes se descartan: vuelven llenos).
+USER_BUCKETS_MAX = 10000
+
+
+class GeminiOverloaded(Exception):
+    """Petición rechazada antes de llegar a Gemini; `retry_after` en segundos para la cabecera Retry-After."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Gemini saturado ({reason}); reintenta en {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def estimate_tokens(prompt):
+    """Tokens reservados para una petición: ~4 caracteres por token de entrada más la salida esperada."""
+    return len(prompt) // 4 + GEMINI_EXPECTED_OUTPUT_TOKENS
+
+
+class TokenBucket:
+    """Bucket de `per_minute` unidades por minuto con capacidad `burst`; per_minute <= 0 es ilimitado."""
+
+    def __init__(self, per_minute, burst=None, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst if burst is not None else per_minute)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount=1):
+        """Segundos hasta poder tomar `amount` (0 si ya se puede)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        # Una petición mayor que la capacidad pasa con el bucket lleno (si no, no pasaría nunca).
+        missing = min(amount, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount=1):
+        if self.rate > 0:
+            self._refill()
+            self.tokens -= amount
+
+
+class Ticket:
+    """Turno de una petición; `async with ticket:` espera a que el planificador la deje pasar."""
+
+    def __init__(self, scheduler, user_id, priority, tokens):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.priority = priority
+        self.tokens = tokens
+        self.granted = False
+        self._error = None
+        self._future = None
+        self._enqueued_at = None
+
+    async def acquire(self):
+        """Espera el turno; GeminiOverloaded si la cola se llenó o se agotó la espera máxima."""
+        if not self.granted:
+            await self.scheduler._wait(self)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.scheduler._release(self, exc or self._error)
+        return False
+
+    def record_error(self, error):
+        """Error de Gemini capturado dentro del bloque (p. ej. en streaming) que debe contar al liberar el turno."""
+        self._error = error
+
+    def charge_extra(self, *_):
+        """
+        Cobra a los buckets globales otra llamada a Gemini dentro del mismo turno (hedge o
+        respaldo del router): una petición más y los tokens estimados de este prompt.
+        """
+        self.scheduler._requests.take(1)
+        self.scheduler._tokens.take(self.tokens)
+        self.scheduler._counters["extra_calls"] += 1
+
+    def record_usage(self, usage_metadata):
+        """Ajusta el bucket de tokens con el uso real que devuelve Gemini (usage_metadata)."""
+        total = getattr(usage_metadata, "total_token_count", None)
+        if total:
+            self.scheduler._tokens.take(total - self.tokens)
+            self.tokens = total
+
+
+class GeminiScheduler:
+    """Admisión por usuario, colas por prioridad y buckets globales de la cuota de Gemini (un solo event loop)."""
+
+    def __init__(self, max_concurrency, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=GEMINI_TOKENS_PER_MINUTE, user_requests_per_minute=GEMINI_USER_REQUESTS_PER_MINUTE,
+                 user_burst=GEMINI_USER_BURST, burst_seconds=GEMINI_BURST_SECONDS, queue_max=None, max_wait=None,
+                 quota_backoff=GEMINI_QUOTA_BACKOFF_SECONDS, clock=time.monotonic):
+        self.max_concurrency = max_concurrency
+        self.user_requests_per_minute = user_requests_per_minute
+        self.user_burst = user_burst
+        self.queue_max = queue_max or GEMINI_QUEUE_MAX
+        self.max_wait = max_wait or GEMINI_MAX_QUEUE_WAIT_SECONDS
+        self.quota_backoff = quota_backoff
+        self._clock = clock
+        self._requests = TokenBucket(requests_per_minute, max(1.0, requests_per_minute * burst_seconds / 60), clock=clock)
+        self._tokens = TokenBucket(tokens_per_minute, tokens_per_minute * burst_seconds / 60, clock=clock)
+        self._users = OrderedDict()
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self._active = 0
+        self._paused_until = 0.0
+        self._timer = None
+        self._counters = {"admitted": 0, "granted": 0, "extra_calls": 0, "quota_errors": 0,
+                          "shed": {reason: 0 for reason in ("user_limit", "queue_full", "queue_wait", "queue_timeout")}}
+        self._waits = {priority: deque(maxlen=500) for priority in PRIORITIES}
+
+    # --- Admisión (síncrona: se decide antes de empezar a responder) ---
+    def admit(self, user_id, prompt, priority=INTERACTIVE):
+        """
+        Devuelve un Ticket o lanza GeminiOverloaded si el usuario superó su límite, la cola de
+        su prioridad está llena o la espera estimada supera el máximo.
+        """
+        if len(self._queues[priority]) >= self.queue_max[priority]:
+            self._shed("queue_full", priority)
+            raise GeminiOverloaded("cola llena", self._retry_after(self._estimated_wait(priority)))
+        wait = self._estimated_wait(priority)
+        if wait > self.max_wait[priority]:
+            self._shed("queue_wait", priority)
+            raise GeminiOverloaded("espera estimada excesiva", self._retry_after(wait))
+
+        bucket = self._user_bucket(user_id)
+        user_delay = bucket.delay(1)
+        if user_delay > 0:
+            self._shed("user_limit", priority)
+            raise GeminiOverloaded("límite por usuario", self._retry_after(user_delay))
+        bucket.take(1)
+        self._counters["admitted"] += 1
+        return Ticket(self, user_id, priority, estimate_tokens(prompt))
+
+    def _user_bucket(self, user_id):
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.user_requests_per_minute, self.user_burst, clock=self._clock)
+            if len(self._users) > USER_BUCKETS_MAX:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return bucket
+
+    def _estimated_wait(self, priority):
+        """Espera aproximada de una petición nueva: la pausa por cuota y los turnos que tiene delante."""
+        ahead = len(self._queues[INTERACTIVE]) + (len(self._queues[BATCH]) if priority == BATCH else 0)
+        next_slot = self._requests.delay(1)  # también recarga el bucket
+        rate = self._requests.rate
+        by_rate = (ahead + 1 - self._requests.tokens) / rate if rate > 0 else 0.0
+        return max(0.0, self._paused_until - self._clock(), by_rate, next_slot)
+
+    @staticmethod
+    def _retry_after(seconds):
+        return max(1, math.ceil(seconds))
+
+    def _shed(self, reason, priority):
+        self._counters["shed"][reason] += 1
+        GEMINI_SHED.inc(reason=reason, priority=priority)
+
+    # --- Cola ---
+    async def _wait(self, ticket):
+        queue = self._queues[ticket.priority]
+        if len(queue) >= self.queue_max[ticket.priority]:
+            self._shed("queue_full", ticket.priority)
+            raise GeminiOverloaded("cola llena", self._retry_after(self._estimated_wait(ticket.priority)))
+        ticket._future = asyncio.get_running_loop().create_future()
+        ticket._enqueued_at = self._clock()
+        queue.append(ticket)
+        GEMINI_QUEUE_DEPTH.inc(priority=ticket.priority)
+        self._pump()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket._future), timeout=self.max_wait[ticket.priority])
+        except BaseException as e:
+            if ticket.granted:
+                if isinstance(e, asyncio.TimeoutError):
+                    return  # concedido justo al vencer la espera: se usa
+                self._release(ticket, None)
+            else:
+                queue.remove(ticket)
+                GEMINI_QUEUE_DEPTH.dec(priority=ticket.priority)
+            if isinstance(e, asyncio.TimeoutError):
+                self._shed("queue_timeout", ticket.priority)
+                raise GeminiOverloaded("tiempo máximo en cola", self._retry_after(self._estimated_wait(ticket.priority)))
+            raise
+
+    def _head(self):
+        for priority in PRIORITIES:
+            if self._queues[priority]:
+                return self._queues[priority][0]
+        return None
+
+    def _pump(self):
+        """Concede turnos en orden de prioridad mientras haya concurrencia y cuota; si falta cuota, se reprograma."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._active < self.max_concurrency:
+            ticket = self._head()
+            if ticket is None:
+                return
+            delay = max(self._paused_until - self._clock(), self._requests.delay(1), self._tokens.delay(ticket.tokens))
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+                return
+            self._queues[ticket.priority].popleft()
+            GEMINI_QUEUE_DEPTH.dec(priority=ticket.priority)
+            self._requests.take(1)
+            self._tokens.take(ticket.tokens)
+            self._active += 1
+            ticket.granted = True
+            waited = self._clock() - ticket._enqueued_at
+            GEMINI_QUEUE_WAIT.observe(waited, priority=ticket.priority)
+            self._waits[ticket.priority].append(waited)
+            self._counters["granted"] += 1
+            ticket._future.set_result(None)
+
+    def _release(self, ticket, error):
+        if not ticket.granted:
+            return
+        ticket.granted = False
+        self._active -= 1
+        if error is not None and is_quota_error(error):
+            # Gemini ya está limitando: se pausa todo el tráfico en lugar de insistir.
+            self._counters["quota_errors"] += 1
+            self._paused_until = max(self._paused_until, self._clock() + self.quota_backoff)
+        self._pump()
+
+    def quota_retry_after(self):
+        """Segundos hasta que se reanuda el tráfico tras un error de cuota (para Retry-After)."""
+        return self._retry_after(max(self._paused_until - self._clock(), self.quota_backoff))
+
+    def stats(self):
+        def percentile(values, q):
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(q * len(values)))], 3) if values else None
+
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": {priority: len(queue) for priority, queue in self._queues.items()},
+            "queue_wait_seconds": {
+                priority: {"p50": percentile(waits, 0.5), "p95": percentile(waits, 0.95)}
+                for priority, waits in self._waits.items()
+            },
+            "paused_for_seconds": round(max(0.0, self._paused_until - self._clock()), 1),
+            "requests_per_minute": self._requests.rate * 60,
+            "tokens_per_minute": self._tokens.rate * 60,
+            "user_requests_per_minute": self.user_requests_per_minute,
+            "admitted": self._counters["admitted"],
+            "granted": self._counters["granted"],
+            "extra_calls": self._counters["extra_calls"],
+            "quota_errors": self._counters["quota_errors"],
+            "shed": dict(self._counters["shed"]),
+        }
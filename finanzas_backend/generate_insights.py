@@ -0,0 +1,206 @@
+# generate_insights.py
+#
+# Motor por lotes de los insights diarios. Sustituye al bucle de la Edge Function
+# generate-user-insights, que por cada perfil y cada tipo de insight hacía una consulta de
+# "insight reciente", una RPC y un insert (varios viajes de ida y vuelta por usuario y tipo).
+#
+# Ahora, por cada tipo de insight:
+#   1. insight_candidates() lo calcula para todos los usuarios con una consulta de conjunto,
+#      en páginas de INSIGHTS_PAGE_SIZE usuarios (keyset por user_id, particionable con --shard);
+#   2. aquí se redactan los textos de la página entera;
+#   3. insert_insights_batch() la inserta de una vez y descarta los repetidos con un solo
+#      anti-join (mismo usuario, tipo y clave dentro de la ventana del tipo).
+# Son dos llamadas por página en lugar de varias por usuario, y volver a ejecutarlo no duplica.
+#
+# Se programa en el mismo cron externo que send_reminders.py (antes: pg_cron a las 05:00 UTC).
+
+import os
+import time
+import logging
+import argparse
+import datetime
+
+from clients import close_sync
+from jobs import crear_supabase, nombre_job, paginar, parse_shard
+from observability import setup_logging, shutdown_logging
+
+log = logging.getLogger("sasper")
+
+INSIGHTS_PAGE_SIZE = int(os.getenv("INSIGHTS_PAGE_SIZE", "1000"))
+
+
+def _monto(value):
+    value = float(value or 0)
+    return f"-${abs(value):.0f}" if value < 0 else f"${value:.0f}"
+
+
+def _comparacion_semanal(item):
+    change = float(item["percentage_change"])
+    subio = change > 0
+    return {
+        "severity": "warning" if subio else "success",
+        "title": f"Tu gasto semanal {'subió' if subio else 'bajó'} un {abs(change):.0f}%",
+        "description": f"La semana pasada gastaste {_monto(item['current'])}, "
+                       f"frente a {_monto(item['previous'])} la semana anterior.",
+        "metadata": {"percentage_change": change},
+    }
+
+
+def _categoria_principal(item):
+    return {
+        "severity": "info",
+        "title": f"Mayor Gasto: {item['category']}",
+        "description": f"Este mes, tu principal gasto ha sido en \"{item['category']}\", "
+                       f"con un total de {_monto(item['total_spent'])}.",
+        "metadata": {"category": item["category"]},
+    }
+
+
+def _comparacion_ahorro(item):
+    savings, previous = float(item["savings"]), float(item["previous_savings"])
+    return {
+        "severity": "success" if savings >= previous else "warning",
+        "title": f"Ahorro del mes pasado: {_monto(savings)}",
+        "description": f"El mes pasado tu balance fue de {_monto(savings)}, "
+                       f"frente a {_monto(previous)} el mes anterior.",
+        "metadata": {"savings": savings, "previous_savings": previous},
+    }
+
+
+def _presupuesto_superado(item):
+    return {
+        "severity": "warning",
+        "title": f"Presupuesto superado: {item['category']}",
+        "description": f"Llevas {_monto(item['spent'])} gastados en \"{item['category']}\" este mes, "
+                       f"sobre un presupuesto de {_monto(item['amount'])}.",
+        "metadata": {"budget_id": item["budget_id"], "category": item["category"]},
+    }
+
+
+def _pago_proximo(item):
+    due = datetime.date.fromisoformat(str(item["next_due_date"])[:10])
+    return {
+        "severity": "info",
+        "title": f"Próximo pago: {item['description']}",
+        "description": f"Tu pago recurrente de {_monto(abs(float(item['amount'])))} vence el {due.day}/{due.month}.",
+        "metadata": {"next_due_date": due.isoformat()},
+    }
+
+
+def _saldo_bajo(item):
+    return {
+        "severity": "warning",
+        "title": f"Saldo bajo en \"{item['account_name']}\"",
+        "description": f"El saldo actual de tu cuenta es de {_monto(item['current_balance'])}.",
+        "metadata": {"account_name": item["account_name"]},
+    }
+
+
+def _hito_meta(item):
+    return {
+        "severity": "success",
+        "title": "¡Meta a la vista!",
+        "description": f"¡Felicidades! Has superado el {item['milestone']}% de tu meta \"{item['goal_name']}\".",
+        "metadata": {"goal_name": item["goal_name"], "milestone": item["milestone"]},
+    }
+
+
+# tipo -> (días en los que no se repite un insight con la misma clave, redacción)
+INSIGHT_TYPES = {
+    "weekly_spending_comparison": (7, _comparacion_semanal),
+    "top_spending_category": (30, _categoria_principal),
+    "monthly_savings_comparison": (30, _comparacion_ahorro),
+    "budget_exceeded": (7, _presupuesto_superado),
+    "upcoming_payment": (7, _pago_proximo),
+    "low_balance_warning": (7, _saldo_bajo),
+    "goal_milestone": (365, _hito_meta),
+}
+
+
+class InsightStats:
+    """Resumen de una ejecución: candidatos, insertados y descartados por repetidos, por tipo."""
+
+    def __init__(self):
+        self.by_type = {}
+        self.errors = []  # (tipo, detalle)
+        self.elapsed = 0.0
+
+    def add(self, insight_type, candidates, inserted):
+        counts = self.by_type.setdefault(insight_type, {"candidates": 0, "inserted": 0, "pages": 0})
+        counts["candidates"] += candidates
+        counts["inserted"] += inserted
+        counts["pages"] += 1
+
+    @property
+    def inserted(self):
+        return sum(c["inserted"] for c in self.by_type.values())
+
+    @property
+    def candidates(self):
+        return sum(c["candidates"] for c in self.by_type.values())
+
+    def summary(self):
+        return (f"{self.candidates} candidatos, {self.inserted} insertados, "
+                f"{self.candidates - self.inserted} repetidos, {len(self.errors)} tipos con error, {self.elapsed:.2f}s")
+
+
+def _construir_insights(insight_type, rows):
+    """Redacta los insights de una página de candidatos (una fila por usuario, varios elementos)."""
+    dedupe_days, redactar = INSIGHT_TYPES[insight_type]
+    return [
+        {"user_id": row["user_id"], "type": insight_type, "dedupe_key": str(item["key"]),
+         "dedupe_days": dedupe_days, **redactar(item)}
+        for row in rows
+        for item in row["items"]
+    ]
+
+
+def generate_insights(shard=(0, 1), types=None, page_size=INSIGHTS_PAGE_SIZE, supabase=None):
+    """
+    Calcula e inserta los insights de `types` (todos por defecto) para todos los usuarios de la
+    partición `shard=(i, n)`. Un fallo en un tipo no impide generar los demás.
+    """
+    job = nombre_job("generate_insights", shard)
+    supabase = supabase or crear_supabase()
+    stats = InsightStats()
+    start = time.perf_counter()
+
+    for insight_type in types or INSIGHT_TYPES:
+        def fetch_page(after_id, limit):
+            return supabase.rpc("insight_candidates", {
+                "p_type": insight_type, "p_after_id": after_id, "p_limit": limit,
+                "p_shard_index": shard[0], "p_shard_count": shard[1],
+            }).execute().data
+
+        try:
+            for rows in paginar(fetch_page, None, page_size):
+                insights = _construir_insights(insight_type, rows)
+                inserted = supabase.rpc("insert_insights_batch", {"p_rows": insights}).execute().data or 0
+                stats.add(insight_type, len(insights), inserted)
+        except Exception as e:
+            log.error(f"{job}: ❌ error generando '{insight_type}': {e}")
+            stats.errors.append((insight_type, str(e)))
+            continue
+        counts = stats.by_type.get(insight_type, {"candidates": 0, "inserted": 0})
+        log.info(f"{job}: ✅ {insight_type}: {counts['inserted']} nuevos de {counts['candidates']} candidatos.")
+
+    stats.elapsed = time.perf_counter() - start
+    log.info(f"{job}: {stats.summary()}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera los insights diarios de todos los usuarios por lotes.")
+    parser.add_argument("--shard", type=parse_shard, default=(0, 1),
+                        help="Partición i/N por hash de user_id (para N instancias de cron).")
+    parser.add_argument("--types", type=lambda value: value.split(","), default=None,
+                        help=f"Tipos a generar, separados por comas (por defecto: {','.join(INSIGHT_TYPES)}).")
+    parser.add_argument("--page-size", type=int, default=INSIGHTS_PAGE_SIZE)
+    args = parser.parse_args()
+
+    setup_logging()
+    try:
+        generate_insights(args.shard, args.types, args.page_size)
+    finally:
+        close_sync()
+        shutdown_logging()
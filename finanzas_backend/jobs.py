@@ -0,0 +1,86 @@
+# jobs.py
+#
+# Piezas comunes de los jobs por lotes (send_reminders.py, generate_insights.py,
+# pregenerate_analyses.py, budget_alert_consumer.py): cliente de Supabase con la clave de
+# servicio, recorrido por keyset, checkpoint por job y partición (--shard i/N).
+# Vivían en send_reminders.py, así que cualquier job que las usaba importaba también
+# firebase_admin; aquí no se importa nada pesado.
+
+import argparse
+import json
+import os
+
+from clients import get_supabase
+
+# Directorio con un fichero por job (y partición) con el último id procesado, para reanudar
+# una ejecución caída. Un fichero por job evita que workers en paralelo se pisen.
+# (Mantiene el nombre de la variable de entorno de cuando solo lo usaban los recordatorios.)
+REMINDERS_CHECKPOINT_DIR = os.getenv("REMINDERS_CHECKPOINT_DIR", ".reminders_checkpoints")
+
+
+def crear_supabase():
+    # Usamos la clave de servicio para tener acceso total. El cliente se comparte entre jobs y
+    # páginas (mismo pool HTTP con keep-alive, ver clients.py); se cierra con close_sync().
+    return get_supabase("SUPABASE_SERVICE_KEY")
+
+
+# --- Checkpoint: último id procesado por job y fecha de ejecución ---
+def _ruta_checkpoint(job):
+    safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in job)
+    return os.path.join(REMINDERS_CHECKPOINT_DIR, f"{safe_name}.json")
+
+
+def leer_checkpoint(job, run_key):
+    try:
+        with open(_ruta_checkpoint(job)) as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    # Un checkpoint de otro día no aplica: los datos de hoy son otros.
+    if entry.get("run_key") == run_key:
+        return entry.get("last_id")
+    return None
+
+
+def guardar_checkpoint(job, run_key, last_id):
+    path = _ruta_checkpoint(job)
+    if last_id is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(REMINDERS_CHECKPOINT_DIR, exist_ok=True)
+    # Escritura atómica: un proceso que muere a mitad no deja el fichero corrupto.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"run_key": run_key, "last_id": last_id}, f)
+    os.replace(tmp_path, path)
+
+
+# --- Lectura paginada por keyset ---
+def paginar(fetch_page, after_id, page_size):
+    """
+    Genera páginas de filas ordenadas por id. Cada consulta pide `id > after_id`, así que no se
+    pierde nada por el límite de filas de PostgREST y el coste no crece con el offset.
+    """
+    while True:
+        rows = fetch_page(after_id, page_size)
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1]["id"]
+        if len(rows) < page_size:
+            return
+
+
+# --- Particiones ---
+def nombre_job(job, shard):
+    """Nombre del job para logs y checkpoint; cada partición guarda su propio checkpoint."""
+    return job if shard[1] <= 1 else f"{job}[{shard[0]}/{shard[1]}]"
+
+
+def parse_shard(value):
+    """Tipo de argparse para --shard i/N."""
+    index, count = (int(part) for part in value.split("/"))
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("El formato es i/N con 0 <= i < N")
+    return index, count
@@ -1,14 +1,24 @@
 # main.py
 
 import os
+import hmac
 import json
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Query,Request
-from supabase import create_client, Client
-import google.generativeai as genai
-import firebase_admin
-from firebase_admin import credentials, messaging
-from fastapi.responses import JSONResponse # Opcional, para control avanzado
+from fastapi.responses import JSONResponse, StreamingResponse # Opcional, para control avanzado
+
+import analytics
+from analysis_cache import build_cache_key, build_data_key, cache_from_env
+from prompt_builder import apply_summary_defaults, build_analysis_prompt
+from gemini_scheduler import BATCH, GeminiOverloaded, GeminiScheduler
+from model_router import ModelRouter, is_quota_error
+from single_flight import SingleFlight, request_key
+from transaction_import import StatementError, StatementImporter, StatementTooLargeError
+from clients import GEMINI_MODEL, client_lifespan, get_gemini_model, get_supabase_async, readiness
+from observability import STAGE_ERRORS, install_http_instrumentation, setup_logging, shutdown_logging, span
 
 
 # --- 1. CONFIGURACIÓN INICIAL Y CLIENTES ---
@@ -16,141 +26,516 @@ from fastapi.responses import JSONResponse # Opcional, para control avanzado
 # Render usará sus propias variables de entorno configuradas en el dashboard.
 load_dotenv()
 
-# --- Configuración del cliente de Supabase (con el fix de SSL para desarrollo local) ---
+# Logging encolado (un hilo aparte escribe en stdout) con el request-id en cada línea.
+log = setup_logging()
+
+# Supabase y Gemini se crean de forma perezosa y se precalientan en segundo plano
+# después de que uvicorn abre el puerto, para que el arranque en frío responda cuanto antes.
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
 if not supabase_url or not supabase_key:
     raise RuntimeError("Credenciales de Supabase no encontradas en las variables de entorno.")
 
-# Creamos la opción para deshabilitar la verificación SSL.
-# Es útil para algunos entornos de desarrollo locales y no daña la producción.
-supabase: Client = create_client(supabase_url, supabase_key)
-print("✅ Cliente de Supabase inicializado.")
-
-try:
-    cred = credentials.Certificate("serviceAccountKey.json") # Asumimos que el archivo estará ahí
-    firebase_admin.initialize_app(cred)
-    print("Firebase Admin SDK inicializado correctamente.")
-except Exception as e:
-    print(f"Error al inicializar Firebase Admin SDK: {e}")
-
-# --- Configuración del cliente de Google Gemini ---
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-if not gemini_api_key:
+if not os.getenv("GEMINI_API_KEY"):
     raise RuntimeError("No se encontró la API Key de Gemini en las variables de entorno.")
-genai.configure(api_key=gemini_api_key)
-# Usamos el modelo que sabemos que funciona para ti
-gemini_model = genai.GenerativeModel('gemini-2.5-pro') 
-print(f"✅ Cliente de Gemini inicializado con el modelo: {gemini_model.model_name}")
+
+# Límite de generaciones simultáneas contra Gemini. Las peticiones que excedan el límite
+# esperan su turno sin bloquear el event loop (el resto de endpoints sigue respondiendo).
+# El planificador añade la cuota por minuto, el límite por usuario y la prioridad de las
+# peticiones interactivas sobre las de segundo plano (gemini_scheduler.py).
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+gemini_scheduler = GeminiScheduler(GEMINI_MAX_CONCURRENCY)
+
+# Enrutado de modelos: el rápido para prompts simples o pequeños, el pro para el contexto
+# enriquecido, con petición de respaldo al rápido si el pro tarda y cambio de modelo por cuota.
+# El modelo pro se crea en warm_up(); el rápido, en su primer uso (genai ya está importado).
+model_router = ModelRouter(get_gemini_model, pro_model=GEMINI_MODEL)
+
+# Token compartido con los jobs internos (pregenerate_analyses.py). Sin él configurado, los
+# endpoints /internal/* rechazan todas las peticiones.
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN")
+
+# Caché de análisis: evita regenerar con Gemini cuando las entradas del prompt no cambiaron.
+analysis_cache = cache_from_env()
+
+# Single-flight: peticiones idénticas concurrentes comparten consulta y generación.
+analysis_flights = SingleFlight()
+preparation_flights = SingleFlight()
 
 # --- 2. APLICACIÓN API ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Precalienta los clientes en segundo plano y, al apagar, cierra conexiones y vacía los logs."""
+    async with client_lifespan():
+        log.info(f"🚀 Servidor iniciado; precalentando clientes (Gemini concurrente: {GEMINI_MAX_CONCURRENCY}).")
+        yield
+    shutdown_logging()
+
+
 app = FastAPI(
     title="API de Finanzas Personales con IA",
-    description="Conecta Flutter, Supabase y Gemini para análisis financieros."
+    description="Conecta Flutter, Supabase y Gemini para análisis financieros.",
+    lifespan=lifespan,
 )
+# Request-id, latencias por ruta y endpoint /metrics (formato Prometheus).
+install_http_instrumentation(app)
 
 # --- 3. ENDPOINTS ---
+@app.get("/ready", tags=["General"])
+def read_ready():
+    """Readiness: 200 cuando Supabase y Gemini están creados; 503 mientras se precalientan."""
+    ready, detail = readiness()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "clients": detail})
+
+
 @app.get("/", tags=["General"])
 def read_root():
     """Endpoint de bienvenida para verificar que el servidor está en funcionamiento."""
     return {"status": "ok", "message": "Servidor de Finanzas Personales con IA en funcionamiento."}
 
-@app.api_route("/api/analisis-financiero", methods=["GET", "POST"], tags=["Análisis IA"])
-async def generar_analisis_financiero(request: Request):
-    print(f"\n--- [NUEVA PETICIÓN IA] Metodo: {request.method} ---")
-    
-    try:
-        # 1. Obtener el user_id dependiendo del método
-        user_id = None
-        financial_state = {}
-        mood_context = {}
-        debt_context = []
-
-        if request.method == "POST":
-            # Extraer del JSON (Nueva versión enriquecida)
-            try:
-                data = await request.json()
-                user_id = data.get('user_id')
-                financial_state = data.get('financial_state', {})
-                mood_context = data.get('spending_mood_context', {})
-                debt_context = data.get('debt_context', [])
-            except Exception as e_json:
-                print(f"⚠️ Error leyendo JSON: {e_json}")
-                raise HTTPException(status_code=400, detail="Cuerpo JSON inválido")
-        else:
-            # Extraer de la URL (Versión antigua GET para compatibilidad)
-            user_id = request.query_params.get('user_id')
-
-        if not user_id:
-            print("❌ Error: No se proporcionó user_id")
-            raise HTTPException(status_code=400, detail="user_id es requerido")
-
-        print(f"ID Usuario: {user_id}")
-
-        # --- PASO A: Consultar historial en Supabase ---
-        # Usamos transaction_date porque vimos que existe en tu tabla
+# --- Helpers compartidos por las variantes JSON y streaming del análisis ---
+async def _leer_peticion_analisis(request: Request):
+    """Extrae user_id y el contexto enriquecido (POST) o solo el user_id (GET antiguo)."""
+    user_id = None
+    financial_state = {}
+    mood_context = {}
+    debt_context = []
+
+    if request.method == "POST":
+        # Extraer del JSON (Nueva versión enriquecida)
         try:
-            response = supabase.table('transactions') \
+            data = await request.json()
+            user_id = data.get('user_id')
+            financial_state = data.get('financial_state', {})
+            mood_context = data.get('spending_mood_context', {})
+            debt_context = data.get('debt_context', [])
+        except Exception as e_json:
+            log.warning(f"⚠️ Error leyendo JSON: {e_json}")
+            raise HTTPException(status_code=400, detail="Cuerpo JSON inválido")
+    else:
+        # Extraer de la URL (Versión antigua GET para compatibilidad)
+        user_id = request.query_params.get('user_id')
+
+    if not user_id:
+        log.error("❌ Error: No se proporcionó user_id")
+        raise HTTPException(status_code=400, detail="user_id es requerido")
+
+    log.info(f"ID Usuario: {user_id}")
+    return user_id, financial_state, mood_context, debt_context
+
+
+async def _consultar_historial(user_id):
+    """Últimas 30 transacciones del usuario (lista vacía si Supabase falla)."""
+    # Usamos transaction_date porque vimos que existe en tu tabla. El id desempata las del mismo
+    # día: sin él, las 30 elegidas (y con ellas la clave de caché y la data_key) podían variar.
+    try:
+        db = await get_supabase_async()
+        with span("supabase.historial"):
+            response = await db.table('transactions') \
                                .select('description, amount, type, category, transaction_date') \
                                .eq('user_id', user_id) \
                                .order('transaction_date', desc=True) \
+                               .order('id', desc=True) \
                                .limit(30) \
                                .execute()
-            transactions = response.data
-        except Exception as e_db:
-            print(f"⚠️ Error Supabase: {e_db}")
-            transactions = []
-
-        # --- PASO B: Construir el Prompt ---
-        # Si no hay datos enriquecidos (viniendo de un GET), usamos un prompt más simple
-        if not financial_state:
-            prompt = f"Analiza estas transacciones y dame consejos: {json.dumps(transactions, default=str)}"
-        else:
-            prompt = f"""
-            Actúa como 'SasPer AI', asesor financiero experto.
-            
-            SITUACIÓN ACTUAL:
-            - Disponible para gastar: ${financial_state.get('available_balance', 0)}
-            - Patrimonio Neto: ${financial_state.get('net_worth', 0)}
-            - Ingreso Mensual: ${financial_state.get('monthly_income', 0)}
-            
-            CONTEXTO EMOCIONAL:
-            - Ánimo predominante: {mood_context.get('predominant', 'neutral')}
-            
-            DEUDAS A CUOTAS:
-            {json.dumps(debt_context, indent=2)}
-
-            HISTORIAL RECIENTE:
-            {json.dumps(transactions, indent=2, default=str)}
-
-            TAREA:
-            Escribe un análisis en Markdown con:
-            1. Resumen de salud financiera.
-            2. Insight sobre el ánimo y los gastos.
-            3. Estrategia para sus deudas.
-            4. Una meta para esta semana.
-            """
-
-        # --- PASO C: Llamar a Gemini ---
-        print("🧠 Generando con Gemini...")
-        gemini_response = gemini_model.generate_content(prompt)
-        
-        print("✅ Éxito.")
-        return {"analisis": gemini_response.text}
+        return response.data
+    except Exception as e_db:
+        log.warning(f"⚠️ Error Supabase: {e_db}")
+        return []
+
+
+async def _consultar_resumen(user_id):
+    """Resumen precalculado del usuario (flujos, categorías, semanas, ánimo, cuotas) en una sola RPC."""
+    try:
+        # La RPC es SECURITY DEFINER y solo se concede a la clave de servicio.
+        db = await get_supabase_async("SUPABASE_SERVICE_KEY")
+        with span("supabase.resumen"):
+            response = await db.rpc('get_user_financial_summary', {'p_user_id': user_id}).execute()
+        return response.data or {}
+    except Exception as e_db:
+        log.warning(f"⚠️ Error leyendo resumen precalculado: {e_db}")
+        return {}
+
+
+async def _preparar_analisis(user_id, financial_state, mood_context, debt_context):
+    """
+    Reúne historial y resumen precalculado en paralelo, completa con el resumen lo que el
+    cliente no envió (ánimo, cuotas, ingreso mensual) y devuelve (clave de caché, prompt,
+    huella de los datos del servidor para buscar el análisis pregenerado).
+    La huella es None si el cliente envió su propio contexto: el pregenerado se hizo con el
+    prompt sin él (como un GET) y no le corresponde.
+    """
+    enriched = bool(financial_state or mood_context or debt_context)
+    transactions, summary = await asyncio.gather(_consultar_historial(user_id), _consultar_resumen(user_id))
+    financial_state, mood_context, debt_context = apply_summary_defaults(summary, financial_state, mood_context, debt_context)
+
+    with span("prompt"):
+        cache_key = build_cache_key(user_id, transactions, financial_state, mood_context, debt_context, summary)
+        prompt = build_analysis_prompt(transactions, financial_state, mood_context, debt_context, summary)
+    return cache_key, prompt, None if enriched else build_data_key(user_id, transactions, summary)
+
+
+async def _buscar_analisis(cache_key, user_id, data_key):
+    """
+    Caché local y, si falla, el análisis pregenerado por el job nocturno (pregenerate_analyses.py).
+    El pregenerado solo vale si se hizo con los mismos datos (misma data_key).
+    """
+    cached_analysis = analysis_cache.get(cache_key)
+    if cached_analysis is not None or data_key is None:
+        return cached_analysis
+    try:
+        # La tabla solo tiene política para el propio usuario (auth.uid()); el backend la lee con la clave de servicio.
+        db = await get_supabase_async("SUPABASE_SERVICE_KEY")
+        with span("supabase.pregenerado"):
+            response = await db.table('precomputed_analyses') \
+                .select('analysis') \
+                .eq('user_id', user_id) \
+                .eq('data_key', data_key) \
+                .limit(1) \
+                .execute()
+    except Exception as e_db:
+        log.warning(f"⚠️ Error leyendo análisis pregenerado: {e_db}")
+        return None
+    if not response.data:
+        return None
+    analysis = response.data[0]['analysis']
+    analysis_cache.set(cache_key, user_id, analysis)
+    return analysis
+
+
+async def _generar_analisis(user_id, financial_state, mood_context, debt_context):
+    # --- PASO A: Consultar historial y resumen precalculado; PASO B: Construir el Prompt ---
+    cache_key, prompt, data_key = await _preparar_analisis(user_id, financial_state, mood_context, debt_context)
+
+    # --- PASO A.2: Buscar en caché (local o pregenerado por el job nocturno) ---
+    cached_analysis = await _buscar_analisis(cache_key, user_id, data_key)
+    if cached_analysis is not None:
+        log.info("⚡ Análisis servido desde caché.")
+        return cached_analysis
+
+    # --- PASO C: Llamar a Gemini ---
+    # La versión asíncrona libera el event loop mientras Gemini responde; el planificador
+    # decide el turno según la cuota y el límite del usuario (o rechaza con 429).
+    ticket = gemini_scheduler.admit(user_id, prompt)
+    async with ticket:
+        log.info("🧠 Generando con Gemini...")
+        with span("gemini"):
+            gemini_response, model_name = await model_router.generate(
+                prompt, enriched=bool(financial_state), on_extra_call=ticket.charge_extra
+            )
+        ticket.record_usage(getattr(gemini_response, "usage_metadata", None))
+
+    analysis_cache.set(cache_key, user_id, gemini_response.text)
+    log.info(f"✅ Éxito ({model_name}).")
+    return gemini_response.text
+
+
+def _respuesta_saturado(detail, retry_after):
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(retry_after)},
+        content={"error": "Demasiadas peticiones", "detail": detail, "retry_after": retry_after},
+    )
+
+
+@app.api_route("/api/analisis-financiero", methods=["GET", "POST"], tags=["Análisis IA"])
+async def generar_analisis_financiero(request: Request):
+    log.info(f"--- [NUEVA PETICIÓN IA] Metodo: {request.method} ---")
+    
+    try:
+        # 1. Obtener el user_id dependiendo del método
+        user_id, financial_state, mood_context, debt_context = await _leer_peticion_analisis(request)
 
+        # Peticiones idénticas en curso (doble toque, reintentos) comparten una sola ejecución.
+        flight_key = request_key(user_id, financial_state, mood_context, debt_context)
+        analysis = await analysis_flights.do(
+            flight_key, lambda: _generar_analisis(user_id, financial_state, mood_context, debt_context)
+        )
+        return {"analisis": analysis}
+
+    except GeminiOverloaded as e:
+        log.warning(f"⏳ Petición rechazada por el planificador: {e}")
+        return _respuesta_saturado(str(e), e.retry_after)
     except Exception as e:
-        import traceback
-        print(f"🔥 ERROR 500 DETALLADO:\n{traceback.format_exc()}")
+        if is_quota_error(e):
+            log.warning(f"⏳ Cuota de Gemini agotada: {e}")
+            return _respuesta_saturado("Cuota de Gemini agotada", gemini_scheduler.quota_retry_after())
+        log.exception("🔥 ERROR 500 DETALLADO")
         return JSONResponse(
             status_code=500, 
             content={"error": "Error interno", "detail": str(e)}
         )
+
+
+@app.post("/internal/analisis-pregenerado", tags=["Interno"], include_in_schema=False)
+async def pregenerar_analisis(request: Request):
+    """
+    Genera el análisis de un usuario para el job nocturno (pregenerate_analyses.py) con
+    prioridad BATCH: comparte la cuota con las peticiones interactivas y siempre cede ante ellas.
+    Devuelve la fila para 'precomputed_analyses'; el job la guarda por lotes.
+    """
+    token = request.headers.get('x-internal-token', '')
+    if not INTERNAL_API_TOKEN or not hmac.compare_digest(token.encode(), INTERNAL_API_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="No autorizado")
+    try:
+        user_id = (await request.json()).get('user_id')
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cuerpo JSON inválido")
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id es requerido")
+
+    # Mismo prompt que una petición GET: es la que servirá el análisis pregenerado.
+    cache_key, prompt, data_key = await _preparar_analisis(user_id, {}, {}, [])
+    try:
+        ticket = gemini_scheduler.admit(user_id, prompt, BATCH)
+        async with ticket:
+            with span("gemini.pregenerado"):
+                gemini_response, model_name = await model_router.generate(
+                    prompt, enriched=False, on_extra_call=ticket.charge_extra
+                )
+            usage = getattr(gemini_response, "usage_metadata", None)
+            ticket.record_usage(usage)
+    except GeminiOverloaded as e:
+        return _respuesta_saturado(str(e), e.retry_after)
+    except Exception as e:
+        if is_quota_error(e):
+            return _respuesta_saturado("Cuota de Gemini agotada", gemini_scheduler.quota_retry_after())
+        raise
+
+    analysis_cache.set(cache_key, user_id, gemini_response.text)
+    return {
+        "user_id": user_id,
+        "data_key": data_key,
+        "analysis": gemini_response.text,
+        "model": model_name,
+        "prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+    }
+
+
+def _evento_sse(event, data):
+    """Formatea un evento Server-Sent Events; el payload va como JSON para conservar saltos de línea."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.api_route("/api/analisis-financiero/stream", methods=["GET", "POST"], tags=["Análisis IA"])
+async def generar_analisis_financiero_stream(request: Request):
+    """
+    Variante en streaming del análisis: reenvía los fragmentos Markdown de Gemini como
+    Server-Sent Events (`chunk`, `done`, `error`) a medida que llegan.
+    Si el cliente se desconecta, se cancela la generación en Gemini.
+    """
+    log.info(f"--- [NUEVA PETICIÓN IA STREAM] Metodo: {request.method} ---")
+    user_id, financial_state, mood_context, debt_context = await _leer_peticion_analisis(request)
+    # La generación en streaming es propia de cada conexión; lo que se comparte entre
+    # peticiones idénticas simultáneas es la preparación (consultas a Supabase).
+    cache_key, prompt, data_key = await preparation_flights.do(
+        request_key(user_id, financial_state, mood_context, debt_context),
+        lambda: _preparar_analisis(user_id, financial_state, mood_context, debt_context),
+    )
+
+    # La admisión se decide antes de abrir el stream, para poder responder 429 con Retry-After.
+    cached_analysis = await _buscar_analisis(cache_key, user_id, data_key)
+    if cached_analysis is None:
+        try:
+            ticket = gemini_scheduler.admit(user_id, prompt)
+        except GeminiOverloaded as e:
+            log.warning(f"⏳ Stream rechazado por el planificador: {e}")
+            return _respuesta_saturado(str(e), e.retry_after)
+
+    async def event_stream():
+        if cached_analysis is not None:
+            log.info("⚡ Análisis (stream) servido desde caché.")
+            yield _evento_sse("chunk", {"text": cached_analysis})
+            yield _evento_sse("done", {"cached": True})
+            return
+
+        partes = []
+        completed = False
+        try:
+            await ticket.acquire()
+        except GeminiOverloaded as e:
+            yield _evento_sse("error", {"error": "Demasiadas peticiones", "detail": str(e), "retry_after": e.retry_after})
+            return
+        # El turno ya está concedido; el bloque lo libera al terminar.
+        async with ticket:
+            log.info("🧠 Generando con Gemini (stream)...")
+            gemini_stream = None
+            # El span cubre la generación completa (hasta el último fragmento).
+            with span("gemini.stream"):
+                try:
+                    gemini_stream, model_name = await model_router.stream(
+                        prompt, enriched=bool(financial_state), on_extra_call=ticket.charge_extra
+                    )
+                    log.info(f"🧠 Modelo elegido: {model_name}")
+                    async for chunk in gemini_stream:
+                        if await request.is_disconnected():
+                            log.info("🔌 Cliente desconectado, cancelando generación.")
+                            break
+                        if chunk.text:
+                            partes.append(chunk.text)
+                            yield _evento_sse("chunk", {"text": chunk.text})
+                    else:
+                        completed = True
+                        ticket.record_usage(getattr(gemini_stream, "usage_metadata", None))
+                except asyncio.CancelledError:
+                    # Starlette cancela el generador cuando detecta la desconexión del cliente.
+                    log.info("🔌 Stream cancelado por desconexión del cliente.")
+                    raise
+                except Exception as e:
+                    log.exception("🔥 ERROR EN STREAM")
+                    STAGE_ERRORS.inc(stage="gemini.stream")
+                    ticket.record_error(e)
+                    yield _evento_sse("error", {"error": "Error interno", "detail": str(e)})
+                finally:
+                    # Cerrar el iterador corta la petición HTTP de streaming hacia Gemini.
+                    if gemini_stream is not None and not completed:
+                        iterator = getattr(gemini_stream, "_iterator", None)
+                        if hasattr(iterator, "cancel"):
+                            iterator.cancel()
+                        elif hasattr(iterator, "aclose"):
+                            await iterator.aclose()
+
+        if completed:
+            analysis_cache.set(cache_key, user_id, "".join(partes))
+            log.info("✅ Stream completado.")
+            yield _evento_sse("done", {"cached": False})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
         
+@app.get("/api/analisis-financiero/cache-stats", tags=["Análisis IA"])
+def obtener_estadisticas_cache():
+    """Contadores de aciertos/fallos de la caché de análisis, para dimensionarla."""
+    return analysis_cache.stats()
+
+
+@app.get("/api/analisis-financiero/coalescing-stats", tags=["Análisis IA"])
+def obtener_estadisticas_coalescing():
+    """Cuántas peticiones idénticas en curso se resolvieron con una sola ejecución."""
+    return {"analisis": analysis_flights.stats(), "stream_preparacion": preparation_flights.stats()}
+
+
+@app.get("/api/analisis-financiero/model-stats", tags=["Análisis IA"])
+def obtener_estadisticas_modelos():
+    """Latencias y tasa de éxito por modelo, hedges lanzados/ganados y umbrales del enrutado."""
+    return model_router.stats()
+
+
+@app.get("/api/analisis-financiero/scheduler-stats", tags=["Análisis IA"])
+def obtener_estadisticas_planificador():
+    """Colas por prioridad (profundidad y espera), cuota configurada, pausas por 429 y peticiones rechazadas."""
+    return gemini_scheduler.stats()
+
+
+# Filas por página al cargar el historial para /api/resumen (límite por defecto de PostgREST).
+RESUMEN_PAGE_SIZE = 1000
+
+
+async def _cargar_transacciones_resumen(db, user_id, since):
+    """Transacciones del usuario desde `since`, solo las columnas que usa analytics, paginadas con .range()."""
+    rows = []
+    while True:
+        # El id desempata las transacciones del mismo día: sin un orden total, una fila puede
+        # repetirse o perderse entre dos páginas.
+        response = await db.table('transactions') \
+            .select('transaction_date, amount, type, category') \
+            .eq('user_id', user_id) \
+            .gte('transaction_date', since.isoformat()) \
+            .order('transaction_date') \
+            .order('id') \
+            .range(len(rows), len(rows) + RESUMEN_PAGE_SIZE - 1) \
+            .execute()
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < RESUMEN_PAGE_SIZE:
+            return rows
+
+
+async def _cargar_presupuestos_mes(db, user_id, today):
+    response = await db.table('budgets') \
+        .select('category, amount') \
+        .eq('user_id', user_id) \
+        .eq('year', today.year) \
+        .eq('month', today.month) \
+        .execute()
+    return response.data or []
+
+
+@app.get("/api/resumen", tags=["Resumen"])
+async def obtener_resumen(user_id: str = Query(..., description="ID del usuario")):
+    """
+    Resumen determinista del usuario calculado en local (analytics.py): totales por categoría
+    del mes, semana actual frente a la anterior, días y movimientos anómalos y previsión de
+    gasto a fin de mes por presupuesto. Sin llamadas a Gemini.
+    """
+    today = datetime.date.today()
+    try:
+        db = await get_supabase_async()
+        with span("supabase.historial_resumen"):
+            transactions, budgets = await asyncio.gather(
+                _cargar_transacciones_resumen(db, user_id, today - datetime.timedelta(days=analytics.HISTORY_DAYS - 1)),
+                _cargar_presupuestos_mes(db, user_id, today),
+            )
+    except Exception as e_db:
+        log.exception("🔥 ERROR CARGANDO DATOS DEL RESUMEN")
+        STAGE_ERRORS.inc(stage="supabase.historial_resumen")
+        return JSONResponse(status_code=500, content={"error": "Error interno", "detail": str(e_db)})
+
+    with span("analytics"):
+        return analytics.build_summary(transactions, budgets, today)
+
+
+@app.post("/api/transactions/import", tags=["Transacciones"])
+async def importar_transacciones(
+    request: Request,
+    user_id: str = Query(..., description="ID del usuario"),
+    account_id: str = Query(None, description="Cuenta a la que se asignan los movimientos"),
+    fmt: str = Query(None, alias="format", pattern="^(csv|ofx)$", description="csv u ofx (por defecto se detecta)"),
+    default_category: str = Query("Otros", description="Categoría para las filas que no traen una"),
+):
+    """
+    Importa un extracto bancario CSV u OFX enviado como cuerpo de la petición (el fichero tal
+    cual, no multipart). Se parsea según llega, descarta las filas ya importadas por su huella,
+    inserta por lotes y encola una evaluación de presupuestos por categoría afectada.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/"):
+        return JSONResponse(status_code=415, content={"error": "Envía el fichero como cuerpo de la petición, no como multipart"})
+
+    db = await get_supabase_async()
+    importer = StatementImporter(db, user_id, account_id=account_id, default_category=default_category,
+                                 alerts_db=await get_supabase_async("SUPABASE_SERVICE_KEY"))
+    try:
+        with span("import"):
+            result = await importer.run(request.stream(), fmt=fmt)
+    except StatementTooLargeError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except StatementError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        log.exception("🔥 ERROR IMPORTANDO EXTRACTO")
+        STAGE_ERRORS.inc(stage="import")
+        partial = importer.result.to_dict() if importer.result else None
+        return JSONResponse(status_code=500, content={"error": "Error interno", "detail": str(e), "partial": partial})
+
+    if result.inserted:
+        analysis_cache.invalidate_user(user_id)
+    log.info(f"📥 Importación {result.format}: {result.inserted} nuevas de {result.rows} filas en {result.elapsed:.2f}s")
+    return {"success": True, **result.to_dict()}
+
 # --- AÑADE EL NUEVO ENDPOINT DE NOTIFICACIONES ---
 # Pega este código en tu app.py, reemplazando la función anterior.
 
 @app.post("/check-budget-on-transaction")
 async def check_budget_on_transaction(request: Request):
+    """
+    Las alertas de presupuesto ya no se evalúan aquí: un trigger deja cada gasto en
+    'budget_alert_outbox' y budget_alert_consumer.py las envía. Se mantiene para las versiones
+    de la app que aún lo llaman tras insertar una transacción (solo invalida la caché de análisis).
+    """
     try:
         data = await request.json()
         user_id = data.get('user_id')
@@ -161,103 +546,6 @@ async def check_budget_on_transaction(request: Request):
     except Exception:
         return JSONResponse(status_code=400, content={"error": "Cuerpo de la solicitud inválido"})
 
-    print(f"--- INICIANDO BÚSQUEDA DE PRESUPUESTO PARA CATEGORÍA '{category_name}' ---")
-
-    try:
-        # --- PASO 1: OBTENER TODOS LOS PRESUPUESTOS DEL USUARIO ---
-        # Este enfoque de depuración nos ayuda a ver qué está devolviendo la base de datos realmente.
-        all_budgets_response = supabase.table('budgets').select('*').eq('user_id', user_id).execute()
-
-        if not all_budgets_response.data:
-            print(f"RESULTADO: No se encontró NINGÚN presupuesto para el usuario {user_id}.")
-            return JSONResponse(status_code=200, content={"message": "El usuario no tiene presupuestos."})
-
-        print(f"DIAGNÓSTICO: Presupuestos encontrados para el usuario: {all_budgets_response.data}")
-
-        # --- PASO 2: ENCONTRAR EL PRESUPUESTO CORRECTO EN PYTHON ---
-        # Filtramos la lista en Python. Es menos eficiente pero a prueba de errores de consulta.
-        target_budget_data = None
-        for budget in all_budgets_response.data:
-            if budget.get('category') == category_name:
-                target_budget_data = budget
-                break # Encontramos el presupuesto, salimos del bucle
-
-        if not target_budget_data:
-            print(f"RESULTADO: No se encontró un presupuesto que coincida con la categoría '{category_name}' en la lista de presupuestos del usuario.")
-            return JSONResponse(status_code=200, content={"message": "No hay presupuesto para esta categoría específica."})
-
-        budget_amount = float(target_budget_data['amount'])
-        print(f"RESULTADO: Presupuesto encontrado en Python para '{category_name}'. Límite: {budget_amount}")
-        
-        # --- PASO 3: LÓGICA DE CÁLCULO Y NOTIFICACIÓN ---
-        from datetime import date
-        import calendar
-
-        today = date.today()
-        
-        # Obtenemos mes y año del presupuesto encontrado
-        # Asumimos que la columna 'month' y 'year' existen y son números
-        budget_month = int(target_budget_data['month'])
-        budget_year = int(target_budget_data['year'])
-
-        # Solo procedemos si la transacción actual está dentro del mes/año del presupuesto
-        if not (today.month == budget_month and today.year == budget_year):
-             print(f"ADVERTENCIA: La transacción (Mes/Año: {today.month}/{today.year}) no corresponde al período del presupuesto (Mes/Año: {budget_month}/{budget_year}).")
-             return JSONResponse(status_code=200, content={"message": "La transacción no aplica al período del presupuesto."})
-
-        # Si estamos en el período correcto, calculamos el gasto
-        first_day_of_month = date(budget_year, budget_month, 1).isoformat()
-        _, last_day = calendar.monthrange(budget_year, budget_month)
-        last_day_of_month = date(budget_year, budget_month, last_day).isoformat()
-
-        print(f"Buscando transacciones entre {first_day_of_month} y {last_day_of_month}")
-        transactions_response = supabase.table('transactions').select('amount').eq('user_id', user_id).eq('type', 'Gasto').eq('category', category_name).gte('transaction_date', first_day_of_month).lte('transaction_date', last_day_of_month).execute()
-        
-        total_spent = sum(float(t['amount']) for t in transactions_response.data)
-
-        # Verificar umbrales
-        if budget_amount == 0:
-            percentage_spent = 0
-        else:
-            percentage_spent = (total_spent / budget_amount) * 100
-        
-        print(f"CÁLCULO FINAL: Usuario: {user_id}, Cat: {category_name}, Gastado: {total_spent}/{budget_amount} ({percentage_spent:.2f}%)")
-
-        notification_title = None
-        notification_body = None
-
-        if 100 <= percentage_spent:
-            notification_title = 'Presupuesto Excedido'
-            notification_body = f'¡Cuidado! Has superado tu presupuesto para "{category_name}".'
-        elif 80 <= percentage_spent < 100:
-            notification_title = 'Alerta de Presupuesto'
-            notification_body = f'Ya has utilizado el {int(percentage_spent)}% de tu presupuesto para "{category_name}".'
-
-        # Si hay que notificar, buscar token y enviar
-        if notification_title:
-            print(f"DECISIÓN: Se debe enviar notificación. Buscando token FCM para {user_id}...")
-            token_response = supabase.table('profiles').select('fcm_token').eq('id', user_id).execute()
-            if token_response.data and token_response.data[0].get('fcm_token'):
-                fcm_token = token_response.data[0]['fcm_token']
-                message = messaging.Message(
-                    notification=messaging.Notification(
-                        title=notification_title,
-                        body=notification_body
-                    ),
-                    token=fcm_token,
-                    data={'screen': 'budgets'}
-                )
-                messaging.send(message)
-                print(f"ÉXITO: Notificación de presupuesto enviada a {user_id}")
-                return JSONResponse(status_code=200, content={"success": True, "message": "Notificación enviada."})
-            else:
-                print(f"ADVERTENCIA: No se pudo encontrar el token FCM para el usuario {user_id}. No se envió notificación.")
-        
-        print("DECISIÓN: Umbral no alcanzado, no se envió notificación.")
-        return JSONResponse(status_code=200, content={"success": True, "message": "Umbral no alcanzado."})
-
-    except Exception as e:
-        import traceback
-        print(f"ERROR INESPERADO: Error procesando el chequeo de presupuesto:")
-        traceback.print_exc() # Imprime el traceback completo para una mejor depuración
-        return JSONResponse(status_code=500, content={"error": "Ocurrió un error interno en el servidor."})
\ No newline at end of file
+    # Una transacción nueva deja obsoletos los análisis guardados del usuario.
+    analysis_cache.invalidate_user(user_id)
+    return JSONResponse(status_code=200, content={"success": True, "message": "Alerta de presupuesto encolada."})
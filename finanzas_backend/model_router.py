@@ -0,0 +1,213 @@
+# model_router.py
+#
+# Enrutado entre modelos de Gemini para /api/analisis-financiero.
+#   - Prompts simples o pequeños (GET sin contexto, pocos tokens) van al modelo rápido; el
+#     contexto enriquecido del POST va al modelo pro.
+#   - Petición "hedged": si el modelo pro no ha respondido tras `hedge_after` segundos, se lanza
+#     en paralelo la misma petición al modelo rápido y gana la primera que termine bien.
+#   - Si el modelo elegido devuelve error de cuota (429 / ResourceExhausted) se pasa al otro.
+#   - Cada llamada extra (hedge o respaldo) se notifica con `on_extra_call(modelo)` para que quien
+#     lleva la cuenta de la cuota (gemini_scheduler.Ticket.charge_extra) la cobre también.
+#   - Estadísticas por modelo (latencias, éxitos, errores de cuota, hedges ganados) para
+#     ajustar los umbrales con datos reales (ver /api/analisis-financiero/model-stats).
+# El módulo no depende de clients.py ni de observability.py: recibe una fábrica
+# `get_model(nombre)`, así lo pueden usar ambos backends (el de la raíz lo importa como paquete).
+
+import asyncio
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+GEMINI_PRO_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.5-flash")
+# Prompts por debajo de este tamaño (tokens aproximados) van al modelo rápido aunque sean enriquecidos.
+ROUTER_SMALL_PROMPT_TOKENS = int(os.getenv("ROUTER_SMALL_PROMPT_TOKENS", "600"))
+# Segundos de espera al modelo pro antes de lanzar la petición de respaldo al rápido (0 = sin hedge).
+ROUTER_HEDGE_AFTER_SECONDS = float(os.getenv("ROUTER_HEDGE_AFTER_SECONDS", "12"))
+
+
+def is_quota_error(error):
+    """Errores de cuota de Gemini (google.api_core.exceptions.ResourceExhausted, HTTP 429)."""
+    return type(error).__name__ in ("ResourceExhausted", "TooManyRequests") or getattr(error, "code", None) == 429
+
+
+class ModelStats:
+    """Contadores y latencias recientes de un modelo."""
+
+    def __init__(self, window=500):
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.quota_errors = 0
+        self.cancelled = 0
+        self.hedges_started = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.latencies = deque(maxlen=window)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "successes": self.successes,
+            "failures": self.failures,
+            "quota_errors": self.quota_errors,
+            "cancelled": self.cancelled,
+            "hedges_started": self.hedges_started,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "success_rate": round(self.successes / self.calls, 4) if self.calls else 0.0,
+            "p50_s": round(statistics.median(latencies), 3) if latencies else None,
+            "p95_s": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+        }
+
+
+class ModelRouter:
+    """Elige modelo por petición, con respaldo por cuota y petición hedged al modelo rápido."""
+
+    def __init__(self, get_model, pro_model=GEMINI_PRO_MODEL, fast_model=GEMINI_FAST_MODEL,
+                 small_prompt_tokens=ROUTER_SMALL_PROMPT_TOKENS, hedge_after=ROUTER_HEDGE_AFTER_SECONDS):
+        self.get_model = get_model
+        self.pro_model = pro_model
+        self.fast_model = fast_model
+        self.small_prompt_tokens = small_prompt_tokens
+        self.hedge_after = hedge_after
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def choose(self, prompt, enriched):
+        """Modelo principal para un prompt: pro solo para contexto enriquecido y no trivial."""
+        if enriched and (len(prompt) + 3) // 4 >= self.small_prompt_tokens:
+            return self.pro_model
+        return self.fast_model
+
+    def _alternative(self, model_name):
+        return self.fast_model if model_name == self.pro_model else self.pro_model
+
+    def _stats_for(self, model_name):
+        with self._lock:
+            return self._stats.setdefault(model_name, ModelStats())
+
+    def _record(self, model_name, elapsed=None, error=None, cancelled=False):
+        stats = self._stats_for(model_name)
+        with self._lock:
+            stats.calls += 1
+            if cancelled:
+                stats.cancelled += 1
+            elif error is None:
+                stats.successes += 1
+                stats.latencies.append(elapsed)
+            else:
+                stats.failures += 1
+                if is_quota_error(error):
+                    stats.quota_errors += 1
+
+    async def _call(self, model_name, prompt):
+        model = self.get_model(model_name)
+        start = time.perf_counter()
+        try:
+            response = await model.generate_content_async(prompt)
+        except asyncio.CancelledError:
+            self._record(model_name, cancelled=True)
+            raise
+        except Exception as e:
+            self._record(model_name, error=e)
+            raise
+        self._record(model_name, time.perf_counter() - start)
+        return response
+
+    async def generate(self, prompt, enriched, on_extra_call=None):
+        """Devuelve (respuesta, modelo que respondió). `on_extra_call(modelo)` se llama por cada hedge o respaldo."""
+        primary = self.choose(prompt, enriched)
+        primary_task = asyncio.ensure_future(self._call(primary, prompt))
+        hedge_task = fallback_task = None
+        tasks = {primary_task: primary}
+        pending = {primary_task}
+        last_error = None
+        # El finally cubre también la espera previa al hedge: si se cancela la petición
+        # (cliente desconectado), no queda ninguna llamada a Gemini consumiendo cuota.
+        try:
+            # Solo se cubre al modelo pro: el rápido no tiene a quién delegar por latencia.
+            if primary == self.pro_model and self.hedge_after > 0:
+                done, _ = await asyncio.wait({primary_task}, timeout=self.hedge_after)
+                if not done:
+                    self._stats_for(self.fast_model).hedges_started += 1
+                    if on_extra_call is not None:
+                        on_extra_call(self.fast_model)
+                    hedge_task = asyncio.ensure_future(self._call(self.fast_model, prompt))
+                    tasks[hedge_task] = self.fast_model
+                    pending.add(hedge_task)
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            self._stats_for(self.fast_model).hedge_wins += 1
+                        return task.result(), tasks[task]
+                    last_error = task.exception()
+                    # Cuota agotada en el principal y sin hedge en curso: pasar al otro modelo.
+                    if task is primary_task and hedge_task is None and is_quota_error(last_error):
+                        fallback = self._alternative(primary)
+                        self._stats_for(fallback).fallbacks += 1
+                        if on_extra_call is not None:
+                            on_extra_call(fallback)
+                        fallback_task = asyncio.ensure_future(self._call(fallback, prompt))
+                        tasks[fallback_task] = fallback
+                        pending.add(fallback_task)
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, prompt, enriched, on_extra_call=None):
+        """
+        Abre una generación en streaming. Sin hedge (los fragmentos ya se entregan al cliente),
+        pero con respaldo al otro modelo si el elegido rechaza la petición por cuota.
+        Devuelve (stream, modelo).
+        """
+        primary = self.choose(prompt, enriched)
+        for model_name in (primary, self._alternative(primary)):
+            if model_name != primary and on_extra_call is not None:
+                on_extra_call(model_name)
+            start = time.perf_counter()
+            try:
+                stream = await self.get_model(model_name).generate_content_async(prompt, stream=True)
+            except Exception as e:
+                self._record(model_name, error=e)
+                if model_name == primary and is_quota_error(e):
+                    self._stats_for(self._alternative(primary)).fallbacks += 1
+                    continue
+                raise
+            # Para el streaming se registra el tiempo hasta abrir la respuesta.
+            self._record(model_name, time.perf_counter() - start)
+            return stream, model_name
+
+    def generate_sync(self, prompt, enriched):
+        """Versión síncrona (backend de main.py raíz): respaldo por cuota, sin hedge."""
+        primary = self.choose(prompt, enriched)
+        for model_name in (primary, self._alternative(primary)):
+            start = time.perf_counter()
+            try:
+                response = self.get_model(model_name).generate_content(prompt)
+            except Exception as e:
+                self._record(model_name, error=e)
+                if model_name == primary and is_quota_error(e):
+                    self._stats_for(self._alternative(primary)).fallbacks += 1
+                    continue
+                raise
+            self._record(model_name, time.perf_counter() - start)
+            return response, model_name
+
+    def stats(self):
+        with self._lock:
+            models = {name: stats.snapshot() for name, stats in self._stats.items()}
+        return {
+            "pro_model": self.pro_model,
+            "fast_model": self.fast_model,
+            "small_prompt_tokens": self.small_prompt_tokens,
+            "hedge_after_seconds": self.hedge_after,
+            "models": models,
+        }
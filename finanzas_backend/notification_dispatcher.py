@@ -0,0 +1,160 @@
+# notification_dispatcher.py
+#
+# Envío de notificaciones push con FCM HTTP v1 (Firebase Admin SDK), compartido por los jobs
+# de recordatorios (send_reminders.py) y el consumidor de alertas (budget_alert_consumer.py). Agrupa los mensajes en lotes de hasta 500 por llamada a `messaging.send_each`,
+# procesa varios lotes en paralelo con un pool acotado, reintenta con backoff los errores
+# transitorios (cuota, 5xx) y recopila los tokens muertos para limpiarlos de 'profiles'.
+#
+# El token OAuth lo gestiona el Admin SDK: la credencial de la app guarda el access token y lo
+# renueva antes de que caduque. `warm_up()` lo obtiene por adelantado para que el primer lote
+# no pague el intercambio OAuth.
+
+import logging
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import firebase_admin
+from firebase_admin import exceptions, messaging
+
+from clients import get_messaging
+
+FCM_BATCH_SIZE = 500
+# Lotes de FCM que se envían en paralelo.
+FCM_MAX_WORKERS = int(os.getenv("FCM_MAX_WORKERS", "4"))
+
+log = logging.getLogger("sasper")
+
+# Errores por token que indican que el dispositivo ya no existe: hay que borrar el token.
+DEAD_TOKEN_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+# Errores transitorios: se reintenta el mensaje en la siguiente ronda.
+RETRYABLE_ERRORS = (messaging.QuotaExceededError, exceptions.UnavailableError, exceptions.InternalError)
+
+
+class DispatchStats:
+    """Resumen de una ejecución del dispatcher."""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.batches = 0
+        self.elapsed = 0.0
+        self.latencies = []  # latencia de cada llamada por lote
+        self.errors = []  # (etiqueta, detalle)
+        self.dead_tokens = set()
+        self.failed_items = []  # (etiqueta, mensaje) que no llegaron a enviarse
+
+    @property
+    def throughput(self):
+        return (self.sent + self.failed) / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other):
+        self.sent += other.sent
+        self.failed += other.failed
+        self.retries += other.retries
+        self.batches += other.batches
+        self.latencies.extend(other.latencies)
+        self.errors.extend(other.errors)
+        self.dead_tokens |= other.dead_tokens
+        self.failed_items.extend(other.failed_items)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+        return (
+            f"{self.sent} enviadas, {self.failed} fallidas, {len(self.dead_tokens)} tokens muertos, "
+            f"{self.retries} reintentos en {self.batches} lotes, {self.elapsed:.2f}s "
+            f"({self.throughput:.1f} notif/s, p50 lote {statistics.median(latencies) * 1000 if latencies else 0:.0f} ms, "
+            f"p95 lote {p95 * 1000:.0f} ms)"
+        )
+
+
+class NotificationDispatcher:
+    """Envía listas de (etiqueta, messaging.Message) en lotes de hasta 500 mensajes."""
+
+    def __init__(self, app=None, max_workers=4, max_retries=3, backoff_base=0.5, send_each=None):
+        self.app = app
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._send_each = send_each or (lambda batch: messaging.send_each(batch, app=self.app))
+
+    def warm_up(self):
+        """Obtiene (y deja cacheado en la credencial) el access token OAuth antes del primer envío."""
+        app = self.app or firebase_admin.get_app()
+        app.credential.get_access_token()
+
+    def send_all(self, notifications):
+        stats = DispatchStats()
+        start = time.perf_counter()
+        batches = [notifications[i:i + FCM_BATCH_SIZE] for i in range(0, len(notifications), FCM_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for batch_stats in pool.map(self._send_batch, batches):
+                stats.merge(batch_stats)
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+    def close(self):
+        # Las conexiones HTTP pertenecen a la app de Firebase; no hay nada propio que cerrar.
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send_batch(self, batch):
+        stats = DispatchStats()
+        pending = batch
+        attempt = 0
+        while pending:
+            t = time.perf_counter()
+            response = self._send_each([message for _, message in pending])
+            stats.latencies.append(time.perf_counter() - t)
+            stats.batches += 1
+
+            retry = []
+            for (label, message), result in zip(pending, response.responses):
+                if result.success:
+                    stats.sent += 1
+                elif isinstance(result.exception, DEAD_TOKEN_ERRORS):
+                    stats.failed += 1
+                    stats.dead_tokens.add(message.token)
+                    stats.failed_items.append((label, message))
+                elif isinstance(result.exception, RETRYABLE_ERRORS) and attempt < self.max_retries:
+                    retry.append((label, message))
+                else:
+                    stats.failed += 1
+                    stats.errors.append((label, str(result.exception)))
+                    stats.failed_items.append((label, message))
+                    log.error(f"Error al enviar notificación para {label}: {result.exception}")
+
+            if retry:
+                attempt += 1
+                stats.retries += len(retry)
+                # Backoff exponencial con jitter para no sincronizar los reintentos.
+                time.sleep(self.backoff_base * (2 ** (attempt - 1)) * (1 + random.random()))
+            pending = retry
+        return stats
+
+
+def crear_dispatcher():
+    """Inicializa Firebase Admin (FCM HTTP v1) si hace falta y devuelve un dispatcher con el token ya cacheado."""
+    get_messaging()
+    dispatcher = NotificationDispatcher(max_workers=FCM_MAX_WORKERS)
+    dispatcher.warm_up()
+    return dispatcher
+
+
+def limpiar_tokens_muertos(supabase, stats, nombre_job):
+    """Borra de 'profiles' los tokens que FCM dio por muertos en un envío."""
+    if stats.dead_tokens:
+        dead = list(stats.dead_tokens)
+        # Limpieza en bloque; troceada para no exceder el largo de URL de PostgREST.
+        for i in range(0, len(dead), 100):
+            supabase.table("profiles").update({"fcm_token": None}).in_("fcm_token", dead[i:i + 100]).execute()
+        log.info(f"{nombre_job}: {len(dead)} tokens FCM inválidos eliminados de 'profiles'.")
@@ -0,0 +1,236 @@
+# observability.py
+#
+# Instrumentación del camino caliente, compartida por main.py y finanzas_backend/main.py:
+#   - span(etapa): mide cada etapa (consulta a Supabase, construcción del prompt, Gemini, FCM)
+#     y alimenta un histograma de latencias, un gauge de operaciones en curso y un contador
+#     de errores por etapa.
+#   - Métricas en formato de texto de Prometheus para el endpoint /metrics (sin dependencias).
+#   - request-id por petición (contextvar) que se añade a cada línea de log.
+#   - Logging encolado: los handlers solo meten el registro en una cola y un hilo aparte lo
+#     escribe en stdout, así el handler de la petición no se bloquea con la E/S.
+
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Buckets (segundos) pensados para el rango de latencias de Supabase (ms) a Gemini (decenas de s).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self):
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # key -> [conteos por bucket, suma, total]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _render_samples(self):
+        lines = []
+        for key, (counts, total, count) in self._series.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+STAGE_LATENCY = registry.register(Histogram("sasper_stage_duration_seconds", "Latencia por etapa del camino caliente.", ("stage",)))
+STAGE_IN_FLIGHT = registry.register(Gauge("sasper_stage_in_flight", "Operaciones en curso por etapa.", ("stage",)))
+STAGE_ERRORS = registry.register(Counter("sasper_stage_errors_total", "Errores por etapa.", ("stage",)))
+HTTP_LATENCY = registry.register(Histogram("sasper_http_request_duration_seconds", "Latencia de las peticiones HTTP.", ("method", "route", "status")))
+HTTP_IN_FLIGHT = registry.register(Gauge("sasper_http_requests_in_flight", "Peticiones HTTP en curso."))
+GEMINI_QUEUE_DEPTH = registry.register(Gauge("sasper_gemini_queue_depth", "Peticiones esperando turno para Gemini.", ("priority",)))
+GEMINI_QUEUE_WAIT = registry.register(Histogram("sasper_gemini_queue_wait_seconds", "Espera en cola hasta llamar a Gemini.", ("priority",)))
+GEMINI_SHED = registry.register(Counter("sasper_gemini_shed_total", "Peticiones a Gemini rechazadas antes de llamar.", ("reason", "priority")))
+
+
+@contextmanager
+def span(stage):
+    """Mide una etapa. Sirve igual en código síncrono y dentro de corutinas (`with span(...)`)."""
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage=stage)
+        STAGE_IN_FLIGHT.dec(stage=stage)
+
+
+def render_metrics():
+    return registry.render()
+
+
+# --- Logging encolado con request-id ---
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+_listener = None
+_listener_pid = None
+_queue_handler = None
+
+
+def setup_logging(level=logging.INFO):
+    """
+    Configura el logger raíz con un QueueHandler; un QueueListener (hilo propio) escribe en stdout.
+    Idempotente: varias llamadas no duplican handlers. En un proceso hijo creado con fork (los
+    workers de send_reminders.py) el hilo escritor heredado no existe: se sustituye el handler.
+    """
+    global _listener, _listener_pid, _queue_handler
+    if _listener is not None and _listener_pid == os.getpid():
+        return logging.getLogger("sasper")
+    root = logging.getLogger()
+    if _queue_handler is not None:
+        root.removeHandler(_queue_handler)
+    log_queue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(message)s"))
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    # El request-id se captura al encolar, en el contexto de la petición (no en el hilo escritor).
+    _queue_handler.addFilter(_RequestIdFilter())
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    return logging.getLogger("sasper")
+
+
+def shutdown_logging():
+    """Vacía la cola y detiene el hilo escritor (llamar al apagar la aplicación)."""
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = None
+
+
+def install_http_instrumentation(app):
+    """
+    Middleware que asigna el request-id (cabecera X-Request-ID o uno nuevo), lo devuelve en la
+    respuesta y registra latencia y peticiones en curso. Añade también el endpoint /metrics.
+    """
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse
+
+    @app.middleware("http")
+    async def _instrument(request: Request, call_next):
+        request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers["X-Request-ID"] = request_id
+            return response
+        finally:
+            route = request.scope.get("route")
+            HTTP_LATENCY.observe(
+                time.perf_counter() - start,
+                method=request.method,
+                route=getattr(route, "path", "sin_ruta"),
+                status=status,
+            )
+            HTTP_IN_FLIGHT.dec()
+            request_id_var.reset(token)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
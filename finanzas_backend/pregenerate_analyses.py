@@ -0,0 +1,217 @@
+# pregenerate_analyses.py
+#
+# Job nocturno que pregenera el análisis IA de los usuarios activos, para que al abrir la
+# pantalla por la mañana /api/analisis-financiero lo sirva al instante desde
+# 'precomputed_analyses' en lugar de esperar una generación en frío de Gemini.
+#
+# Misma forma que send_reminders.py: recorre los usuarios por keyset con checkpoint y admite
+# particiones (--shard i/N). Dentro de cada página, un pool acotado de hilos pide los análisis
+# a la API (POST /internal/analisis-pregenerado), que los genera con prioridad BATCH en el
+# mismo planificador que las peticiones interactivas (gemini_scheduler.py): la cuota de Gemini
+# se reparte en un solo sitio y la pregeneración cede siempre ante los usuarios. Un 429 de la
+# API se reintenta tras su Retry-After.
+# Si los datos del usuario no cambiaron desde el último análisis pregenerado, no se regenera.
+
+import os
+import time
+import logging
+import random
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from analysis_cache import build_data_key
+from clients import close_sync, get_sync_http
+from jobs import crear_supabase, guardar_checkpoint, leer_checkpoint, nombre_job, paginar, parse_shard
+from observability import setup_logging, shutdown_logging
+
+# API que genera los análisis (main.py) y token de sus endpoints internos.
+PREGEN_API_URL = os.getenv("PREGEN_API_URL", "http://localhost:8000").rstrip("/")
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN")
+# Peticiones simultáneas a la API; el ritmo real lo marca su planificador.
+PREGEN_MAX_WORKERS = int(os.getenv("PREGEN_MAX_WORKERS", "4"))
+# Cubre la espera en la cola BATCH (GEMINI_MAX_QUEUE_WAIT_BATCH_SECONDS) más la generación.
+PREGEN_REQUEST_TIMEOUT = float(os.getenv("PREGEN_REQUEST_TIMEOUT", "300"))
+# Solo se pregenera para usuarios con movimientos en los últimos N días.
+PREGEN_ACTIVE_DAYS = int(os.getenv("PREGEN_ACTIVE_DAYS", "30"))
+PREGEN_PAGE_SIZE = int(os.getenv("PREGEN_PAGE_SIZE", "100"))
+PREGEN_MAX_RETRIES = 3
+
+log = logging.getLogger("sasper")
+
+# Respuestas de la API que se reintentan (planificador saturado, API reiniciándose).
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+class PregenStats:
+    """Resumen de una ejecución del job."""
+
+    def __init__(self):
+        self.generated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.elapsed = 0.0
+        self.errors = []  # (user_id, detalle)
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.output_tokens
+
+    @property
+    def throughput(self):
+        return self.generated / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other):
+        self.generated += other.generated
+        self.unchanged += other.unchanged
+        self.failed += other.failed
+        self.retries += other.retries
+        self.prompt_tokens += other.prompt_tokens
+        self.output_tokens += other.output_tokens
+        self.errors.extend(other.errors)
+
+    def summary(self):
+        return (
+            f"{self.generated} generados, {self.unchanged} sin cambios, {self.failed} fallidos, "
+            f"{self.retries} reintentos, {self.elapsed:.2f}s ({self.throughput * 60:.1f} análisis/min), "
+            f"tokens: {self.prompt_tokens} entrada + {self.output_tokens} salida = {self.total_tokens}"
+        )
+
+
+def _datos_usuario(supabase, user_id):
+    """Mismas entradas que usa el endpoint: últimas 30 transacciones y resumen precalculado."""
+    # Mismo orden total que main.py (_consultar_historial), para que la data_key coincida.
+    transactions = supabase.table("transactions") \
+        .select("description, amount, type, category, transaction_date") \
+        .eq("user_id", user_id) \
+        .order("transaction_date", desc=True) \
+        .order("id", desc=True) \
+        .limit(30) \
+        .execute().data
+    summary = supabase.rpc("get_user_financial_summary", {"p_user_id": user_id}).execute().data or {}
+    return transactions, summary
+
+
+def _generar(http, user_id, stats):
+    """Pide el análisis a la API; reintenta los 429 tras su Retry-After y los fallos de red con backoff."""
+    attempt = 0
+    while True:
+        try:
+            response = http.post(
+                f"{PREGEN_API_URL}/internal/analisis-pregenerado",
+                json={"user_id": user_id},
+                headers={"X-Internal-Token": INTERNAL_API_TOKEN},
+                timeout=PREGEN_REQUEST_TIMEOUT,
+            )
+            if response.status_code not in RETRYABLE_STATUS or attempt >= PREGEN_MAX_RETRIES:
+                response.raise_for_status()
+                return response.json()
+            delay = float(response.headers.get("Retry-After") or 2 ** (attempt + 1))
+        except httpx.TransportError:
+            if attempt >= PREGEN_MAX_RETRIES:
+                raise
+            delay = 2 ** (attempt + 1)
+        attempt += 1
+        stats.retries += 1
+        time.sleep(delay * (1 + random.random()))
+
+
+def _pregenerar_usuario(supabase, http, user_id, stored_keys):
+    """Genera el análisis de un usuario. Devuelve (stats, fila para precomputed_analyses o None)."""
+    stats = PregenStats()
+    try:
+        transactions, summary = _datos_usuario(supabase, user_id)
+        data_key = build_data_key(user_id, transactions, summary)
+        if stored_keys.get(user_id) == data_key:
+            stats.unchanged += 1
+            return stats, None
+
+        # La API arma el mismo prompt que una petición GET y devuelve la huella de los datos
+        # con los que lo generó (puede diferir de la leída aquí si el usuario cambió algo).
+        row = _generar(http, user_id, stats)
+        stats.generated += 1
+        stats.prompt_tokens += row["prompt_tokens"]
+        stats.output_tokens += row["output_tokens"]
+        return stats, {**row, "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+    except Exception as e:
+        log.error(f"Error pregenerando el análisis del usuario {user_id}: {e}")
+        stats.failed += 1
+        stats.errors.append((user_id, str(e)))
+        return stats, None
+
+
+def pregenerate_analyses(shard=(0, 1), max_workers=PREGEN_MAX_WORKERS):
+    """
+    Recorre los usuarios activos (por páginas y con checkpoint) y guarda su análisis en
+    'precomputed_analyses'. `shard=(i, n)` limita el job a una partición por hash de user_id.
+    """
+    job = nombre_job("pregenerate_analyses", shard)
+    run_key = datetime.date.today().isoformat()
+    since = (datetime.date.today() - datetime.timedelta(days=PREGEN_ACTIVE_DAYS)).isoformat()
+    log.info(f"{job}: pregenerando análisis de usuarios activos desde {since}...")
+
+    if not INTERNAL_API_TOKEN:
+        raise RuntimeError("INTERNAL_API_TOKEN no está configurado: la API rechazaría las peticiones.")
+    http = get_sync_http()
+    supabase = crear_supabase()
+    total = PregenStats()
+    start = time.perf_counter()
+
+    def fetch_page(after_id, limit):
+        return supabase.rpc("active_analysis_users", {
+            "p_since": since, "p_after_id": after_id, "p_limit": limit,
+            "p_shard_index": shard[0], "p_shard_count": shard[1],
+        }).execute().data
+
+    after_id = leer_checkpoint(job, run_key)
+    if after_id is not None:
+        log.info(f"{job}: reanudando desde el usuario {after_id}.")
+
+    pages = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for rows in paginar(fetch_page, after_id, PREGEN_PAGE_SIZE):
+            pages += 1
+            user_ids = [row["id"] for row in rows]
+            stored = supabase.table("precomputed_analyses") \
+                .select("user_id, data_key") \
+                .in_("user_id", user_ids) \
+                .execute().data or []
+            stored_keys = {row["user_id"]: row["data_key"] for row in stored}
+
+            results = list(pool.map(lambda uid: _pregenerar_usuario(supabase, http, uid, stored_keys), user_ids))
+            upserts = [row for _, row in results if row is not None]
+            for stats, _ in results:
+                total.merge(stats)
+            if upserts:
+                supabase.table("precomputed_analyses").upsert(upserts, on_conflict="user_id").execute()
+            guardar_checkpoint(job, run_key, rows[-1]["id"])
+            log.info(f"{job}: página {pages} ({len(user_ids)} usuarios, {len(upserts)} guardados).")
+    guardar_checkpoint(job, run_key, None)
+
+    total.elapsed = time.perf_counter() - start
+    log.info(f"{job}: {pages} páginas, {total.summary()}")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pregenera los análisis IA de los usuarios activos.")
+    parser.add_argument("--shard", type=parse_shard, default=(0, 1),
+                        help="Partición i/N por hash de user_id (para N instancias de cron).")
+    parser.add_argument("--max-workers", type=int, default=PREGEN_MAX_WORKERS)
+    args = parser.parse_args()
+
+    setup_logging()
+    try:
+        stats = pregenerate_analyses(args.shard, args.max_workers)
+        if stats.errors:
+            log.warning(f"{len(stats.errors)} usuarios con error:")
+            for user_id, detail in stats.errors[:20]:
+                log.warning(f"  {user_id}: {detail}")
+    finally:
+        close_sync()
+        shutdown_logging()
@@ -0,0 +1,226 @@
+# prompt_builder.py
+#
+# Construcción compacta de los datos que van en los prompts de análisis (compartido por
+# main.py y finanzas_backend/main.py). En lugar de `json.dumps(..., indent=2)`, que gasta la
+# mayoría de tokens en espacios y claves repetidas, se envía:
+#   - un resumen pre-agregado (ingresos vs gastos, totales por categoría, tendencia semanal), y
+#   - las filas en formato columnar (cabecera una vez + una línea por fila, separadas por '|').
+# Si el bloque excede el presupuesto de tokens se omiten las filas más antiguas; el resumen
+# siempre se calcula sobre todas, así que no se pierde información agregada.
+
+import json
+import os
+from datetime import date, datetime
+
+# Presupuesto aproximado de tokens para el bloque de transacciones (≈ 4 caracteres por token).
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+TRANSACTION_COLUMNS = ("transaction_date", "type", "category", "amount", "description")
+_COLUMN_LABELS = {
+    "transaction_date": "fecha",
+    "type": "tipo",
+    "category": "categoria",
+    "amount": "monto",
+    "description": "descripcion",
+}
+
+
+def estimate_tokens(text):
+    """Estimación barata del número de tokens (sin llamar al tokenizador de Gemini)."""
+    return (len(text) + 3) // 4
+
+
+def _compact_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    text = str(value)
+    # Las fechas con hora se recortan al día: la hora no aporta al análisis.
+    if len(text) >= 10 and text[4:5] == "-" and text[7:8] == "-":
+        text = text[:10]
+    return text.replace("|", "/").replace("\n", " ").strip()
+
+
+def encode_rows(rows, columns=None, labels=None):
+    """Codifica una lista de dicts como cabecera + líneas separadas por '|'."""
+    if not rows:
+        return ""
+    if columns is None:
+        columns = []
+        for row in rows:
+            for key in row:
+                if key not in columns:
+                    columns.append(key)
+    labels = labels or {}
+    lines = ["|".join(labels.get(c, c) for c in columns)]
+    lines.extend("|".join(_compact_value(row.get(c)) for c in columns) for row in rows)
+    return "\n".join(lines)
+
+
+def _parse_date(value):
+    if isinstance(value, (date, datetime)):
+        return value if isinstance(value, date) else value.date()
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def aggregate_transactions(transactions):
+    """Totales de ingresos/gastos, gasto por categoría y gasto por semana ISO."""
+    income = 0.0
+    expense = 0.0
+    by_category = {}
+    by_week = {}
+    for t in transactions:
+        try:
+            amount = abs(float(t.get("amount") or 0))
+        except (TypeError, ValueError):
+            continue
+        if t.get("type") == "Ingreso":
+            income += amount
+            continue
+        expense += amount
+        category = t.get("category") or "Sin categoría"
+        by_category[category] = by_category.get(category, 0.0) + amount
+        day = _parse_date(t.get("transaction_date"))
+        if day is not None:
+            year, week, _ = day.isocalendar()
+            key = f"{year}-S{week:02d}"
+            by_week[key] = by_week.get(key, 0.0) + amount
+    return {
+        "count": len(transactions),
+        "income": income,
+        "expense": expense,
+        "by_category": sorted(by_category.items(), key=lambda kv: kv[1], reverse=True),
+        "by_week": sorted(by_week.items()),
+    }
+
+
+def render_summary(aggregates):
+    lines = [
+        f"Transacciones: {aggregates['count']} | Ingresos: {_compact_value(aggregates['income'])} "
+        f"| Gastos: {_compact_value(aggregates['expense'])}"
+    ]
+    if aggregates["by_category"]:
+        lines.append("Gasto por categoría: " + ", ".join(
+            f"{category} {_compact_value(total)}" for category, total in aggregates["by_category"]
+        ))
+    if aggregates["by_week"]:
+        lines.append("Gasto por semana: " + ", ".join(
+            f"{week} {_compact_value(total)}" for week, total in aggregates["by_week"]
+        ))
+    return "\n".join(lines)
+
+
+def build_transactions_block(transactions, token_budget=None):
+    """
+    Resumen agregado + filas columnares, dentro de `token_budget` tokens aproximados.
+    Las transacciones llegan ordenadas de la más reciente a la más antigua; al recortar se
+    conservan las más recientes.
+    """
+    token_budget = PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    summary = render_summary(aggregate_transactions(transactions))
+    remaining = token_budget - estimate_tokens(summary)
+
+    # Cada fila se codifica una sola vez y se acumula hasta agotar el presupuesto.
+    encoded = encode_rows(transactions, TRANSACTION_COLUMNS, _COLUMN_LABELS).split("\n") if transactions else []
+    lines = []
+    used = 0
+    for line in encoded:
+        cost = estimate_tokens(line + "\n")
+        if used + cost > remaining:
+            break
+        lines.append(line)
+        used += cost
+    kept_rows = max(len(lines) - 1, 0)  # la primera línea es la cabecera
+    rows_text = "\n".join(lines) if kept_rows else ""
+
+    omitted = len(transactions) - kept_rows
+    parts = [summary]
+    if rows_text:
+        parts.append(rows_text)
+    if omitted:
+        parts.append(f"(+{omitted} transacciones más antiguas omitidas; incluidas en los totales)")
+    return "\n".join(parts)
+
+
+def render_financial_summary(summary):
+    """Texto compacto del resumen precalculado (ver get_user_financial_summary en supabase/migrations)."""
+    lines = [
+        f"- Mes actual: ingresos {_compact_value(float(summary.get('month_income') or 0))}, "
+        f"gastos {_compact_value(float(summary.get('month_expense') or 0))} "
+        f"(mes anterior: {_compact_value(float(summary.get('prev_month_income') or 0))} / "
+        f"{_compact_value(float(summary.get('prev_month_expense') or 0))})"
+    ]
+    categories = summary.get("category_totals") or {}
+    if categories:
+        top = sorted(categories.items(), key=lambda kv: float(kv[1]), reverse=True)
+        lines.append("- Gasto del mes por categoría: " + ", ".join(f"{c} {_compact_value(float(v))}" for c, v in top))
+    weeks = summary.get("weekly_expense") or []
+    if weeks:
+        lines.append("- Gasto semanal (Δ vs semana previa): " + ", ".join(
+            f"{_compact_value(w.get('week'))} {_compact_value(float(w.get('expense') or 0))}"
+            + (f" ({float(w['delta']):+.0f})" if w.get("delta") is not None else "")
+            for w in weeks
+        ))
+    if summary.get("monthly_installments"):
+        lines.append(f"- Cuotas mensuales activas: {_compact_value(float(summary['monthly_installments']))}")
+    return "\n".join(lines)
+
+
+def build_debts_block(debt_context):
+    """Deudas a cuotas en formato columnar (o JSON compacto si no son una lista de dicts)."""
+    if not debt_context:
+        return "Sin deudas registradas."
+    if isinstance(debt_context, list) and all(isinstance(d, dict) for d in debt_context):
+        return encode_rows(debt_context)
+    return json.dumps(debt_context, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def apply_summary_defaults(summary, financial_state, mood_context, debt_context):
+    """Completa con el resumen precalculado el contexto que el cliente no envió (ánimo, cuotas, ingreso)."""
+    if summary:
+        if not mood_context and summary.get('predominant_mood'):
+            mood_context = {'predominant': summary['predominant_mood']}
+        if not debt_context and summary.get('installments'):
+            debt_context = summary['installments']
+        if financial_state and not financial_state.get('monthly_income') and summary.get('month_income'):
+            financial_state = {**financial_state, 'monthly_income': summary['month_income']}
+    return financial_state, mood_context, debt_context
+
+
+def build_analysis_prompt(transactions, financial_state, mood_context, debt_context, summary=None):
+    """Prompt de /api/analisis-financiero (también lo usa el job de pregeneración nocturna)."""
+    # Historial en formato compacto (resumen agregado + filas columnares), ver build_transactions_block
+    historial = build_transactions_block(transactions)
+    resumen = render_financial_summary(summary) if summary else ""
+    # Si no hay datos enriquecidos (viniendo de un GET), usamos un prompt más simple
+    if not financial_state:
+        if resumen:
+            return f"Analiza esta situación financiera y dame consejos:\n{resumen}\n\nTransacciones recientes:\n{historial}"
+        return f"Analiza estas transacciones y dame consejos:\n{historial}"
+    return f"""Actúa como 'SasPer AI', asesor financiero experto.
+
+SITUACIÓN ACTUAL:
+- Disponible para gastar: ${financial_state.get('available_balance', 0)}
+- Patrimonio Neto: ${financial_state.get('net_worth', 0)}
+- Ingreso Mensual: ${financial_state.get('monthly_income', 0)}
+{resumen}
+
+CONTEXTO EMOCIONAL:
+- Ánimo predominante: {mood_context.get('predominant', 'neutral')}
+
+DEUDAS A CUOTAS:
+{build_debts_block(debt_context)}
+
+HISTORIAL RECIENTE:
+{historial}
+
+TAREA:
+Escribe un análisis en Markdown con:
+1. Resumen de salud financiera.
+2. Insight sobre el ánimo y los gastos.
+3. Estrategia para sus deudas.
+4. Una meta para esta semana.
+"""
@@ -1,143 +1,283 @@
 import os
+import time
+import logging
+import argparse
 import datetime
-import requests
-from supabase import create_client, Client
+from firebase_admin import messaging
+from supabase import Client
 
-def send_recurring_payment_reminders():
+from clients import close_sync
+from jobs import crear_supabase, guardar_checkpoint, leer_checkpoint, nombre_job, paginar, parse_shard
+from notification_dispatcher import DispatchStats, crear_dispatcher, limpiar_tokens_muertos
+from observability import setup_logging, shutdown_logging
+
+log = logging.getLogger("sasper")
+
+# Tamaño de página del recorrido por keyset (id > último id procesado). Con 500 cada página
+# es exactamente un lote de FCM y la memoria no crece con el número de recordatorios.
+REMINDERS_PAGE_SIZE = int(os.getenv("REMINDERS_PAGE_SIZE", "500"))
+
+
+# --- Etapa 2.5: reclamar en el registro de entregas ---
+LEDGER_CONFLICT_COLUMNS = "kind,source_id,delivery_date,user_id"
+
+
+def _ledger_key(row):
+    return (row["kind"], row["source_id"], row["delivery_date"], row["user_id"])
+
+
+def _reclamar_entregas(supabase, items):
+    """
+    Inserta en bloque las filas de reminder_deliveries (ON CONFLICT DO NOTHING) y devuelve solo
+    los items cuya fila insertó esta ejecución. Si otro worker ya los reclamó, no se reenvían.
+    """
+    if not items:
+        return []
+    response = supabase.table("reminder_deliveries") \
+        .upsert([ledger_row for ledger_row, _, _ in items], on_conflict=LEDGER_CONFLICT_COLUMNS, ignore_duplicates=True) \
+        .execute()
+    claimed = {_ledger_key(row) for row in response.data or []}
+    return [item for item in items if _ledger_key(item[0]) in claimed]
+
+
+def _liberar_entregas(supabase, ledger_rows):
+    """
+    Borra del registro las entregas reclamadas que no llegaron a enviarse (envío fallido o
+    página interrumpida), para que la siguiente ejecución las vuelva a intentar.
+    """
+    grupos = {}
+    for row in ledger_rows:
+        grupos.setdefault((row["kind"], row["delivery_date"]), []).append(row["source_id"])
+    for (kind, delivery_date), source_ids in grupos.items():
+        # Troceado para no exceder el largo de URL de PostgREST.
+        for i in range(0, len(source_ids), 100):
+            supabase.table("reminder_deliveries").delete().eq("kind", kind).eq("delivery_date", delivery_date) \
+                .in_("source_id", source_ids[i:i + 100]).execute()
+
+
+def _ejecutar_pipeline(job, run_key, fetch_page, build_messages, dispatcher):
+    """
+    Recorre las páginas desde el checkpoint, construye los mensajes de cada página, los reclama
+    en el registro de entregas, envía los reclamados, libera los que fallaron y avanza el checkpoint.
+    Al terminar sin errores el checkpoint del job se borra.
+    """
+    supabase = crear_supabase()
+    owned = dispatcher is None
+    dispatcher = dispatcher or crear_dispatcher()
+    total = DispatchStats()
+    start = time.perf_counter()
+    after_id = leer_checkpoint(job, run_key)
+    if after_id is not None:
+        log.info(f"{job}: reanudando desde el id {after_id}.")
+
+    try:
+        pages = 0
+        for rows in paginar(lambda after, limit: fetch_page(supabase, after, limit), after_id, REMINDERS_PAGE_SIZE):
+            pages += 1
+            claimed = _reclamar_entregas(supabase, build_messages(rows))
+            if claimed:
+                try:
+                    stats = dispatcher.send_all([(label, message) for _, label, message in claimed])
+                except Exception:
+                    # Nada de la página cuenta como entregado: se libera entera y no se avanza el checkpoint.
+                    _liberar_entregas(supabase, [ledger_row for ledger_row, _, _ in claimed])
+                    raise
+                fallidos = {id(message) for _, message in stats.failed_items}
+                _liberar_entregas(supabase, [ledger_row for ledger_row, _, message in claimed if id(message) in fallidos])
+                limpiar_tokens_muertos(supabase, stats, job)
+                total.merge(stats)
+            guardar_checkpoint(job, run_key, rows[-1]["id"])
+        guardar_checkpoint(job, run_key, None)
+    finally:
+        if owned:
+            dispatcher.close()
+
+    if pages == 0:
+        log.info(f"{job}: no hay recordatorios para enviar hoy. Misión cumplida.")
+    total.elapsed = time.perf_counter() - start
+    log.info(f"{job}: {pages} páginas, {total.summary()}")
+    return total
+
+
+def _mensajes_recurrentes(reminders):
+    """Etapa 2 para pagos recurrentes: filas -> (fila del registro, etiqueta, messaging.Message)."""
+    notifications = []
+    for reminder in reminders:
+        if not reminder.get("fcm_token"):
+            log.warning(f"No se encontró token FCM para la transacción: {reminder['description']}")
+            continue
+
+        payment_date = datetime.datetime.strptime(reminder["next_due_date"], "%Y-%m-%d")
+        # Aquí puedes mejorar el formato del mes si es necesario
+        formatted_date = f"{payment_date.day} de {payment_date.strftime('%B').lower()}"
+
+        title = "Recordatorio de Próximo Pago" if reminder["type"] == "Gasto" else "Recordatorio de Próximo Ingreso"
+        body = f"Tu próximo {reminder['type'].lower()} es: {reminder['description']}. Fecha: {formatted_date}."
+
+        message = messaging.Message(
+            notification=messaging.Notification(title=title, body=body),
+            token=reminder["fcm_token"],
+            data={"screen": "/recurring_transactions"}
+        )
+        ledger_row = {
+            "kind": "recurring_payment",
+            "source_id": reminder["id"],
+            "delivery_date": reminder["next_due_date"],
+            "user_id": reminder["user_id"],
+        }
+        notifications.append((ledger_row, reminder['description'], message))
+    return notifications
+
+
+def _mensajes_metas(insights, run_date):
+    """Etapa 2 para metas de ahorro: filas -> (fila del registro, etiqueta, messaging.Message)."""
+    notifications = []
+    for insight in insights:
+        if not insight.get("fcm_token"):
+            continue
+
+        meta = insight.get("metadata") or {}
+        goal_name = meta.get("goal_name", "tu meta")
+        savings_amount = meta.get("savings_amount", 0)
+
+        # Los valores de 'data' en FCM v1 deben ser strings.
+        message = messaging.Message(
+            notification=messaging.Notification(
+                title="✨ Hoy toca ahorrar para tu meta",
+                body=f"¡Aporta ${savings_amount} para \"{goal_name}\"!"
+            ),
+            token=insight["fcm_token"],
+            data={"type": "goal_reminder", "goal_id": str(meta.get("goal_id") or "")}
+        )
+        ledger_row = {
+            "kind": "goal_saving",
+            "source_id": insight["id"],
+            "delivery_date": run_date,
+            "user_id": insight["user_id"],
+        }
+        notifications.append((ledger_row, f"usuario {insight['user_id']}", message))
+    return notifications
+
+
+def send_recurring_payment_reminders(dispatcher=None, shard=(0, 1)):
     """
     Busca transacciones recurrentes que vencen mañana y envía notificaciones push.
+    Si no se pasa un dispatcher compartido, se crea uno para esta ejecución.
+    `shard=(i, n)` limita el job a los usuarios cuya partición por hash de user_id es i.
     """
-    print("Iniciando la revisión de transacciones recurrentes...")
+    log.info("Iniciando la revisión de transacciones recurrentes...")
 
     try:
-        # 1. Cargar las variables de entorno de forma segura desde Render
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_SERVICE_KEY") # Usamos la clave de servicio para tener acceso total
-        fcm_server_key = os.getenv("FCM_SERVER_KEY")
-
-        if not all([supabase_url, supabase_key, fcm_server_key]):
-            print("Error: Faltan variables de entorno (SUPABASE_URL, SUPABASE_SERVICE_KEY, o FCM_SERVER_KEY).")
-            return
-
-        # 2. Conectarse a Supabase
-        supabase: Client = create_client(supabase_url, supabase_key)
-
-        # 3. Calcular la fecha de mañana
-        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
-        tomorrow_str = tomorrow.strftime("%Y-%m-%d")
-
-        # 4. Consultar las transacciones que vencen mañana
-        response = supabase.from_("recurring_transactions") \
-            .select("description, type, next_due_date, profiles(fcm_token)") \
-            .eq("next_due_date", tomorrow_str) \
-            .not_("profiles", "is", "null") \
-            .execute()
-
-        reminders = response.data
-        if not reminders:
-            print("No hay recordatorios para enviar hoy. Misión cumplida.")
-            return
-
-        print(f"Se encontraron {len(reminders)} recordatorios para enviar.")
-
-        # 5. Iterar y enviar notificaciones
-        for reminder in reminders:
-            profile = reminder.get("profiles")
-            if not profile or not profile.get("fcm_token"):
-                print(f"Advertencia: No se encontró token FCM para la transacción: {reminder['description']}")
-                continue
-
-            fcm_token = profile["fcm_token"]
-            
-            payment_date = datetime.datetime.strptime(reminder["next_due_date"], "%Y-%m-%d")
-            # Aquí puedes mejorar el formato del mes si es necesario
-            formatted_date = f"{payment_date.day} de {payment_date.strftime('%B').lower()}"
-
-            title = "Recordatorio de Próximo Pago" if reminder["type"] == "Gasto" else "Recordatorio de Próximo Ingreso"
-            body = f"Tu próximo {reminder['type'].lower()} es: {reminder['description']}. Fecha: {formatted_date}."
-
-            # Construir el payload para FCM
-            headers = {
-                "Authorization": f"key={fcm_server_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "to": fcm_token,
-                "notification": {
-                    "title": title,
-                    "body": body
-                },
-                "data": {
-                    "screen": "/recurring_transactions"
-                }
-            }
-
-            # Enviar la petición a FCM
-            fcm_response = requests.post("https://fcm.googleapis.com/fcm/send", json=payload, headers=headers)
-
-            if fcm_response.status_code == 200:
-                print(f"Notificación enviada con éxito para: {reminder['description']}")
-            else:
-                print(f"Error al enviar notificación para {reminder['description']}: {fcm_response.text}")
+        tomorrow_str = (datetime.date.today() + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+
+        # El filtro de entregas ya registradas se hace en la propia consulta (anti-join en la RPC).
+        def fetch_page(supabase: Client, after_id, limit):
+            return supabase.rpc("pending_recurring_reminders", {
+                "p_due_date": tomorrow_str, "p_after_id": after_id, "p_limit": limit,
+                "p_shard_index": shard[0], "p_shard_count": shard[1],
+            }).execute().data
+
+        return _ejecutar_pipeline(nombre_job("recurring_payments", shard), tomorrow_str, fetch_page, _mensajes_recurrentes, dispatcher)
 
     except Exception as e:
-        print(f"Error fatal en la función de recordatorios: {e}")
+        log.exception(f"Error fatal en la función de recordatorios: {e}")
 
-def send_goal_reminders():
+def send_goal_reminders(dispatcher=None, shard=(0, 1)):
     """
     Busca insights de tipo 'goal_saving_reminder' y envía notificaciones push.
+    Si no se pasa un dispatcher compartido, se crea uno para esta ejecución.
+    `shard=(i, n)` limita el job a los usuarios cuya partición por hash de user_id es i.
     """
-    print("Iniciando revisión de metas...")
+    log.info("Iniciando revisión de metas...")
     try:
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
-        fcm_server_key = os.getenv("FCM_SERVER_KEY")
-        
-        supabase = create_client(supabase_url, supabase_key)
-
-        # 1. Buscar insights de metas pendientes
-        response = supabase.from_("insights") \
-            .select("id, user_id, metadata, profiles(fcm_token)") \
-            .eq("type", "goal_saving_reminder") \
-            .eq("is_read", False) \
-            .execute()
-
-        insights = response.data
-        if not insights:
-            print("No hay metas para recordar hoy.")
-            return
-
-        for insight in insights:
-            profile = insight.get("profiles")
-            if not profile or not profile.get("fcm_token"):
-                continue
-
-            # 2. Extraer datos del JSON metadata
-            meta = insight.get("metadata", {})
-            goal_name = meta.get("goal_name", "tu meta")
-            savings_amount = meta.get("savings_amount", 0)
-
-            # 3. Enviar notificación Push (Firebase)
-            headers = {"Authorization": f"key={fcm_server_key}", "Content-Type": "application/json"}
-            payload = {
-                "to": profile["fcm_token"],
-                "notification": {
-                    "title": "✨ Hoy toca ahorrar para tu meta",
-                    "body": f"¡Aporta ${savings_amount} para \"{goal_name}\"!"
-                },
-                "data": {
-                    "type": "goal_reminder",
-                    "goal_id": meta.get("goal_id")
-                }
-            }
-            
-            requests.post("https://fcm.googleapis.com/fcm/send", json=payload, headers=headers)
-            print(f"Notificación de ahorro enviada a usuario {insight['user_id']}")
+        run_date = datetime.date.today().isoformat()
+
+        def fetch_page(supabase: Client, after_id, limit):
+            return supabase.rpc("pending_goal_reminders", {
+                "p_run_date": run_date, "p_after_id": after_id, "p_limit": limit,
+                "p_shard_index": shard[0], "p_shard_count": shard[1],
+            }).execute().data
+
+        return _ejecutar_pipeline(nombre_job("goal_reminders", shard), run_date, fetch_page, lambda rows: _mensajes_metas(rows, run_date), dispatcher)
 
     except Exception as e:
-        print(f"Error en send_goal_reminders: {e}")
+        log.exception(f"Error en send_goal_reminders: {e}")
+
+# --- Modo worker por particiones ---
+JOBS = {
+    "recurring_payments": send_recurring_payment_reminders,
+    "goal_reminders": send_goal_reminders,
+}
+
+
+def _resultado(job, shard, stats, elapsed):
+    """Resumen serializable (se devuelve entre procesos) de un job sobre una partición."""
+    return {
+        "job": job,
+        "shard": f"{shard[0]}/{shard[1]}",
+        "ok": stats is not None,
+        "sent": stats.sent if stats else 0,
+        "failed": stats.failed if stats else 0,
+        "dead_tokens": len(stats.dead_tokens) if stats else 0,
+        "retries": stats.retries if stats else 0,
+        "elapsed": elapsed,
+    }
+
+
+def _ejecutar_job_en_shard(job, shard):
+    """Punto de entrada de cada proceso del lanzador local: un job sobre una partición."""
+    setup_logging()
+    start = time.perf_counter()
+    try:
+        with crear_dispatcher() as dispatcher:
+            stats = JOBS[job](dispatcher, shard=shard)
+    finally:
+        close_sync()
+        # El proceso del pool puede terminar sin más aviso: se vacía la cola de logs ahora.
+        shutdown_logging()
+    return _resultado(job, shard, stats, time.perf_counter() - start)
+
+
+def _imprimir_reporte(results, wall_time):
+    log.info("=== Reporte de recordatorios ===")
+    log.info(f"{'job':<20} {'shard':>7} {'enviadas':>9} {'fallidas':>9} {'muertos':>8} {'tiempo':>8}")
+    for r in sorted(results, key=lambda r: (r["job"], r["shard"])):
+        estado = "" if r["ok"] else "  (ERROR)"
+        log.info(f"{r['job']:<20} {r['shard']:>7} {r['sent']:>9} {r['failed']:>9} {r['dead_tokens']:>8} {r['elapsed']:>7.2f}s{estado}")
+    for job in JOBS:
+        job_results = [r for r in results if r["job"] == job]
+        if job_results:
+            log.info(f"Total {job}: {sum(r['sent'] for r in job_results)} enviadas, "
+                     f"{sum(r['failed'] for r in job_results)} fallidas, "
+                     f"shard más lento {max(r['elapsed'] for r in job_results):.2f}s")
+    log.info(f"Tiempo total: {wall_time:.2f}s (suma de workers: {sum(r['elapsed'] for r in results):.2f}s)")
+
 
 # Y finalmente, asegúrate de llamar a ambas funciones en el __main__
 if __name__ == "__main__":
-    send_recurring_payment_reminders()
-    send_goal_reminders() # <-- Añade esta línea
\ No newline at end of file
+    from concurrent.futures import ProcessPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Envía los recordatorios push diarios.")
+    parser.add_argument("--shard", type=parse_shard, default=(0, 1),
+                        help="Partición i/N por hash de user_id (para N instancias de cron).")
+    parser.add_argument("--local-workers", type=int, default=0,
+                        help="Lanza N particiones localmente, con ambos tipos de recordatorio en paralelo.")
+    args = parser.parse_args()
+
+    setup_logging()
+    start = time.perf_counter()
+    if args.local_workers > 0:
+        tasks = [(job, (i, args.local_workers)) for job in JOBS for i in range(args.local_workers)]
+        with ProcessPoolExecutor(max_workers=len(tasks)) as pool:
+            results = list(pool.map(_ejecutar_job_en_shard, *zip(*tasks)))
+    else:
+        # Un único dispatcher para ambos jobs: comparten la app de Firebase y su token OAuth cacheado.
+        results = []
+        with crear_dispatcher() as shared_dispatcher:
+            for job, send_fn in JOBS.items():
+                job_start = time.perf_counter()
+                stats = send_fn(shared_dispatcher, shard=args.shard)
+                results.append(_resultado(job, args.shard, stats, time.perf_counter() - job_start))
+        close_sync()
+    _imprimir_reporte(results, time.perf_counter() - start)
+    shutdown_logging()
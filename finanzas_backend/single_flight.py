@@ -0,0 +1,61 @@
+# single_flight.py
+#
+# Deduplicación de peticiones idénticas en curso ("single-flight").
+# La app a veces lanza dos veces el mismo análisis (doble toque, reconstrucción de pantalla,
+# reintento GET+POST). Con SingleFlight la primera petición con una clave hace el trabajo
+# (consulta a Supabase + generación en Gemini) y las que llegan mientras tanto con la misma
+# clave esperan ese mismo resultado en lugar de repetirlo.
+
+import asyncio
+import hashlib
+import json
+
+
+def request_key(*parts):
+    """Clave estable (SHA-256) a partir de las entradas de la petición."""
+    normalized = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Comparte una única ejecución entre las llamadas concurrentes con la misma clave."""
+
+    def __init__(self):
+        self._in_flight = {}  # key -> asyncio.Task
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    async def do(self, key, coro_factory):
+        """
+        Ejecuta `coro_factory()` si no hay otra ejecución en curso con `key`; si la hay, espera
+        su resultado (o su excepción). La tarea no se cancela si se desconecta quien la inició
+        mientras otras peticiones siguen esperándola.
+        """
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(coro_factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            self.failures += 1
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+            "failures": self.failures,
+            "in_flight": len(self._in_flight),
+        }
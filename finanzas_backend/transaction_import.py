@@ -0,0 +1,378 @@
+# transaction_import.py
+#
+# Importación de extractos bancarios (CSV u OFX) para POST /api/transactions/import.
+# Antes la app insertaba los movimientos de uno en uno y llamaba a /check-budget-on-transaction
+# tras cada insert. Aquí:
+#   1. el cuerpo de la petición se decodifica y se parsea según va llegando (trozo a trozo, sin
+#      cargar el fichero entero): los parsers reciben texto y devuelven los registros completos;
+#   2. cada registro se valida y normaliza a una fila de 'transactions' con una huella
+#      (import_hash) de cuenta, fecha, importe y descripción (o FITID en OFX);
+#   3. las filas se envían en upserts multi-fila de IMPORT_BATCH_SIZE con ON CONFLICT DO NOTHING
+#      sobre (user_id, import_hash): reimportar el mismo extracto no duplica nada. Hay como mucho
+#      IMPORT_MAX_IN_FLIGHT lotes en vuelo mientras se sigue parseando, así que la memoria queda
+#      acotada a unos pocos lotes más el conjunto de huellas vistas;
+#   4. al terminar se encola una sola evaluación de presupuestos por categoría afectada
+#      (enqueue_budget_alert_events()), que atiende budget_alert_consumer.py.
+# Migración: 20261017160000_transaction_import.sql.
+
+import os
+import re
+import csv
+import time
+import codecs
+import asyncio
+import hashlib
+import datetime
+import functools
+import unicodedata
+from decimal import Decimal, InvalidOperation
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_IN_FLIGHT = int(os.getenv("IMPORT_MAX_IN_FLIGHT", "2"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+# Errores de fila que se devuelven con detalle (el resto solo se cuentan).
+IMPORT_MAX_ERRORS_REPORTED = 20
+DEFAULT_CATEGORY = "Otros"
+DESCRIPTION_MAX_LENGTH = 255
+
+# Cabeceras CSV aceptadas (sin tildes, en minúsculas) -> campo.
+CSV_COLUMNS = {
+    "date": ("fecha", "date", "fecha operacion", "fecha valor", "fecha movimiento", "transaction_date"),
+    "amount": ("importe", "monto", "amount", "cantidad", "valor"),
+    "debit": ("cargo", "debe", "debito", "debit", "retiro"),
+    "credit": ("abono", "haber", "credito", "credit", "deposito"),
+    "description": ("descripcion", "concepto", "description", "detalle", "movimiento", "memo"),
+    "category": ("categoria", "category"),
+    "type": ("tipo", "type"),
+}
+EXPENSE_TYPES = {"gasto", "expense", "debit", "cargo", "egreso"}
+INCOME_TYPES = {"ingreso", "income", "credit", "abono"}
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%Y/%m/%d", "%Y%m%d")
+
+
+class StatementError(ValueError):
+    """El extracto no se puede importar (formato desconocido, cabecera sin columnas obligatorias...)."""
+
+
+class StatementTooLargeError(StatementError):
+    pass
+
+
+def _sin_tildes(value):
+    return "".join(c for c in unicodedata.normalize("NFKD", value) if not unicodedata.combining(c)).strip().lower()
+
+
+class CsvStatementParser:
+    """Parser incremental de CSV: detecta el separador (, ; o tabulador) y las columnas en la cabecera."""
+
+    def __init__(self):
+        self._buffer = ""
+        self._pending = []  # líneas de un registro con un campo entrecomillado aún abierto
+        self._line = 0
+        self._delimiter = None
+        self._columns = None
+
+    def feed(self, text):
+        """Añade texto y devuelve los registros completos como (nº de línea, {campo: valor})."""
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._parse_lines(lines)
+
+    def close(self):
+        lines, self._buffer = ([self._buffer] if self._buffer else []), ""
+        records = self._parse_lines(lines)
+        if self._pending:
+            records.append((self._line, StatementError("comillas sin cerrar al final del fichero")))
+        if self._columns is None:
+            raise StatementError("El CSV está vacío")
+        return records
+
+    def _parse_lines(self, lines):
+        records = []
+        for line in lines:
+            self._line += 1
+            self._pending.append(line.rstrip("\r"))
+            text = "\n".join(self._pending)
+            if text.count('"') % 2:
+                continue
+            self._pending = []
+            if not text.strip():
+                continue
+            if self._columns is None:
+                self._read_header(text)
+                continue
+            try:
+                values = next(csv.reader([text], delimiter=self._delimiter))
+            except csv.Error as e:
+                records.append((self._line, ValueError(f"línea CSV no válida: {e}")))
+                continue
+            records.append((self._line, {field: values[i].strip() for field, i in self._columns.items() if i < len(values)}))
+        return records
+
+    def _read_header(self, text):
+        self._delimiter = max((",", ";", "\t"), key=text.count)
+        names = [_sin_tildes(name) for name in next(csv.reader([text], delimiter=self._delimiter))]
+        self._columns = {}
+        for field, aliases in CSV_COLUMNS.items():
+            for alias in aliases:
+                if alias in names:
+                    self._columns[field] = names.index(alias)
+                    break
+        if "date" not in self._columns or not ({"amount", "debit", "credit"} & self._columns.keys()):
+            raise StatementError("La cabecera del CSV necesita una columna de fecha y otra de importe (o cargo/abono)")
+
+
+class OfxStatementParser:
+    """Parser incremental de OFX (SGML 1.x o XML 2.x): extrae cada bloque <STMTTRN>."""
+
+    _TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.IGNORECASE | re.DOTALL)
+    _FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+    def __init__(self):
+        self._buffer = ""
+        self._count = 0
+
+    def feed(self, text):
+        self._buffer += text
+        records, end = [], 0
+        for match in self._TRANSACTION.finditer(self._buffer):
+            self._count += 1
+            fields = {name.upper(): value.strip() for name, value in self._FIELD.findall(match.group(1))}
+            records.append((self._count, {
+                "date": fields.get("DTPOSTED", "")[:8],
+                "amount": fields.get("TRNAMT", ""),
+                "description": " ".join(filter(None, (fields.get("NAME"), fields.get("MEMO")))),
+                "fitid": fields.get("FITID"),
+            }))
+            end = match.end()
+        self._buffer = self._buffer[end:]
+        # Sin bloque abierto solo hace falta conservar lo justo para no partir una etiqueta.
+        start = self._buffer.upper().find("<STMTTRN>")
+        self._buffer = self._buffer[start:] if start >= 0 else self._buffer[-len("<STMTTRN>"):]
+        return records
+
+    def close(self):
+        self._buffer = ""
+        return []
+
+
+def detect_format(head):
+    """'ofx' o 'csv' a partir de los primeros bytes del fichero."""
+    start = head.lstrip(b"\xef\xbb\xbf \r\n\t")[:16].upper()
+    return "ofx" if start.startswith((b"OFXHEADER", b"<?XML", b"<OFX")) else "csv"
+
+
+# Un extracto repite pocas fechas distintas y strptime es lo más caro de cada fila.
+@functools.lru_cache(maxsize=4096)
+def _parse_date(value):
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value[:10] if fmt == "%Y-%m-%d" else value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"fecha no reconocida: '{value}'")
+
+
+def _parse_amount(value):
+    """Admite '1234.56', '-1.234,56', '1,234.56', '$ 12,50'... El último separador es el decimal."""
+    text = re.sub(r"[^\d,.\-+()]", "", value or "")
+    negative = text.startswith("-") or (text.startswith("(") and text.endswith(")"))
+    text = text.strip("-+()")
+    if "," in text and "." in text:
+        decimal_sep = "," if text.rfind(",") > text.rfind(".") else "."
+        text = text.replace("." if decimal_sep == "," else ",", "").replace(",", ".")
+    elif "," in text:
+        text = text.replace(",", ".") if text.count(",") == 1 else text.replace(",", "")
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"importe no válido: '{value}'")
+    return -amount if negative else amount
+
+
+def _importe(record):
+    if record.get("amount"):
+        return _parse_amount(record["amount"])
+    debit = _parse_amount(record["debit"]) if record.get("debit") else Decimal(0)
+    credit = _parse_amount(record["credit"]) if record.get("credit") else Decimal(0)
+    return credit - abs(debit)
+
+
+class ImportResult:
+    """Contadores de una importación; to_dict() es la respuesta del endpoint."""
+
+    def __init__(self, fmt):
+        self.format = fmt
+        self.rows = 0
+        self.valid = 0
+        self.invalid = 0
+        self.inserted = 0
+        self.batches = 0
+        self.errors = []  # (nº de línea o de movimiento, detalle)
+        self.categories = set()  # categorías de gasto del mes en curso
+        self.alerts_enqueued = 0
+        self.elapsed = 0.0
+
+    def add_error(self, line, detail):
+        self.invalid += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS_REPORTED:
+            self.errors.append({"line": line, "error": str(detail)})
+
+    def to_dict(self):
+        return {
+            "format": self.format,
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "duplicates": self.valid - self.inserted,
+            "invalid": self.invalid,
+            "errors": self.errors,
+            "batches": self.batches,
+            "budget_categories_enqueued": self.alerts_enqueued,
+            "elapsed_s": round(self.elapsed, 3),
+        }
+
+
+class StatementImporter:
+    """Convierte los registros de un extracto en filas de 'transactions' y las inserta por lotes."""
+
+    def __init__(self, db, user_id, account_id=None, default_category=DEFAULT_CATEGORY,
+                 batch_size=IMPORT_BATCH_SIZE, max_in_flight=IMPORT_MAX_IN_FLIGHT, today=None, alerts_db=None):
+        self.db = db
+        # enqueue_budget_alert_events solo se concede a la clave de servicio.
+        self.alerts_db = alerts_db or db
+        self.user_id = user_id
+        self.account_id = account_id
+        self.default_category = default_category
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.today = today or datetime.date.today()
+        self._seen = {}  # huella base -> apariciones en este fichero
+        self._batch = []
+        self._in_flight = set()
+        self.result = None
+
+    def _fila(self, record):
+        """Fila de 'transactions' para un registro; ValueError si no es válido."""
+        date = _parse_date(record.get("date") or "")
+        amount = _importe(record)
+        if amount == 0:
+            raise ValueError("importe cero")
+        kind = _sin_tildes(record.get("type") or "")
+        tx_type = "Gasto" if kind in EXPENSE_TYPES else "Ingreso" if kind in INCOME_TYPES else \
+            "Gasto" if amount < 0 else "Ingreso"
+        # Como en la app: los gastos se guardan en negativo y los ingresos en positivo.
+        amount = -abs(amount) if tx_type == "Gasto" else abs(amount)
+        description = " ".join((record.get("description") or "").split())[:DESCRIPTION_MAX_LENGTH]
+        category = (record.get("category") or "").strip() or self.default_category
+
+        # Dos movimientos idénticos el mismo día son legítimos (dos cafés): la n-ésima aparición
+        # dentro del fichero forma parte de la huella, así que reimportarlo da las mismas huellas.
+        fitid = record.get("fitid")
+        base = f"fitid|{self.account_id or ''}|{fitid}" if fitid else \
+            f"{self.account_id or ''}|{date.isoformat()}|{amount.quantize(Decimal('0.01'))}|{description.lower()}"
+        digest = hashlib.sha256(base.encode()).digest()[:16]
+        occurrence = self._seen.get(digest, 0)
+        self._seen[digest] = occurrence + 1
+
+        row = {
+            "user_id": self.user_id,
+            "amount": float(amount),
+            "type": tx_type,
+            "category": category,
+            "description": description,
+            "transaction_date": date.isoformat(),
+            "import_hash": hashlib.sha256(f"{base}|{occurrence}".encode()).hexdigest()[:32],
+        }
+        if self.account_id:
+            row["account_id"] = self.account_id
+        if tx_type == "Gasto" and (date.year, date.month) == (self.today.year, self.today.month):
+            self.result.categories.add(category)
+        return row
+
+    async def _insertar(self, rows):
+        response = await self.db.table('transactions') \
+            .upsert(rows, on_conflict='user_id,import_hash', ignore_duplicates=True,
+                    returning='minimal', count='exact') \
+            .execute()
+        self.result.inserted += response.count or 0
+
+    async def _esperar(self, return_when):
+        done, self._in_flight = await asyncio.wait(self._in_flight, return_when=return_when)
+        for task in done:
+            task.result()  # propaga el primer error de inserción
+
+    async def _enviar_lote(self):
+        if not self._batch:
+            return
+        if len(self._in_flight) >= self.max_in_flight:
+            await self._esperar(asyncio.FIRST_COMPLETED)
+        batch, self._batch = self._batch, []
+        self.result.batches += 1
+        self._in_flight.add(asyncio.ensure_future(self._insertar(batch)))
+
+    async def _procesar(self, records):
+        for line, record in records:
+            self.result.rows += 1
+            if isinstance(record, Exception):
+                self.result.add_error(line, record)
+                continue
+            try:
+                self._batch.append(self._fila(record))
+            except ValueError as e:
+                self.result.add_error(line, e)
+                continue
+            self.result.valid += 1
+            if len(self._batch) >= self.batch_size:
+                await self._enviar_lote()
+
+    def _iniciar(self, head, fmt):
+        fmt = fmt or detect_format(head)
+        # OFX 1.x suele venir en Windows-1252 y lo declara en la cabecera.
+        encoding = "cp1252" if fmt == "ofx" and b"CHARSET:1252" in head[:512].upper() else "utf-8-sig"
+        self.result = ImportResult(fmt)
+        parser = OfxStatementParser() if fmt == "ofx" else CsvStatementParser()
+        return parser, codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    async def run(self, chunks, fmt=None, max_bytes=IMPORT_MAX_BYTES):
+        """
+        Importa el extracto que llega en `chunks` (iterable asíncrono de bytes). `fmt` ('csv' u
+        'ofx') se detecta por el contenido si no se indica. Si una inserción falla, lo ya insertado
+        se queda y reintentar la importación completa es seguro (las huellas descartan lo repetido).
+        """
+        start = time.perf_counter()
+        parser, decoder, received, head = None, None, 0, b""
+        try:
+            async for chunk in chunks:
+                received += len(chunk)
+                if received > max_bytes:
+                    raise StatementTooLargeError(f"El extracto supera el máximo de {max_bytes // (1024 * 1024)} MB")
+                if parser is None:
+                    # El formato y la codificación se deciden con los primeros bytes.
+                    head += chunk
+                    if len(head) < 512:
+                        continue
+                    parser, decoder = self._iniciar(head, fmt)
+                    chunk = head
+                await self._procesar(parser.feed(decoder.decode(chunk)))
+            if parser is None and head:
+                parser, decoder = self._iniciar(head, fmt)
+                await self._procesar(parser.feed(decoder.decode(head)))
+            if parser is None:
+                raise StatementError("El extracto está vacío")
+            await self._procesar(parser.feed(decoder.decode(b"", final=True)) + parser.close())
+            await self._enviar_lote()
+            if self._in_flight:
+                await self._esperar(asyncio.ALL_COMPLETED)
+        except BaseException:
+            for task in self._in_flight:
+                task.cancel()
+            raise
+
+        if self.result.inserted and self.result.categories:
+            response = await self.alerts_db.rpc('enqueue_budget_alert_events', {
+                'p_user_id': self.user_id, 'p_categories': sorted(self.result.categories),
+            }).execute()
+            self.result.alerts_enqueued = response.data or 0
+        self.result.elapsed = time.perf_counter() - start
+        return self.result
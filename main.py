@@ -1,41 +1,61 @@
 # main.py - VERSIÓN DE PRODUCCIÓN FINAL
 
 import os
-import json
-import httpx
+import functools
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Query
-from supabase import create_client, Client
-from supabase.lib.client_options import ClientOptions
+from supabase import Client
 import google.generativeai as genai
 
+from finanzas_backend.clients import close_sync, get_supabase
+from finanzas_backend.model_router import ModelRouter
+from finanzas_backend.observability import install_http_instrumentation, setup_logging, shutdown_logging, span
+from finanzas_backend.prompt_builder import build_transactions_block
+
 # --- 1. CONFIGURACIÓN INICIAL Y CLIENTES ---
 load_dotenv()
 
+# Logging encolado con request-id (ver finanzas_backend/observability.py)
+log = setup_logging()
+
 # --- Configuración del cliente de Supabase (con el fix de SSL) ---
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
 if not supabase_url or not supabase_key:
     raise RuntimeError("Credenciales de Supabase no encontradas en el archivo .env.")
 
-# Creamos la opción para deshabilitar la verificación SSL que tu red local necesita
-options = ClientOptions(httpx_client=httpx.Client(verify=False))
-supabase: Client = create_client(supabase_url, supabase_key, options=options)
-print("✅ Cliente de Supabase inicializado correctamente (con fix SSL).")
+# Deshabilitamos la verificación SSL que tu red local necesita (salvo que se indique otra cosa).
+# El cliente usa el transporte HTTP compartido con pool y keep-alive (finanzas_backend/clients.py).
+os.environ.setdefault("HTTP_VERIFY_SSL", "false")
+supabase: Client = get_supabase()
+log.info("✅ Cliente de Supabase inicializado correctamente (con fix SSL).")
 
 # --- Configuración del cliente de Google Gemini ---
 gemini_api_key = os.getenv("GEMINI_API_KEY")
 if not gemini_api_key:
     raise RuntimeError("No se encontró la API Key de Gemini en el archivo .env.")
 genai.configure(api_key=gemini_api_key)
-gemini_model = genai.GenerativeModel('gemini-2.5-pro')
-print(f"✅ Cliente de Gemini inicializado con el modelo: {gemini_model.model_name}")
+# Un GenerativeModel por nombre; el router elige el rápido para este prompt simple y pasa
+# al pro si el rápido agota la cuota (ver finanzas_backend/model_router.py).
+gemini_router = ModelRouter(functools.lru_cache(maxsize=None)(genai.GenerativeModel))
+log.info(f"✅ Cliente de Gemini inicializado (modelos: {gemini_router.fast_model} / {gemini_router.pro_model})")
 
 # --- 2. APLICACIÓN API ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Al apagar: cerrar las conexiones del pool compartido y vaciar la cola de logs.
+    close_sync()
+    shutdown_logging()
+
+
 app = FastAPI(
     title="API de Finanzas Personales con IA",
-    description="Conecta Flutter, Supabase y Gemini para análisis financieros."
+    description="Conecta Flutter, Supabase y Gemini para análisis financieros.",
+    lifespan=lifespan,
 )
+install_http_instrumentation(app)
 
 # --- 3. ENDPOINTS ---
 @app.get("/", tags=["General"])
@@ -46,46 +66,47 @@ def read_root():
 async def generar_analisis_financiero(
     user_id: str = Query(..., description="El UUID del usuario de Supabase a analizar.")
 ):
-    print(f"\n--- [NUEVA PETICIÓN] para el usuario: {user_id} ---")
+    log.info(f"--- [NUEVA PETICIÓN] para el usuario: {user_id} ---")
     
     try:
         # --- PASO A: Consultar Supabase ---
-        print("1. Consultando transacciones en Supabase...")
-        response = supabase.table('transactions') \
-                           .select('description, amount, type, category, transaction_date') \
-                           .eq('user_id', user_id) \
-                           .order('transaction_date', desc=True) \
-                           .limit(50) \
-                           .execute()
+        log.info("1. Consultando transacciones en Supabase...")
+        with span("supabase.historial"):
+            response = supabase.table('transactions') \
+                               .select('description, amount, type, category, transaction_date') \
+                               .eq('user_id', user_id) \
+                               .order('transaction_date', desc=True) \
+                               .limit(50) \
+                               .execute()
         
         if not response.data:
-            print("Resultado: No se encontraron transacciones (¿Falta política de RLS en la tabla 'transactions'?).")
+            log.info("Resultado: No se encontraron transacciones (¿Falta política de RLS en la tabla 'transactions'?).")
             return {"analisis": "No he encontrado transacciones para analizar. ¡Empieza a registrar tus gastos para recibir tu primer análisis!"}
 
         transactions = response.data
-        print(f"2. Se encontraron {len(transactions)} transacciones.")
+        log.info(f"2. Se encontraron {len(transactions)} transacciones.")
 
         # --- PASO B: Construir el Prompt ---
-        print("3. Construyendo el prompt para Gemini...")
-        transactions_json = json.dumps(transactions, indent=2, default=str)
-        prompt = f"""
-        Eres 'Financiero AI', un asesor financiero experto y amigable.
-        Analiza las siguientes transacciones de un usuario y proporciónale un resumen claro, una observación clave y un consejo práctico.
-        Mantén un tono motivador y cercano.
-        
-        Datos de las transacciones:
-        ```json
-        {transactions_json}
-        ```
-        """
-        print("4. Prompt generado. Enviando a Gemini...")
+        log.info("3. Construyendo el prompt para Gemini...")
+        # Formato compacto compartido con finanzas_backend (resumen agregado + filas columnares)
+        with span("prompt"):
+            historial = build_transactions_block(transactions)
+        prompt = f"""Eres 'Financiero AI', un asesor financiero experto y amigable.
+Analiza las siguientes transacciones de un usuario y proporciónale un resumen claro, una observación clave y un consejo práctico.
+Mantén un tono motivador y cercano.
+
+Datos de las transacciones (resumen y filas fecha|tipo|categoria|monto|descripcion):
+{historial}
+"""
+        log.info("4. Prompt generado. Enviando a Gemini...")
 
         # --- PASO C: Llamar a Gemini ---
-        gemini_response = gemini_model.generate_content(prompt)
+        with span("gemini"):
+            gemini_response, model_name = gemini_router.generate_sync(prompt, enriched=False)
         
-        print("5. ¡ÉXITO! Análisis recibido de Gemini.")
+        log.info(f"5. ¡ÉXITO! Análisis recibido de Gemini ({model_name}).")
         return {"analisis": gemini_response.text}
 
     except Exception as e:
-        print(f"--- ¡ERROR! Ocurrió un error inesperado: {e} ---")
+        log.exception(f"--- ¡ERROR! Ocurrió un error inesperado: {e} ---")
         raise HTTPException(status_code=500, detail=f"No se pudo completar el análisis. Error: {str(e)}")
\ No newline at end of file
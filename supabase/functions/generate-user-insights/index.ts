@@ -1,3 +1,5 @@
+// Sustituida por el motor por lotes finanzas_backend/generate_insights.py (ver la migración
+// 20261017140000_batch_insights.sql, que retira su llamada diaria desde pg_cron).
 import { createClient } from 'https://esm.sh/@supabase/supabase-js@2';
 import { serve } from 'https://deno.land/std@0.177.0/http/server.ts';
 
@@ -0,0 +1,85 @@
+-- Gasto mensual agregado por usuario/categoría, mantenido por trigger.
+-- /check-budget-on-transaction pasa de traer cada fila de 'transactions' del mes a una
+-- sola búsqueda por clave primaria en esta tabla.
+
+-- Índice para las consultas por usuario/categoría/tipo/fecha (también acelera el backfill).
+CREATE INDEX IF NOT EXISTS idx_transactions_user_category_type_date
+  ON public.transactions (user_id, category, type, transaction_date);
+
+CREATE TABLE IF NOT EXISTS public.monthly_category_spend (
+  user_id     UUID        NOT NULL,
+  category    TEXT        NOT NULL,
+  year        INT         NOT NULL,
+  month       INT         NOT NULL,
+  total_spent NUMERIC     NOT NULL DEFAULT 0,
+  updated_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, year, month, category)
+);
+
+COMMENT ON TABLE public.monthly_category_spend IS 'Suma de transacciones de tipo Gasto por usuario, categoría y mes (mantenida por trigger)';
+
+-- La app guarda los gastos con importe negativo: el acumulado suma ABS(amount) para que
+-- total_spent sea positivo y comparable directamente con budgets.amount.
+
+ALTER TABLE public.monthly_category_spend ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Usuarios leen su gasto mensual" ON public.monthly_category_spend;
+CREATE POLICY "Usuarios leen su gasto mensual"
+  ON public.monthly_category_spend FOR SELECT
+  USING (auth.uid() = user_id);
+
+-- Aplica un delta (positivo o negativo) al acumulado del mes de una transacción.
+CREATE OR REPLACE FUNCTION public.apply_monthly_category_spend_delta(
+  p_user_id UUID, p_category TEXT, p_date DATE, p_delta NUMERIC
+) RETURNS VOID
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  INSERT INTO public.monthly_category_spend AS s (user_id, category, year, month, total_spent, updated_at)
+  VALUES (p_user_id, p_category, EXTRACT(YEAR FROM p_date)::INT, EXTRACT(MONTH FROM p_date)::INT, p_delta, now())
+  ON CONFLICT (user_id, year, month, category)
+  DO UPDATE SET total_spent = s.total_spent + EXCLUDED.total_spent,
+                updated_at  = now();
+$$;
+
+CREATE OR REPLACE FUNCTION public.trg_transactions_monthly_category_spend()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  -- Restar la versión anterior de la fila (UPDATE/DELETE)...
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.type = 'Gasto' AND OLD.category IS NOT NULL THEN
+    PERFORM public.apply_monthly_category_spend_delta(OLD.user_id, OLD.category, OLD.transaction_date::DATE, -ABS(OLD.amount));
+  END IF;
+  -- ...y sumar la nueva (INSERT/UPDATE).
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.type = 'Gasto' AND NEW.category IS NOT NULL THEN
+    PERFORM public.apply_monthly_category_spend_delta(NEW.user_id, NEW.category, NEW.transaction_date::DATE, ABS(NEW.amount));
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS transactions_monthly_category_spend ON public.transactions;
+CREATE TRIGGER transactions_monthly_category_spend
+  AFTER INSERT OR UPDATE OF amount, type, category, transaction_date, user_id OR DELETE
+  ON public.transactions
+  FOR EACH ROW EXECUTE FUNCTION public.trg_transactions_monthly_category_spend();
+
+-- Backfill con el histórico existente.
+INSERT INTO public.monthly_category_spend (user_id, category, year, month, total_spent)
+SELECT user_id,
+       category,
+       EXTRACT(YEAR FROM transaction_date)::INT,
+       EXTRACT(MONTH FROM transaction_date)::INT,
+       SUM(ABS(amount))
+FROM public.transactions
+WHERE type = 'Gasto' AND category IS NOT NULL
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (user_id, year, month, category)
+DO UPDATE SET total_spent = EXCLUDED.total_spent, updated_at = now();
+
+-- Solo la usan los triggers (SECURITY DEFINER): no debe poder llamarse por /rpc.
+REVOKE ALL ON FUNCTION public.apply_monthly_category_spend_delta(UUID, TEXT, DATE, NUMERIC) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,83 @@
+-- Registro de entregas de recordatorios push: una fila por (usuario, tipo, origen, fecha).
+-- send_reminders.py reclama cada recordatorio insertando su fila antes de enviarlo
+-- (upsert con ON CONFLICT DO NOTHING): solo envía las filas que insertó él, así que
+-- reintentos, ejecuciones solapadas o varios workers en paralelo no duplican notificaciones.
+-- Si el envío falla (o la página se interrumpe) borra la fila para que se reintente.
+
+CREATE TABLE IF NOT EXISTS public.reminder_deliveries (
+  kind          TEXT        NOT NULL,  -- 'recurring_payment' | 'goal_saving'
+  source_id     TEXT        NOT NULL,  -- id de recurring_transactions / insights
+  delivery_date DATE        NOT NULL,  -- fecha de vencimiento (pagos) o de ejecución (metas)
+  user_id       UUID        NOT NULL,
+  delivered_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (kind, source_id, delivery_date, user_id)
+);
+
+COMMENT ON TABLE public.reminder_deliveries IS 'Recordatorios push ya enviados; evita duplicados entre ejecuciones del job';
+
+-- Solo la clave de servicio (job de recordatorios) accede a esta tabla.
+ALTER TABLE public.reminder_deliveries ENABLE ROW LEVEL SECURITY;
+
+CREATE INDEX IF NOT EXISTS idx_reminder_deliveries_delivered_at
+  ON public.reminder_deliveries (delivered_at);
+
+-- Pagos recurrentes que vencen en p_due_date y aún no tienen entrega registrada.
+-- Paginación por keyset: filas con id > p_after_id, ordenadas por id (UUID nativo, usa la PK).
+CREATE OR REPLACE FUNCTION public.pending_recurring_reminders(
+  p_due_date DATE, p_after_id TEXT DEFAULT NULL, p_limit INT DEFAULT 500
+) RETURNS TABLE (
+  id TEXT, user_id UUID, description TEXT, type TEXT, next_due_date DATE, fcm_token TEXT
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT rt.id::TEXT, rt.user_id, rt.description::TEXT, rt.type::TEXT, rt.next_due_date::DATE, p.fcm_token::TEXT
+  FROM public.recurring_transactions rt
+  JOIN public.profiles p ON p.id = rt.user_id
+  WHERE rt.next_due_date::DATE = p_due_date
+    AND p.fcm_token IS NOT NULL
+    AND (p_after_id IS NULL OR rt.id > p_after_id::UUID)
+    AND NOT EXISTS (
+      SELECT 1 FROM public.reminder_deliveries d
+      WHERE d.kind = 'recurring_payment'
+        AND d.source_id = rt.id::TEXT
+        AND d.delivery_date = p_due_date
+        AND d.user_id = rt.user_id
+    )
+  ORDER BY rt.id
+  LIMIT p_limit;
+$$;
+
+-- Insights 'goal_saving_reminder' sin leer y sin entrega registrada en p_run_date.
+CREATE OR REPLACE FUNCTION public.pending_goal_reminders(
+  p_run_date DATE, p_after_id TEXT DEFAULT NULL, p_limit INT DEFAULT 500
+) RETURNS TABLE (
+  id TEXT, user_id UUID, metadata JSONB, fcm_token TEXT
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT i.id::TEXT, i.user_id, i.metadata::JSONB, p.fcm_token::TEXT
+  FROM public.insights i
+  JOIN public.profiles p ON p.id = i.user_id
+  WHERE i.type = 'goal_saving_reminder'
+    AND i.is_read = FALSE
+    AND p.fcm_token IS NOT NULL
+    AND (p_after_id IS NULL OR i.id > p_after_id::UUID)
+    AND NOT EXISTS (
+      SELECT 1 FROM public.reminder_deliveries d
+      WHERE d.kind = 'goal_saving'
+        AND d.source_id = i.id::TEXT
+        AND d.delivery_date = p_run_date
+        AND d.user_id = i.user_id
+    )
+  ORDER BY i.id
+  LIMIT p_limit;
+$$;
+
+REVOKE ALL ON FUNCTION public.pending_recurring_reminders(DATE, TEXT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.pending_goal_reminders(DATE, TEXT, INT) FROM PUBLIC, anon, authenticated;
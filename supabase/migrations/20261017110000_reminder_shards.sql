@@ -0,0 +1,78 @@
+-- Reparto de los recordatorios entre N workers por hash de user_id.
+-- Cada worker llama a las RPC con (p_shard_index, p_shard_count) y solo recibe los usuarios
+-- de su partición, así que N procesos o instancias de cron se reparten el trabajo sin solaparse.
+-- Con los valores por defecto (0, 1) el comportamiento es el de antes.
+
+DROP FUNCTION IF EXISTS public.pending_recurring_reminders(DATE, TEXT, INT);
+DROP FUNCTION IF EXISTS public.pending_goal_reminders(DATE, TEXT, INT);
+
+-- Partición estable de un usuario (hashtext puede ser negativo: se normaliza a [0, n)).
+CREATE OR REPLACE FUNCTION public.user_shard(p_user_id UUID, p_shard_count INT)
+RETURNS INT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT (((hashtext(p_user_id::TEXT)::BIGINT % p_shard_count) + p_shard_count) % p_shard_count)::INT;
+$$;
+
+CREATE OR REPLACE FUNCTION public.pending_recurring_reminders(
+  p_due_date DATE, p_after_id TEXT DEFAULT NULL, p_limit INT DEFAULT 500,
+  p_shard_index INT DEFAULT 0, p_shard_count INT DEFAULT 1
+) RETURNS TABLE (
+  id TEXT, user_id UUID, description TEXT, type TEXT, next_due_date DATE, fcm_token TEXT
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT rt.id::TEXT, rt.user_id, rt.description::TEXT, rt.type::TEXT, rt.next_due_date::DATE, p.fcm_token::TEXT
+  FROM public.recurring_transactions rt
+  JOIN public.profiles p ON p.id = rt.user_id
+  WHERE rt.next_due_date::DATE = p_due_date
+    AND p.fcm_token IS NOT NULL
+    AND (p_shard_count <= 1 OR public.user_shard(rt.user_id, p_shard_count) = p_shard_index)
+    AND (p_after_id IS NULL OR rt.id > p_after_id::UUID)
+    AND NOT EXISTS (
+      SELECT 1 FROM public.reminder_deliveries d
+      WHERE d.kind = 'recurring_payment'
+        AND d.source_id = rt.id::TEXT
+        AND d.delivery_date = p_due_date
+        AND d.user_id = rt.user_id
+    )
+  ORDER BY rt.id
+  LIMIT p_limit;
+$$;
+
+CREATE OR REPLACE FUNCTION public.pending_goal_reminders(
+  p_run_date DATE, p_after_id TEXT DEFAULT NULL, p_limit INT DEFAULT 500,
+  p_shard_index INT DEFAULT 0, p_shard_count INT DEFAULT 1
+) RETURNS TABLE (
+  id TEXT, user_id UUID, metadata JSONB, fcm_token TEXT
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT i.id::TEXT, i.user_id, i.metadata::JSONB, p.fcm_token::TEXT
+  FROM public.insights i
+  JOIN public.profiles p ON p.id = i.user_id
+  WHERE i.type = 'goal_saving_reminder'
+    AND i.is_read = FALSE
+    AND p.fcm_token IS NOT NULL
+    AND (p_shard_count <= 1 OR public.user_shard(i.user_id, p_shard_count) = p_shard_index)
+    AND (p_after_id IS NULL OR i.id > p_after_id::UUID)
+    AND NOT EXISTS (
+      SELECT 1 FROM public.reminder_deliveries d
+      WHERE d.kind = 'goal_saving'
+        AND d.source_id = i.id::TEXT
+        AND d.delivery_date = p_run_date
+        AND d.user_id = i.user_id
+    )
+  ORDER BY i.id
+  LIMIT p_limit;
+$$;
+
+REVOKE ALL ON FUNCTION public.pending_recurring_reminders(DATE, TEXT, INT, INT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.pending_goal_reminders(DATE, TEXT, INT, INT, INT) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,171 @@
+-- Resumen financiero precalculado por usuario.
+-- Flujos de ingresos/gastos por mes y por semana, y conteo de ánimos por mes, mantenidos
+-- de forma incremental por trigger sobre 'transactions'. get_user_financial_summary()
+-- devuelve en una sola llamada lo que /api/analisis-financiero necesita: flujo del mes,
+-- totales por categoría (monthly_category_spend), deltas semanales, ánimo predominante y
+-- cuotas de compras a plazos activas.
+
+CREATE TABLE IF NOT EXISTS public.user_period_flow (
+  user_id      UUID    NOT NULL,
+  period_kind  TEXT    NOT NULL CHECK (period_kind IN ('month', 'week')),
+  period_start DATE    NOT NULL,
+  income       NUMERIC NOT NULL DEFAULT 0,
+  expense      NUMERIC NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, period_kind, period_start)
+);
+
+CREATE TABLE IF NOT EXISTS public.user_monthly_mood (
+  user_id      UUID NOT NULL,
+  period_start DATE NOT NULL,
+  mood         TEXT NOT NULL,
+  count        INT  NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, period_start, mood)
+);
+
+ALTER TABLE public.user_period_flow ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.user_monthly_mood ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Usuarios leen su flujo" ON public.user_period_flow;
+CREATE POLICY "Usuarios leen su flujo" ON public.user_period_flow FOR SELECT USING (auth.uid() = user_id);
+DROP POLICY IF EXISTS "Usuarios leen su ánimo" ON public.user_monthly_mood;
+CREATE POLICY "Usuarios leen su ánimo" ON public.user_monthly_mood FOR SELECT USING (auth.uid() = user_id);
+
+-- Las cuotas activas se leen directamente de 'transactions'; este índice parcial lo hace barato.
+CREATE INDEX IF NOT EXISTS idx_transactions_user_installments
+  ON public.transactions (user_id, transaction_date)
+  WHERE is_installment;
+
+-- Aplica una transacción (p_sign = 1 al sumar, -1 al restar) a los acumulados del usuario.
+CREATE OR REPLACE FUNCTION public.apply_user_flow_delta(
+  p_user_id UUID, p_type TEXT, p_date DATE, p_amount NUMERIC, p_mood TEXT, p_sign INT
+) RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_income  NUMERIC := CASE WHEN p_type = 'Ingreso' THEN p_sign * ABS(p_amount) ELSE 0 END;
+  v_expense NUMERIC := CASE WHEN p_type = 'Gasto'   THEN p_sign * ABS(p_amount) ELSE 0 END;
+BEGIN
+  IF v_income = 0 AND v_expense = 0 AND p_mood IS NULL THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO public.user_period_flow AS f (user_id, period_kind, period_start, income, expense)
+  VALUES (p_user_id, 'month', date_trunc('month', p_date)::DATE, v_income, v_expense),
+         (p_user_id, 'week',  date_trunc('week',  p_date)::DATE, v_income, v_expense)
+  ON CONFLICT (user_id, period_kind, period_start)
+  DO UPDATE SET income = f.income + EXCLUDED.income, expense = f.expense + EXCLUDED.expense;
+
+  IF p_mood IS NOT NULL AND p_type = 'Gasto' THEN
+    INSERT INTO public.user_monthly_mood AS m (user_id, period_start, mood, count)
+    VALUES (p_user_id, date_trunc('month', p_date)::DATE, p_mood, p_sign)
+    ON CONFLICT (user_id, period_start, mood)
+    DO UPDATE SET count = m.count + EXCLUDED.count;
+  END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.trg_transactions_user_flow()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.apply_user_flow_delta(OLD.user_id, OLD.type, OLD.transaction_date::DATE, OLD.amount, OLD.mood::TEXT, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.apply_user_flow_delta(NEW.user_id, NEW.type, NEW.transaction_date::DATE, NEW.amount, NEW.mood::TEXT, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS transactions_user_flow ON public.transactions;
+CREATE TRIGGER transactions_user_flow
+  AFTER INSERT OR UPDATE OF amount, type, transaction_date, user_id, mood OR DELETE
+  ON public.transactions
+  FOR EACH ROW EXECUTE FUNCTION public.trg_transactions_user_flow();
+
+-- Backfill con el histórico existente.
+INSERT INTO public.user_period_flow (user_id, period_kind, period_start, income, expense)
+SELECT user_id, kind, period_start,
+       SUM(CASE WHEN type = 'Ingreso' THEN ABS(amount) ELSE 0 END),
+       SUM(CASE WHEN type = 'Gasto'   THEN ABS(amount) ELSE 0 END)
+FROM (
+  SELECT user_id, type, amount, 'month' AS kind, date_trunc('month', transaction_date)::DATE AS period_start FROM public.transactions
+  UNION ALL
+  SELECT user_id, type, amount, 'week', date_trunc('week', transaction_date)::DATE FROM public.transactions
+) t
+WHERE type IN ('Ingreso', 'Gasto')
+GROUP BY 1, 2, 3
+ON CONFLICT (user_id, period_kind, period_start)
+DO UPDATE SET income = EXCLUDED.income, expense = EXCLUDED.expense;
+
+INSERT INTO public.user_monthly_mood (user_id, period_start, mood, count)
+SELECT user_id, date_trunc('month', transaction_date)::DATE, mood::TEXT, COUNT(*)
+FROM public.transactions
+WHERE type = 'Gasto' AND mood IS NOT NULL
+GROUP BY 1, 2, 3
+ON CONFLICT (user_id, period_start, mood) DO UPDATE SET count = EXCLUDED.count;
+
+-- Resumen completo en una sola llamada.
+CREATE OR REPLACE FUNCTION public.get_user_financial_summary(p_user_id UUID, p_weeks INT DEFAULT 6)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH month_flow AS (
+    SELECT period_start, income, expense
+    FROM public.user_period_flow
+    WHERE user_id = p_user_id AND period_kind = 'month'
+      AND period_start >= (date_trunc('month', current_date) - INTERVAL '1 month')::DATE
+  ),
+  weeks AS (
+    SELECT period_start, expense,
+           expense - LAG(expense) OVER (ORDER BY period_start) AS delta
+    FROM public.user_period_flow
+    WHERE user_id = p_user_id AND period_kind = 'week'
+      AND period_start >= (date_trunc('week', current_date) - make_interval(weeks => p_weeks))::DATE
+  ),
+  categories AS (
+    SELECT category, ABS(total_spent) AS total
+    FROM public.monthly_category_spend
+    WHERE user_id = p_user_id
+      AND year = EXTRACT(YEAR FROM current_date)::INT
+      AND month = EXTRACT(MONTH FROM current_date)::INT
+  ),
+  moods AS (
+    SELECT mood, count
+    FROM public.user_monthly_mood
+    WHERE user_id = p_user_id AND period_start = date_trunc('month', current_date)::DATE AND count > 0
+  ),
+  installments AS (
+    SELECT description, category,
+           ABS(amount) / GREATEST(COALESCE(installments_total, 1), 1) AS amount_per_installment,
+           GREATEST(COALESCE(installments_total, 1) - COALESCE(installments_current, 1) + 1, 0) AS remaining_installments
+    FROM public.transactions
+    WHERE user_id = p_user_id AND is_installment
+      AND COALESCE(installments_current, 1) <= COALESCE(installments_total, 1)
+  )
+  SELECT jsonb_build_object(
+    'month_income',   COALESCE((SELECT income  FROM month_flow WHERE period_start = date_trunc('month', current_date)::DATE), 0),
+    'month_expense',  COALESCE((SELECT expense FROM month_flow WHERE period_start = date_trunc('month', current_date)::DATE), 0),
+    'prev_month_income',  COALESCE((SELECT income  FROM month_flow WHERE period_start < date_trunc('month', current_date)::DATE), 0),
+    'prev_month_expense', COALESCE((SELECT expense FROM month_flow WHERE period_start < date_trunc('month', current_date)::DATE), 0),
+    'category_totals', COALESCE((SELECT jsonb_object_agg(category, total ORDER BY total DESC) FROM categories), '{}'::JSONB),
+    'weekly_expense',  COALESCE((SELECT jsonb_agg(jsonb_build_object('week', period_start, 'expense', expense, 'delta', delta) ORDER BY period_start) FROM weeks), '[]'::JSONB),
+    'predominant_mood', (SELECT mood FROM moods ORDER BY count DESC LIMIT 1),
+    'installments', COALESCE((SELECT jsonb_agg(to_jsonb(i)) FROM installments i WHERE remaining_installments > 0), '[]'::JSONB),
+    'monthly_installments', COALESCE((SELECT SUM(amount_per_installment) FROM installments WHERE remaining_installments > 0), 0)
+  );
+$$;
+
+-- Ambas son SECURITY DEFINER: apply_user_flow_delta solo la usa el trigger y el resumen
+-- lo pide el backend con la clave de servicio, así que ninguna se expone por /rpc.
+REVOKE ALL ON FUNCTION public.apply_user_flow_delta(UUID, TEXT, DATE, NUMERIC, TEXT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.get_user_financial_summary(UUID, INT) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,45 @@
+-- Análisis IA pregenerados por el job nocturno (finanzas_backend/pregenerate_analyses.py).
+-- Cada fila guarda el último análisis de un usuario junto con la huella (data_key) de los
+-- datos con los que se generó. /api/analisis-financiero lo sirve al instante si la huella
+-- coincide con la de los datos actuales; si el usuario registró algo después, genera en vivo.
+-- El backend lee la tabla con la clave de servicio; la política es para la app.
+
+CREATE TABLE IF NOT EXISTS public.precomputed_analyses (
+  user_id       UUID PRIMARY KEY,
+  data_key      TEXT        NOT NULL,
+  analysis      TEXT        NOT NULL,
+  model         TEXT,
+  prompt_tokens INT,
+  output_tokens INT,
+  generated_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+ALTER TABLE public.precomputed_analyses ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Usuarios leen su análisis" ON public.precomputed_analyses;
+CREATE POLICY "Usuarios leen su análisis" ON public.precomputed_analyses FOR SELECT USING (auth.uid() = user_id);
+
+-- Usuarios con movimientos desde p_since, recorridos por keyset sobre user_id y con la misma
+-- partición por hash que los recordatorios (user_shard). Se apoya en user_period_flow, que
+-- tiene una fila por usuario y semana con actividad, en lugar de escanear 'transactions'.
+CREATE OR REPLACE FUNCTION public.active_analysis_users(
+  p_since DATE, p_after_id TEXT DEFAULT NULL, p_limit INT DEFAULT 500,
+  p_shard_index INT DEFAULT 0, p_shard_count INT DEFAULT 1
+) RETURNS TABLE (id TEXT)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT DISTINCT f.user_id::TEXT
+  FROM public.user_period_flow f
+  WHERE f.period_kind = 'week'
+    AND f.period_start >= date_trunc('week', p_since)::DATE
+    AND (p_shard_count <= 1 OR public.user_shard(f.user_id, p_shard_count) = p_shard_index)
+    AND (p_after_id IS NULL OR f.user_id::TEXT > p_after_id)
+  ORDER BY 1
+  LIMIT p_limit;
+$$;
+
+-- SECURITY DEFINER y solo para el job (clave de servicio): no debe poder llamarse por /rpc.
+REVOKE ALL ON FUNCTION public.active_analysis_users(DATE, TEXT, INT, INT, INT) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,159 @@
+-- Insights diarios por lotes (finanzas_backend/generate_insights.py).
+-- La Edge Function generate-user-insights recorría todos los perfiles y, por usuario y tipo de
+-- insight, hacía una consulta de "insight reciente", una RPC y un insert. Ahora:
+--   - insight_candidates() calcula un tipo de insight para todos los usuarios con una sola
+--     consulta sobre los agregados (user_period_flow, monthly_category_spend) y las tablas base,
+--     paginada por user_id (keyset) y particionable con user_shard();
+--   - insert_insights_batch() inserta una página entera y descarta los repetidos con un único
+--     anti-join contra los insights recientes del mismo tipo y la misma clave (metadata.dedupe_key).
+
+-- Índice para el anti-join (usuario, tipo, fecha).
+CREATE INDEX IF NOT EXISTS idx_insights_user_type_created
+  ON public.insights (user_id, type, created_at DESC);
+
+-- Una fila por usuario con los elementos del tipo pedido (cada uno con su 'key' de deduplicación).
+CREATE OR REPLACE FUNCTION public.insight_candidates(
+  p_type TEXT, p_after_id TEXT DEFAULT NULL, p_limit INT DEFAULT 1000,
+  p_shard_index INT DEFAULT 0, p_shard_count INT DEFAULT 1
+) RETURNS TABLE (id TEXT, user_id UUID, items JSONB)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH periodo AS (
+    SELECT (date_trunc('week', current_date) - INTERVAL '1 week')::DATE  AS last_week,
+           (date_trunc('month', current_date) - INTERVAL '1 month')::DATE AS last_month,
+           EXTRACT(YEAR FROM current_date)::INT  AS year,
+           EXTRACT(MONTH FROM current_date)::INT AS month
+  ),
+  items AS (
+    -- Gasto de la última semana completa frente a la anterior (cambio de más del 10%).
+    SELECT c.user_id,
+           jsonb_build_object('key', c.period_start, 'current', c.expense, 'previous', p.expense,
+                              'percentage_change', ROUND((c.expense - p.expense) / p.expense * 100, 1)) AS item
+    FROM periodo, public.user_period_flow c
+    JOIN public.user_period_flow p
+      ON p.user_id = c.user_id AND p.period_kind = 'week' AND p.period_start = c.period_start - 7
+    WHERE p_type = 'weekly_spending_comparison'
+      AND c.period_kind = 'week' AND c.period_start = periodo.last_week
+      AND p.expense > 0 AND ABS(c.expense - p.expense) > 0.10 * p.expense
+
+    UNION ALL
+    -- Categoría de mayor gasto del mes en curso.
+    SELECT * FROM (
+      SELECT DISTINCT ON (s.user_id) s.user_id,
+             jsonb_build_object('key', periodo.year || '-' || periodo.month, 'category', s.category,
+                                'total_spent', ABS(s.total_spent))
+      FROM periodo, public.monthly_category_spend s
+      WHERE p_type = 'top_spending_category'
+        AND s.year = periodo.year AND s.month = periodo.month AND s.total_spent <> 0
+      ORDER BY s.user_id, ABS(s.total_spent) DESC
+    ) top
+
+    UNION ALL
+    -- Ahorro (ingresos - gastos) del último mes completo frente al anterior.
+    SELECT c.user_id,
+           jsonb_build_object('key', c.period_start, 'savings', c.income - c.expense,
+                              'previous_savings', p.income - p.expense)
+    FROM periodo, public.user_period_flow c
+    JOIN public.user_period_flow p
+      ON p.user_id = c.user_id AND p.period_kind = 'month'
+     AND p.period_start = (c.period_start - INTERVAL '1 month')::DATE
+    WHERE p_type = 'monthly_savings_comparison'
+      AND c.period_kind = 'month' AND c.period_start = periodo.last_month
+      AND (p.income > 0 OR p.expense > 0)
+
+    UNION ALL
+    -- Presupuestos del mes con el gasto acumulado ya por encima del importe.
+    SELECT b.user_id,
+           jsonb_build_object('key', 'budget:' || b.id || ':' || b.year || '-' || b.month, 'budget_id', b.id,
+                              'category', b.category, 'amount', b.amount, 'spent', ABS(s.total_spent))
+    FROM periodo, public.budgets b
+    JOIN public.monthly_category_spend s
+      ON s.user_id = b.user_id AND s.year = b.year AND s.month = b.month AND s.category = b.category
+    WHERE p_type = 'budget_exceeded'
+      AND b.year = periodo.year AND b.month = periodo.month
+      AND b.amount > 0 AND ABS(s.total_spent) >= b.amount
+
+    UNION ALL
+    -- Pagos recurrentes que vencen en los próximos 3 días.
+    SELECT rt.user_id,
+           jsonb_build_object('key', rt.id || ':' || rt.next_due_date::DATE, 'description', rt.description,
+                              'amount', rt.amount, 'next_due_date', rt.next_due_date::DATE)
+    FROM public.recurring_transactions rt
+    WHERE p_type = 'upcoming_payment'
+      AND rt.next_due_date::DATE BETWEEN current_date AND current_date + 3
+
+    UNION ALL
+    -- Cuentas activas (no tarjetas de crédito) con saldo por debajo de 50.
+    SELECT a.user_id,
+           jsonb_build_object('key', a.id, 'account_name', a.name, 'current_balance', a.balance)
+    FROM public.accounts a
+    WHERE p_type = 'low_balance_warning'
+      AND a.status = 'active' AND a.type <> 'Tarjeta de Crédito' AND a.balance < 50
+
+    UNION ALL
+    -- Mayor hito (25/50/75/90 %) superado por cada meta activa.
+    SELECT g.user_id,
+           jsonb_build_object('key', g.id || ':' || m.milestone, 'goal_name', g.name, 'milestone', m.milestone)
+    FROM public.goals g
+    CROSS JOIN LATERAL (
+      SELECT MAX(h) AS milestone
+      FROM unnest(ARRAY[25, 50, 75, 90]) AS h
+      WHERE g.current_amount * 100 >= g.target_amount * h
+    ) m
+    WHERE p_type = 'goal_milestone'
+      AND g.status = 'active' AND g.target_amount > 0
+      AND g.current_amount < g.target_amount AND m.milestone IS NOT NULL
+  )
+  SELECT i.user_id::TEXT, i.user_id, jsonb_agg(i.item ORDER BY i.item->>'key')
+  FROM items i
+  WHERE (p_shard_count <= 1 OR public.user_shard(i.user_id, p_shard_count) = p_shard_index)
+    AND (p_after_id IS NULL OR i.user_id::TEXT > p_after_id)
+  GROUP BY i.user_id
+  ORDER BY 1
+  LIMIT p_limit;
+$$;
+
+-- Inserta una página de insights y devuelve cuántos se insertaron. Un insight se descarta si
+-- el usuario ya tiene uno del mismo tipo y clave creado dentro de su ventana (dedupe_days).
+-- Los insights anteriores a este motor no tienen dedupe_key: como mucho se repite uno por
+-- clave el primer día.
+CREATE OR REPLACE FUNCTION public.insert_insights_batch(p_rows JSONB)
+RETURNS INT
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH nuevos AS (
+    SELECT *
+    FROM jsonb_to_recordset(p_rows) AS r(
+      user_id UUID, type TEXT, severity TEXT, title TEXT, description TEXT,
+      metadata JSONB, dedupe_key TEXT, dedupe_days INT
+    )
+  ),
+  insertados AS (
+    INSERT INTO public.insights (user_id, type, severity, title, description, metadata)
+    SELECT n.user_id, n.type, n.severity, n.title, n.description,
+           COALESCE(n.metadata, '{}'::JSONB) || jsonb_build_object('dedupe_key', n.dedupe_key)
+    FROM nuevos n
+    WHERE NOT EXISTS (
+      SELECT 1 FROM public.insights i
+      WHERE i.user_id = n.user_id
+        AND i.type = n.type
+        AND i.created_at >= now() - make_interval(days => n.dedupe_days)
+        AND i.metadata->>'dedupe_key' = n.dedupe_key
+    )
+    RETURNING 1
+  )
+  SELECT COUNT(*)::INT FROM insertados;
+$$;
+
+REVOKE ALL ON FUNCTION public.insight_candidates(TEXT, TEXT, INT, INT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.insert_insights_batch(JSONB) FROM PUBLIC, anon, authenticated;
+
+-- El job diario pasa a ser generate_insights.py (mismo cron externo que los recordatorios,
+-- 05:00 UTC). Se retira la llamada de pg_cron a la Edge Function para no generar dos veces.
+SELECT cron.unschedule('daily-insight-generation')
+WHERE EXISTS (SELECT 1 FROM cron.job WHERE jobname = 'daily-insight-generation');
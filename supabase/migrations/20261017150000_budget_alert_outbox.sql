@@ -0,0 +1,98 @@
+-- Alertas de presupuesto dirigidas por eventos.
+-- Antes solo se evaluaban si la app llamaba a /check-budget-on-transaction tras insertar la
+-- transacción, y el envío a FCM iba dentro de la petición. Ahora un trigger de sentencia sobre
+-- 'transactions' deja un evento (usuario, categoría, mes) en 'budget_alert_outbox' y el
+-- consumidor finanzas_backend/budget_alert_consumer.py los reclama por lotes con SKIP LOCKED,
+-- los agrupa, evalúa los presupuestos una vez por lote y envía las alertas.
+
+CREATE TABLE IF NOT EXISTS public.budget_alert_outbox (
+  id          BIGSERIAL   PRIMARY KEY,
+  user_id     UUID        NOT NULL,
+  category    TEXT        NOT NULL,
+  year        INT         NOT NULL,
+  month       INT         NOT NULL,
+  created_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  claimed_at  TIMESTAMPTZ,
+  claimed_by  TEXT,
+  attempts    INT         NOT NULL DEFAULT 0
+);
+
+COMMENT ON TABLE public.budget_alert_outbox IS 'Eventos de gasto pendientes de evaluar contra los presupuestos (los consume budget_alert_consumer.py)';
+
+-- Sin políticas: solo la clave de servicio (el consumidor) accede a la tabla.
+ALTER TABLE public.budget_alert_outbox ENABLE ROW LEVEL SECURITY;
+
+-- Una fila por (usuario, categoría, mes) y sentencia: una importación de 500 gastos de la misma
+-- categoría deja un solo evento. Solo cuentan los gastos del mes en curso (los únicos que alertan).
+CREATE OR REPLACE FUNCTION public.trg_transactions_budget_alert_outbox()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO public.budget_alert_outbox (user_id, category, year, month)
+  SELECT DISTINCT n.user_id, n.category,
+         EXTRACT(YEAR FROM n.transaction_date)::INT, EXTRACT(MONTH FROM n.transaction_date)::INT
+  FROM new_rows n
+  WHERE n.type = 'Gasto'
+    AND n.category IS NOT NULL
+    AND date_trunc('month', n.transaction_date) = date_trunc('month', current_date);
+  RETURN NULL;
+END;
+$$;
+
+-- Las tablas de transición solo admiten un evento por trigger: uno para INSERT y otro para UPDATE.
+DROP TRIGGER IF EXISTS transactions_budget_alert_outbox_insert ON public.transactions;
+CREATE TRIGGER transactions_budget_alert_outbox_insert
+  AFTER INSERT ON public.transactions
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.trg_transactions_budget_alert_outbox();
+
+DROP TRIGGER IF EXISTS transactions_budget_alert_outbox_update ON public.transactions;
+CREATE TRIGGER transactions_budget_alert_outbox_update
+  AFTER UPDATE ON public.transactions
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.trg_transactions_budget_alert_outbox();
+
+-- Reclama hasta p_limit eventos pendientes. SKIP LOCKED permite varios consumidores sin que se
+-- pisen; un evento reclamado y no completado en p_lease_seconds (consumidor caído) se vuelve a
+-- ofrecer. Tras p_max_attempts intentos se deja de ofrecer y queda en la tabla para revisarlo.
+CREATE OR REPLACE FUNCTION public.claim_budget_alert_events(
+  p_consumer TEXT, p_limit INT DEFAULT 500, p_lease_seconds INT DEFAULT 120, p_max_attempts INT DEFAULT 5
+) RETURNS TABLE (id BIGINT, user_id UUID, category TEXT, year INT, month INT)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.budget_alert_outbox o
+  SET claimed_at = now(), claimed_by = p_consumer, attempts = o.attempts + 1
+  WHERE o.id IN (
+    SELECT e.id
+    FROM public.budget_alert_outbox e
+    WHERE (e.claimed_at IS NULL OR e.claimed_at < now() - make_interval(secs => p_lease_seconds))
+      AND e.attempts < p_max_attempts
+    ORDER BY e.id
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING o.id, o.user_id, o.category, o.year, o.month;
+$$;
+
+-- Borra los eventos ya procesados (solo los que sigue teniendo reclamados este consumidor).
+CREATE OR REPLACE FUNCTION public.complete_budget_alert_events(p_consumer TEXT, p_ids BIGINT[])
+RETURNS INT
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH borrados AS (
+    DELETE FROM public.budget_alert_outbox
+    WHERE id = ANY(p_ids) AND claimed_by = p_consumer
+    RETURNING 1
+  )
+  SELECT COUNT(*)::INT FROM borrados;
+$$;
+
+REVOKE ALL ON FUNCTION public.claim_budget_alert_events(TEXT, INT, INT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.complete_budget_alert_events(TEXT, BIGINT[]) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,95 @@
+-- Importación masiva de extractos (POST /api/transactions/import).
+-- Antes, importar un extracto era un insert por transacción desde la app y una llamada a
+-- /check-budget-on-transaction por cada una. Ahora el backend inserta por lotes multi-fila y:
+--   - cada fila importada lleva una huella (import_hash) única por usuario, así que reimportar
+--     el mismo extracto, o uno que se solapa, no duplica movimientos (ON CONFLICT DO NOTHING);
+--   - el acumulado monthly_category_spend se actualiza una vez por sentencia (agregado por
+--     usuario/categoría/mes) en lugar de una vez por fila insertada;
+--   - las filas importadas no generan eventos de alerta por lote: el endpoint encola uno por
+--     categoría afectada al terminar, con enqueue_budget_alert_events().
+
+ALTER TABLE public.transactions ADD COLUMN IF NOT EXISTS import_hash TEXT;
+
+COMMENT ON COLUMN public.transactions.import_hash IS 'Huella de la fila del extracto importado (NULL en las transacciones creadas desde la app)';
+
+-- Los NULL no colisionan entre sí: las transacciones manuales no se ven afectadas.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_transactions_user_import_hash
+  ON public.transactions (user_id, import_hash);
+
+-- --- monthly_category_spend: INSERT por sentencia, UPDATE/DELETE por fila ---
+
+CREATE OR REPLACE FUNCTION public.trg_transactions_monthly_category_spend_insert()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO public.monthly_category_spend AS s (user_id, category, year, month, total_spent, updated_at)
+  SELECT n.user_id, n.category,
+         EXTRACT(YEAR FROM n.transaction_date)::INT, EXTRACT(MONTH FROM n.transaction_date)::INT,
+         SUM(ABS(n.amount)), now()
+  FROM new_rows n
+  WHERE n.type = 'Gasto' AND n.category IS NOT NULL
+  GROUP BY 1, 2, 3, 4
+  ON CONFLICT (user_id, year, month, category)
+  DO UPDATE SET total_spent = s.total_spent + EXCLUDED.total_spent,
+                updated_at  = now();
+  RETURN NULL;
+END;
+$$;
+
+-- El trigger por fila sigue cubriendo UPDATE (con lista de columnas, incompatible con tablas
+-- de transición) y DELETE; los INSERT pasan al trigger de sentencia.
+DROP TRIGGER IF EXISTS transactions_monthly_category_spend ON public.transactions;
+CREATE TRIGGER transactions_monthly_category_spend
+  AFTER UPDATE OF amount, type, category, transaction_date, user_id OR DELETE
+  ON public.transactions
+  FOR EACH ROW EXECUTE FUNCTION public.trg_transactions_monthly_category_spend();
+
+DROP TRIGGER IF EXISTS transactions_monthly_category_spend_insert ON public.transactions;
+CREATE TRIGGER transactions_monthly_category_spend_insert
+  AFTER INSERT ON public.transactions
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.trg_transactions_monthly_category_spend_insert();
+
+-- --- budget_alert_outbox: los INSERT importados los encola el endpoint al terminar ---
+
+CREATE OR REPLACE FUNCTION public.trg_transactions_budget_alert_outbox()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO public.budget_alert_outbox (user_id, category, year, month)
+  SELECT DISTINCT n.user_id, n.category,
+         EXTRACT(YEAR FROM n.transaction_date)::INT, EXTRACT(MONTH FROM n.transaction_date)::INT
+  FROM new_rows n
+  WHERE n.type = 'Gasto'
+    AND n.category IS NOT NULL
+    AND (TG_OP = 'UPDATE' OR n.import_hash IS NULL)
+    AND date_trunc('month', n.transaction_date) = date_trunc('month', current_date);
+  RETURN NULL;
+END;
+$$;
+
+-- Un evento por categoría del mes en curso; el consumidor las evalúa juntas en su siguiente lote.
+CREATE OR REPLACE FUNCTION public.enqueue_budget_alert_events(p_user_id UUID, p_categories TEXT[])
+RETURNS INT
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH encolados AS (
+    INSERT INTO public.budget_alert_outbox (user_id, category, year, month)
+    SELECT DISTINCT p_user_id, c, EXTRACT(YEAR FROM current_date)::INT, EXTRACT(MONTH FROM current_date)::INT
+    FROM unnest(p_categories) AS c
+    WHERE c IS NOT NULL
+    RETURNING 1
+  )
+  SELECT COUNT(*)::INT FROM encolados;
+$$;
+
+-- Solo la llama el backend con la clave de servicio (SECURITY DEFINER: no se expone por /rpc).
+REVOKE ALL ON FUNCTION public.enqueue_budget_alert_events(UUID, TEXT[]) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,74 @@
+-- Último umbral de presupuesto notificado por (usuario, categoría, mes).
+-- budget_alert_consumer.py solo avisa cuando el gasto cruza un umbral (80% o 100%) por encima
+-- del último notificado: sin este estado, cada gasto nuevo en una categoría que ya pasó del
+-- 80% repetía la notificación. Si el gasto vuelve a bajar (se borra o corrige un gasto), el
+-- estado baja con él y un nuevo cruce vuelve a avisar.
+
+CREATE TABLE IF NOT EXISTS public.budget_alert_state (
+  user_id     UUID        NOT NULL,
+  category    TEXT        NOT NULL,
+  year        INT         NOT NULL,
+  month       INT         NOT NULL,
+  threshold   INT         NOT NULL,  -- 0 | 80 | 100
+  updated_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, category, year, month)
+);
+
+COMMENT ON TABLE public.budget_alert_state IS 'Último umbral de presupuesto notificado por usuario, categoría y mes (lo mantiene budget_alert_consumer.py)';
+
+-- Sin políticas: solo la clave de servicio (el consumidor) accede a la tabla.
+ALTER TABLE public.budget_alert_state ENABLE ROW LEVEL SECURITY;
+
+-- Registra el umbral actual de cada presupuesto evaluado
+-- (p_rows: [{user_id, category, year, month, threshold}], threshold 0 por debajo del 80%) y
+-- devuelve solo los que subieron de umbral: son los que hay que notificar. El upsert bloquea
+-- la fila, así que si dos consumidores evalúan el mismo presupuesto a la vez solo uno lo recibe.
+CREATE OR REPLACE FUNCTION public.claim_budget_alert_thresholds(p_rows JSONB)
+RETURNS TABLE (user_id UUID, category TEXT, threshold INT)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+#variable_conflict use_column
+BEGIN
+  -- Bajadas: el gasto volvió por debajo del umbral notificado. No se avisa.
+  UPDATE public.budget_alert_state s
+  SET threshold = r.threshold, updated_at = now()
+  FROM jsonb_to_recordset(p_rows) AS r(user_id UUID, category TEXT, year INT, month INT, threshold INT)
+  WHERE (s.user_id, s.category, s.year, s.month) = (r.user_id, r.category, r.year, r.month)
+    AND r.threshold < s.threshold;
+
+  -- Subidas (o primer cruce del mes): se registran y se devuelven para notificarlas.
+  RETURN QUERY
+  INSERT INTO public.budget_alert_state AS s (user_id, category, year, month, threshold)
+  SELECT r.user_id, r.category, r.year, r.month, r.threshold
+  FROM jsonb_to_recordset(p_rows) AS r(user_id UUID, category TEXT, year INT, month INT, threshold INT)
+  WHERE r.threshold > 0
+  ON CONFLICT (user_id, category, year, month) DO UPDATE
+    SET threshold = EXCLUDED.threshold, updated_at = now()
+    WHERE s.threshold < EXCLUDED.threshold
+  RETURNING s.user_id, s.category, s.threshold;
+END;
+$$;
+
+-- Deshace cruces cuya notificación no llegó a enviarse: baja el estado un umbral (100 -> 80,
+-- 80 -> 0) si nadie lo cambió entretanto, para que la siguiente evaluación vuelva a avisar.
+CREATE OR REPLACE FUNCTION public.release_budget_alert_thresholds(p_rows JSONB)
+RETURNS INT
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH liberados AS (
+    UPDATE public.budget_alert_state s
+    SET threshold = CASE WHEN r.threshold >= 100 THEN 80 ELSE 0 END, updated_at = now()
+    FROM jsonb_to_recordset(p_rows) AS r(user_id UUID, category TEXT, year INT, month INT, threshold INT)
+    WHERE (s.user_id, s.category, s.year, s.month) = (r.user_id, r.category, r.year, r.month)
+      AND s.threshold = r.threshold
+    RETURNING 1
+  )
+  SELECT COUNT(*)::INT FROM liberados;
+$$;
+
+REVOKE ALL ON FUNCTION public.claim_budget_alert_thresholds(JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.release_budget_alert_thresholds(JSONB) FROM PUBLIC, anon, authenticated;